@@ -5,6 +5,7 @@
 
 from agavepy.agave import Agave, load_resource
 from django.conf import settings
+from designsafe.apps.auth.clients import PooledAgave, registry
 
 AGAVE_RESOURCES = load_resource(getattr(settings, 'AGAVE_TENANT_BASEURL'))
 
@@ -19,9 +20,10 @@ def get_service_account_client():
              There might be some issues because of permissionas,
              but it might be a bit safer."""
 
-    return Agave(api_server=settings.AGAVE_TENANT_BASEURL,
-                 token=settings.AGAVE_SUPER_TOKEN,
-                 resources=AGAVE_RESOURCES)
+    return registry.get('__service_account__', settings.AGAVE_SUPER_TOKEN,
+                        lambda: PooledAgave(api_server=settings.AGAVE_TENANT_BASEURL,
+                                            token=settings.AGAVE_SUPER_TOKEN,
+                                            resources=AGAVE_RESOURCES))
 
 
 def to_camel_case(snake_str):
@@ -5,7 +5,8 @@ from designsafe.apps.api.agave.filemanager.base import BaseFileManager
 from designsafe.apps.data.models.agave.files import (BaseFileResource,
                                                     BaseFilePermissionResource,
                                                     BaseAgaveFileHistoryRecord)
-from designsafe.apps.api.tasks import reindex_agave
+from designsafe.apps.data.models.changes import FileChange
+from designsafe.apps.data.models.shares import SharedRoot
 from requests import HTTPError
 import logging
 
@@ -13,10 +14,12 @@ logger = logging.getLogger(__name__)
 
 
 class AgaveFileManager(BaseFileManager):
-    """
-    TODO !!
+    """Agave file manager.
 
-    trigger celery indexing tasks on CRUD operations
+    Every operation records a
+    :class:`~designsafe.apps.data.models.changes.FileChange` which is
+    later applied to the files index by
+    :func:`~designsafe.apps.data.tasks.apply_file_changes`.
     """
 
     DEFAULT_SYSTEM_ID = 'designsafe.storage.default'
@@ -54,9 +57,8 @@ class AgaveFileManager(BaseFileManager):
         f = BaseFileResource.listing(self._ag, system, file_path)
         res = f.import_data(from_system, from_file_path)
         file_name = from_file_path.split('/')[-1]
-        reindex_agave.apply_async(kwargs={'username': 'ds_admin',
-                                          'file_id': '{}/{}'.format(system, os.path.join(file_path, file_name))},
-                                  queue='indexing')
+        FileChange.record(FileChange.CREATE, system,
+                          os.path.join(file_path, file_name))
         return res
 
     def copy(self, system, file_path, dest_path=None, dest_name=None):
@@ -76,20 +78,14 @@ class AgaveFileManager(BaseFileManager):
 
         copied_file = f.copy(dest_path, dest_name)
 
-        # schedule celery task to index new copy
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}/{}'.format(system, dest_path.strip('/'), dest_name)},
-                                  queue='indexing')
+        FileChange.record(FileChange.CREATE, system,
+                          os.path.join(dest_path, dest_name))
 
         return copied_file
 
     def delete(self, system, path):
         resp = BaseFileResource(self._ag, system, path).delete()
-        parent_path = '/'.join(path.strip('/').split('/')[:-1])
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, parent_path),
-                                            'levels': 1}, 
-                                            queue='indexing')
+        FileChange.record(FileChange.DELETE, system, path)
         return resp
 
     def download(self, system, path):
@@ -113,34 +109,23 @@ class AgaveFileManager(BaseFileManager):
     def mkdir(self, system, file_path, dir_name):
         f = BaseFileResource(self._ag, system, file_path)
         resp = f.mkdir(dir_name)
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, file_path)},
-                                            queue='indexing')
+        FileChange.record(FileChange.CREATE, system,
+                          os.path.join(file_path, dir_name))
         return resp
 
     def move(self, system, file_path, dest_path, dest_name=None):
         f = BaseFileResource.listing(self._ag, system, file_path)
         resp = f.move(dest_path, dest_name)
-        parent_path = '/'.join(file_path.strip('/').split('/')[:-1])
-        parent_path = parent_path.strip('/') or '/'
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, parent_path),
-                                            'levels': 1},
-                                            queue='indexing')
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, os.path.join(dest_path, resp.name)),
-                                            'levels': 1},
-                                            queue='indexing')
+        FileChange.record(FileChange.MOVE, system, file_path,
+                          os.path.join(dest_path, resp.name))
         return resp
 
     def rename(self, system, file_path, rename_to):
         f = BaseFileResource.listing(self._ag, system, file_path)
         resp = f.rename(rename_to)
         parent_path = '/'.join(file_path.strip('/').split('/')[:-1])
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, parent_path),
-                                            'levels': 1},
-                                            queue='indexing')
+        FileChange.record(FileChange.MOVE, system, file_path,
+                          os.path.join(parent_path, rename_to))
         return resp
 
     def share(self, system, file_path, username, permission):
@@ -150,9 +135,8 @@ class AgaveFileManager(BaseFileManager):
         pem.username = username
         pem.permission_bit = permission
         resp = pem.save()
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, file_path)},
-                                            queue='indexing')
+        FileChange.record(FileChange.PEMS, system, file_path)
+        SharedRoot.record_share(system, file_path, username, permission)
         return resp
 
     def trash(self, system, file_path, trash_path):
@@ -177,23 +161,13 @@ class AgaveFileManager(BaseFileManager):
                 raise
 
         resp = f.move(trash_path, name)
-        parent_path = '/'.join(file_path.strip('/').split('/')[:-1])
-        parent_path = parent_path.strip('/') or '/'
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, trash_path),
-                                            'levels': 1},
-                                            queue='indexing')
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, parent_path),
-                                            'levels': 1},
-                                            queue='indexing')
+        FileChange.record(FileChange.MOVE, system, file_path,
+                          os.path.join(trash_path, name))
         return resp
 
     def upload(self, system, file_path, upload_file):
         f = BaseFileResource(self._ag, system, file_path)
         resp = f.upload(upload_file)
-        reindex_agave.apply_async(kwargs = {'username': 'ds_admin',
-                                            'file_id': '{}/{}'.format(system, file_path),
-                                            'levels': 1},
-                                            queue='indexing')
+        FileChange.record(FileChange.CREATE, system,
+                          os.path.join(file_path, upload_file.name))
         return resp
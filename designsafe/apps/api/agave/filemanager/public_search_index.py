@@ -478,15 +478,18 @@ class PublicElasticFileManager(BaseFileManager):
 
     def search(self, system, query_string,
                file_path=None, offset=0, limit=100, sort=None):
-        files_limit = limit
-        files_offset = offset
-        projects_limit = limit
-        projects_offset = offset
-        projects_search = PublicProjectIndexed.search()
-
+        """Searches public projects and files.
+
+        Projects and files are searched with a single query over both doc
+        types, projects sorted first. This way a page that spans projects
+        and files comes from one result set. The root folder of every
+        project in the page is resolved with a single `terms` query.
+        A search costs two queries regardless of the page size.
+        """
         projects_query = Q('bool',
                            filter=Q('bool',
-                                    must=Q({'term': {'systemId': system}}),
+                                    must=[Q({'type': {'value': PublicProjectIndexed._doc_type.name}}),
+                                          Q({'term': {'systemId': system}})],
                                     must_not=Q({'term': {'path._exact': '/'}})),
                            must=Q({'simple_query_string':{
                                     'query': query_string,
@@ -502,71 +505,46 @@ class PublicElasticFileManager(BaseFileManager):
                                                "pis.firstName",
                                                "pis.lastName",
                                                "title"]}}))
-        projects_search.query = projects_query
-        if sort:
-            projects_search = projects_search.sort(sort)
-        else:
-            projects_search = projects_search.sort('name._exact')
-
-        t1 = datetime.datetime.now()
-        projects_res = projects_search.execute()
-        logger.debug(datetime.datetime.now() - t1)
-        files_search = PublicObjectIndexed.search()
-
         files_query = Q('bool',
                         must=Q({'simple_query_string': {
                                  'query': query_string,
                                  'fields': ['name']}}),
                         filter=Q('bool',
-                                 must=Q({'term': {'systemId': system}}),
+                                 must=[Q({'type': {'value': PublicObjectIndexed._doc_type.name}}),
+                                       Q({'term': {'systemId': system}})],
                                  must_not=Q({'term': {'path._exact': '/'}})))
-        files_search.query = files_query
 
+        search = PublicProjectIndexed.search().doc_type(PublicObjectIndexed)
+        search.query = Q('bool', should=[projects_query, files_query],
+                         minimum_should_match=1)
+        # 'project' sorts after 'object', descending order lists projects first.
+        search = search.sort({'_type': {'order': 'desc'}},
+                             sort or 'name._exact')
         t1 = datetime.datetime.now()
-        files_res = files_search.execute()
+        res = search[offset:offset + limit].execute()
         logger.debug(datetime.datetime.now() - t1)
-        if projects_res.hits.total:
-            if projects_res.hits.total - offset > limit:
-                files_offset = 0
-                files_limit = 0
-            elif projects_res.hits.total - offset < 0:
-                projects_offset = 0
-                projects_limit = 0
-            else:
-                projects_limit = projects_res.hits.total
-                files_limit = limit - projects_limit
 
-        # TODO: This is rather SLOW
+        project_paths = [hit.projectPath for hit in res
+                         if isinstance(hit, PublicProjectIndexed)]
+        roots = {}
+        if project_paths:
+            roots_search = PublicObjectIndexed.search()
+            roots_search.query = Q('bool',
+                                   must=[
+                                       Q({'term': {'path._exact': '/'}}),
+                                       Q({'terms': {'name._exact': project_paths}}),
+                                       Q({'term': {'systemId': system}})])
+            roots_res = roots_search[0:len(project_paths)].execute()
+            roots = dict((root.name, root) for root in roots_res)
+
         children = []
-        project_paths = [p.projectPath for p in projects_res]
-        for project in projects_search[projects_offset:projects_limit]:
-            logger.debug(project)
-            search = PublicObjectIndexed.search()
-            search.query = Q('bool',
-                             must=[
-                                Q({'term': {'path._exact': '/'}}),
-                                Q({'term': {'name._exact': project.projectPath}}),
-                                Q({'term': {'systemId': system}})])
-            res = search.execute()
-            print res
-            if res.hits.total:
-                children.append(PublicObject(res[0]).to_dict())
-        # search = PublicObjectIndexed.search()
-        # search.query = Q('bool',
-        #     must=[
-        #         Q({'term': {'path._exact': '/'}}),
-        #         Q({'terms': {'name._exact': project_paths}}),
-        #         Q({'term': {'systemId': system}})
-        #     ])
-        # res = search.execute()
-        # logger.debug(datetime.datetime.now() - t1)
-
-        # for r in res[projects_offset:projects_limit]:
-        #     children.append(PublicObject(r).to_dict())
-
-        for file_doc in files_search[files_offset:files_limit]:
-            logger.debug(file_doc)
-            children.append(PublicObject(file_doc).to_dict())
+        for hit in res:
+            if isinstance(hit, PublicProjectIndexed):
+                root = roots.get(hit.projectPath)
+                if root is not None:
+                    children.append(PublicObject(root).to_dict())
+            else:
+                children.append(PublicObject(hit).to_dict())
         logger.debug(datetime.datetime.now() - t1)
         result = {
             'trail': [{'name': '$SEARCH', 'path': '/$SEARCH'}],
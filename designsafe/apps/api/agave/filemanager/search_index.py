@@ -8,6 +8,7 @@ from elasticsearch import TransportError, ConnectionTimeout
 from elasticsearch_dsl.query import Q
 from elasticsearch_dsl import Search, DocType
 from elasticsearch_dsl.connections import connections
+from designsafe.apps.data.models.shares import SharedRoot
 from .base import BaseFileManager
 
 
@@ -215,23 +216,85 @@ class ElasticFileManager(BaseFileManager):
         return None
 
     @staticmethod
-    def listing(system, file_path, user_context):
+    def shared_listing(system, user_context, offset=0, limit=100):
+        """Lists the files shared with a user (`$SHARE`)
+
+        The top-most paths shared with the user or with ``WORLD``, outside
+        of the user's home, are read from
+        :meth:`~designsafe.apps.data.models.shares.SharedRoot.shared_paths`
+        and their documents are retrieved with a single bounded search.
+
+        :param str system: system id
+        :param str user_context: username
+        :param int offset: offset
+        :param int limit: limit
+        """
+        result = {
+            'trail': [{'name': '$SHARE', 'path': '/$SHARE'}],
+            'name': '$SHARE',
+            'path': '/$SHARE',
+            'system': system,
+            'type': 'dir',
+            'children': [],
+            'permissions': 'NONE'
+        }
+        roots = SharedRoot.shared_paths(system, user_context,
+                                        offset=offset, limit=limit)
+        if not roots:
+            return result
+
+        files_q = []
+        for root in roots:
+            path, name = os.path.split(root)
+            files_q.append(Q('bool', must=[
+                Q('term', **{'path._exact': path or '/'}),
+                Q('term', **{'name._exact': name})
+            ]))
+        username_q = Q('term', **{'permissions.username': user_context})
+        world_q = Q('term', **{'permissions.username': 'WORLD'})
+        pems_filter = Q('bool')
+        pems_filter.should = [username_q, world_q]
+        nested_filter = Q('nested')
+        nested_filter.path = 'permissions'
+        nested_filter.query = pems_filter
+        query = Q('bool',
+                  must=Q('term', **{'system._exact': system}),
+                  should=files_q,
+                  minimum_should_match=1,
+                  filter=nested_filter)
+        search = IndexedFile.search()
+        search.query = query
+        search = search[0:len(roots)]
+        try:
+            res = search.execute()
+        except (TransportError, ConnectionTimeout) as e:
+            if getattr(e, 'status_code', 500) == 404:
+                raise
+            res = search.execute()
+
+        docs = dict((os.path.join(doc.path, doc.name).strip('/'), doc)
+                    for doc in res)
+        for root in roots:
+            doc = docs.get(root)
+            if doc is not None:
+                result['children'].append(
+                    Object(wrap=doc).to_dict(user_context=user_context))
+        return result
+
+    @staticmethod
+    def listing(system, file_path, user_context, offset=0, limit=100):
         file_path = file_path or '/'
         file_path = file_path.strip('/')
+        if file_path == '$SHARE':
+            return ElasticFileManager.shared_listing(system, user_context,
+                                                     offset=offset, limit=limit)
         if file_path.strip('/').split('/')[0] != user_context:
-            if file_path == '$SHARE':
-                q = Q('bool',
-                      must=[
-                        Q('term', **{'system._exact': system})
-                      ]
-                      )
-            else:
-                q = Q('bool',
-                      must=[
-                        Q('term', **{'path._path': file_path}),
-                        Q('term', **{'system._exact': system})
-                      ]
-                      )
+            q = Q('bool',
+                  must=[
+                    Q('term', **{'path._path': file_path}),
+                    Q('term', **{'system._exact': system})
+                  ]
+                  )
         else:
             q = Q('bool',
                   must=[
@@ -239,22 +302,8 @@ class ElasticFileManager(BaseFileManager):
                        Q('term', **{'system._exact': system})
                    ]
                   )
-        if user_context is not None:
-            username_q = Q('term', **{'permissions.username': user_context})
-            world_q = Q('term', **{'permissions.username': 'WORLD'})
-            pems_filter = Q('bool')
-            pems_filter.should = [username_q, world_q]
-            nested_filter = Q('nested')
-            nested_filter.path = 'permissions'
-            nested_filter.query = pems_filter
+        query = Q('bool', must=q)
 
-        if file_path == '$SHARE':
-            file_path = '/'
-            home_filter = Q('bool', must_not=Q('term', **{'path._path': user_context}))
-            query = Q('bool', must=q, filter=[nested_filter, home_filter])
-        else:
-            query = Q('bool', must=q)
-    
         search = IndexedFile.search()
         search.query = query
         search = search.sort('path._exact', 'name._exact')
@@ -1,11 +1,14 @@
 """ Main views for agave api. api/agave/*
     All these views return :class:`JsonResponse`s"""
 
+import hashlib
 import logging
 import json
 import os
 import re
 import chardet
+from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import (HttpResponseRedirect, HttpResponseBadRequest,
                          HttpResponseForbidden, HttpResponseServerError)
@@ -29,6 +32,61 @@ from requests import HTTPError
 logger = logging.getLogger(__name__)
 metrics = logging.getLogger('metrics')
 
+def _decode_sample(content, truncated):
+    """Decodes the first bytes of a file as utf-8 or the detected encoding
+
+    A multibyte character may be cut at the end of a truncated sample,
+    the incomplete bytes are dropped.
+    """
+    for encoding in ['utf-8', None]:
+        if encoding is None:
+            encoding = chardet.detect(content)['encoding']
+            if encoding is None:
+                break
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError as exc:
+            if truncated and exc.start >= len(content) - 3:
+                try:
+                    return content[:exc.start].decode(encoding)
+                except UnicodeDecodeError:
+                    pass
+        except LookupError:
+            break
+    raise UnicodeError('Unrecognized content encoding')
+
+def text_preview(f):
+    """Returns the text preview of a file and whether it is truncated
+
+    Only the first ``settings.TEXT_PREVIEW_MAX_SIZE`` bytes of the file
+    are downloaded. Previews are cached per system, path and last
+    modification time.
+    """
+    max_size = getattr(settings, 'TEXT_PREVIEW_MAX_SIZE', 512 * 1024)
+    key = 'text_preview:{}'.format(hashlib.md5(u'{}:{}:{}:{}'.format(
+        f.system, f.path, getattr(f, 'last_modified', ''), max_size
+    ).encode('utf-8')).hexdigest())
+    preview = cache.get(key)
+    if preview is not None:
+        return preview
+
+    content = f.download_range(max_size + 1)
+    truncated = len(content) > max_size
+    content = content[:max_size]
+    try:
+        encoded = _decode_sample(content, truncated).encode('utf-8')
+    except UnicodeError:
+        logger.exception('Failed to preview file',
+                         extra={'system_id': f.system,
+                                'file_path': f.path})
+        encoded = u'Sorry! We were unable to preview this file due ' \
+                  u'to an unrecognized content encoding. Please ' \
+                  u'download the file to view its contents.'
+        truncated = False
+    preview = (encoded, truncated)
+    cache.set(key, preview, getattr(settings, 'TEXT_PREVIEW_CACHE_TTL', 60 * 60 * 24))
+    return preview
+
 
 class FileManagersView(View):
     """Main view for File Managers. Used to get current available file managers."""
@@ -64,9 +122,12 @@ class FileListingView(BaseApiView):
                 (file_path.strip('/') == '$SHARE' or
                  file_path.strip('/').split('/')[0] != request.user.username):
 
+                offset = int(request.GET.get('offset', 0))
+                limit = int(request.GET.get('limit', 100))
                 listing = ElasticFileManager.listing(system=system_id,
                                                      file_path=file_path,
-                                                     user_context=request.user.username)
+                                                     user_context=request.user.username,
+                                                     offset=offset, limit=limit)
                 return JsonResponse(listing)
             else:
                 offset = int(request.GET.get('offset', 0))
@@ -104,22 +165,8 @@ class FileMediaView(View):
                 if f.ext in BaseFileResource.SUPPORTED_IMAGE_PREVIEW_EXTS:
                     context['image_preview'] = f.download_postit(force=False, lifetime=360)
                 elif f.ext in BaseFileResource.SUPPORTED_TEXT_PREVIEW_EXTS:
-                    content = f.download()
-                    try:
-                        encoded = content.encode('utf-8')
-                    except UnicodeError:
-                        try:
-                            encoding = chardet.detect(content)['encoding']
-                            encoded = content.decode(encoding).encode('utf-8')
-                        except UnicodeError:
-                            logger.exception('Failed to preview file',
-                                             extra={'file_mgr_name': file_mgr_name,
-                                                    'system_id': system_id,
-                                                    'file_path': file_path})
-                            encoded = u'Sorry! We were unable to preview this file due ' \
-                                      u'to an unrecognized content encoding. Please ' \
-                                      u'download the file to view its contents.'
-                    context['text_preview'] = encoded
+                    context['text_preview'], context['text_preview_truncated'] = \
+                        text_preview(f)
                 elif f.ext in BaseFileResource.SUPPORTED_OBJECT_PREVIEW_EXTS:
                     context['object_preview'] = f.download_postit(force=False, lifetime=360)
 
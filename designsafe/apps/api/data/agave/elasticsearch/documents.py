@@ -1,10 +1,12 @@
 from django.conf import settings
 from elasticsearch_dsl.query import Q
 from elasticsearch import TransportError, ConnectionTimeout
+from elasticsearch.helpers import streaming_bulk
 from elasticsearch_dsl import Search, DocType
 from elasticsearch_dsl.connections import connections
 from designsafe.apps.api.data.agave.file import AgaveFile
 from designsafe.apps.api.data.agave.elasticsearch import utils as query_utils
+from designsafe.libs.elasticsearch.utils import file_uuid
 from itertools import takewhile
 import dateutil.parser
 import itertools
@@ -385,7 +387,6 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
             link = file_obj._links['self']['href'],
             type = file_obj.type
         )
-        o.save()
         if get_pems:
             pems = file_obj.permissions
         else:
@@ -401,7 +402,7 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
                 }
             }]
 
-        o.update(permissions = pems)
+        o.permissions = pems
         o.save()
         return o
 
@@ -443,16 +444,121 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
         return res, s[offset:limit]
 
 
-    def copy(self, username, target_file_path):
+    @classmethod
+    def _children_query(cls, system, username, file_path):
+        """Query matching every document below a folder
+
+        See :meth:`_listing_recursive`.
+        """
+        return Q('bool',
+                 must = Q({'term': {'path._path': file_path}}),
+                 filter = query_utils.files_access_filter(username, system)
+                )
+
+    @classmethod
+    def delete_children(cls, system, username, file_path):
+        """Deletes every document below a folder.
+
+        This is done with a single `delete_by_query` request, the
+        documents are deleted server side.
+
+        :param str system: system id
+        :param str username: username making the request
+        :param str file_path: path of the folder
+
+        :returns: count of how many documents were deleted
+        :rtype: int
+        """
+        q = cls._children_query(system, username, file_path)
+        es_client = connections.get_connection()
+        resp = es_client.delete_by_query(
+            index=cls._doc_type.index,
+            doc_type=cls._doc_type.name,
+            body={'query': q.to_dict()},
+            conflicts='proceed',
+            refresh=True)
+        logger.debug(u'delete_by_query %s: %s', file_path, resp)
+        return resp.get('deleted', 0)
+
+    @classmethod
+    def move_children(cls, system, username, file_path, target_path,
+                      copy=False, progress=None, chunk_size=500):
+        """Moves (or copies) every document below a folder.
+
+        Documents are stored with an id derived from their path
+        (see :meth:`save`), which means that a path change is a change
+        of id. Instead of updating documents in place
+        (i.e. `update_by_query`) every document below `file_path` is
+        scanned once and a bulk `index` action with the new path and id
+        is sent, together with a bulk `delete` of the old id
+        if the document is being moved.
+
+        :param str system: system id
+        :param str username: username making the request
+        :param str file_path: path of the folder
+        :param str target_path: new path of the folder
+        :param bool copy: if `True` documents are copied instead of moved
+        :param callable progress: function called with the count of
+            documents processed after every chunk.
+        :param int chunk_size: number of documents per bulk request
+
+        :returns: count of how many documents were moved or copied
+        :rtype: int
+        """
+        s = cls.search()
+        s.query = cls._children_query(system, username, file_path)
+        es_client = connections.get_connection()
+
+        def _actions():
+            for doc in s.scan():
+                d = doc.to_dict()
+                d['path'] = target_path + d['path'][len(file_path):]
+                d['agavePath'] = u'agave://{}/{}'.format(
+                    system, os.path.join(d['path'], d['name']))
+                yield {
+                    '_op_type': 'index',
+                    '_index': cls._doc_type.index,
+                    '_type': cls._doc_type.name,
+                    '_id': file_uuid(system, d['path'], d['name']),
+                    '_source': d
+                }
+                if not copy:
+                    yield {
+                        '_op_type': 'delete',
+                        '_index': cls._doc_type.index,
+                        '_type': cls._doc_type.name,
+                        '_id': doc.meta.id
+                    }
+
+        cnt = 0
+        for ok, item in streaming_bulk(es_client, _actions(),
+                                       chunk_size=chunk_size,
+                                       raise_on_error=False):
+            op_type, result = item.popitem()
+            if not ok:
+                logger.error(u'Bulk %s error: %s', op_type, result)
+                continue
+            if op_type == 'index':
+                cnt += 1
+                if progress is not None and cnt % chunk_size == 0:
+                    progress(cnt)
+
+        es_client.indices.refresh(index=cls._doc_type.index)
+        return cnt
+
+    def copy(self, username, target_file_path, recursive = True):
         """Copy a document.
 
         Although creating a copy of a document using this class is farily
         straight forward (i.e. `o = Object(**doc); o.save()`, this method
         is necessary in order to account for recursive copying i.e. when
-        a folder is copied.
+        a folder is copied. See :meth:`move_children`.
 
         :param str username: username making the request
         :param str path: path to the file to copy
+        :param bool recursive: if `False` the children documents of a folder
+            are not copied. Use this when copying the children in a separate
+            task.
 
         :returns: instance of this class
         :rtype: :class:`Object`
@@ -472,46 +578,39 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
         if not target_path:
             target_path = self.path
 
-        if self.type == 'dir':
-            res, s = self.__class__.listing_recursive(self.systemId, username, os.path.join(self.path, self.name))
-            for o in s.scan():
-                d = o.to_dict()
-                regex = r'^{}'.format(os.path.join(self.path, self.name))
-                logger.debug(u'd[path]: {}'.format(d['path']))
-                d['path'] = re.sub(regex,
-                                os.path.join(target_path, target_name),
-                                d['path'], count = 1)
-                logger.debug(u'changed d[path]: {}'.format(d['path']))
-                d['agavePath'] = u'agave://{}/{}'.format(self.systemId, os.path.join(d['path'], d['name']))
-                doc = Object(**d)
-                doc.save()
+        if recursive and self.type == 'dir':
+            self.__class__.move_children(self.systemId, username,
+                                         os.path.join(self.path, self.name),
+                                         os.path.join(target_path, target_name),
+                                         copy = True)
         d = self.to_dict()
         d['path'] = target_path
         d['name'] = target_name
         d['agavePath'] = u'agave://{}/{}'.format(self.systemId, os.path.join(d['path'], d['name']))
         doc = Object(**d)
         doc.save()
-        self.save()
         return doc
 
-    def delete_recursive(self, username):
+    def delete_recursive(self, username, recursive = True):
         """Delete a file recursively.
 
         This method works with both files and folders.
         If the document represents a folder then it will
-        recursively delete any childre documents.
+        recursively delete any childre documents. See :meth:`delete_children`.
+
+        :param bool recursive: if `False` the children documents of a folder
+            are not deleted. Use this when deleting the children in a separate
+            task.
 
         :returns: count of how many documents were deleted
         :rtype: int
         """
         cnt = 0
-        if self.type == 'dir':
-            res, s = self.__class__.listing_recursive(self.systemId, username, os.path.join(self.path, self.name))
-            for o in s.scan():
-                o.delete()
-                cnt += 1
+        if recursive and self.type == 'dir':
+            cnt += self.__class__.delete_children(self.systemId, username,
+                                                  os.path.join(self.path, self.name))
 
-        self.delete()
+        self.delete(ignore=404)
         cnt += 1
         return cnt
 
@@ -548,37 +647,39 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
     def parent_path(self):
         return self.path
 
-    def move(self, username, path):
+    def move(self, username, path, recursive = True):
         """Update document with new path
 
         :param str username: username making the request
         :param str path: path to update
+        :param bool recursive: if `False` the children documents of a folder
+            are not moved. Use this when moving the children in a separate
+            task. See :meth:`move_children`.
 
         :returns: an instance of this class
         :rtype: :class:`Object`
         """
-        if self.type == 'dir':
-            res, s = self.__class__.listing_recursive(self.systemId, username, os.path.join(self.path, self.name))
-            for o in s.scan():
-                regex = ur'^{}'.format(os.path.join(self.path, self.name))
-                o.update(path = re.sub(regex, os.path.join(path, self.name),
-                                o.path, count = 1),
-                         agavePath = u'agave://{}/{}'.format(self.systemId,
-                                os.path.join(self.path, self.name)))
-                o.save()
         tail, head = os.path.split(path)
-        self.update(path = tail, agavePath = u'agave://{}/{}'.format(self.systemId,
-                                                os.path.join(tail, self.name)))
-        logger.debug(u'Moved: {}'.format(self.full_path))
+        if recursive and self.type == 'dir':
+            self.__class__.move_children(self.systemId, username,
+                                         os.path.join(self.path, self.name),
+                                         os.path.join(tail, self.name))
+        self.path = tail
+        self.agavePath = u'agave://{}/{}'.format(self.systemId,
+                                                 os.path.join(tail, self.name))
         self.save()
+        logger.debug(u'Moved: {}'.format(self.full_path))
         return self
 
 
-    def rename(self, username, path):
+    def rename(self, username, path, recursive = True):
         """Updates a document with a new name.
 
         :param str username: username making the request
         :param str path: name to upate
+        :param bool recursive: if `False` the children documents of a folder
+            are not updated. Use this when updating the children in a separate
+            task. See :meth:`move_children`.
 
         :returns: an instance of this class
         :rtype: :class:`Object`
@@ -589,30 +690,32 @@ class Object(ExecuteSearchMixin, PaginationMixin, DocType):
         #If we don't then we got just the new file name in the path arg.
         if tail == '':
             head = path
-        if self.type == 'dir':
-            res, s = self.__class__.listing_recursive(self.systemId, username, os.path.join(self.path, self.name))
-            for o in s.scan():
-                regex = ur'^{}'.format(os.path.join(self.path, self.name))
-                target_path = re.sub(regex, os.path.join(self.path, head), o.path, count = 1)
-                o.update(path =  target_path,
-                         agavePath = u'agave://{}/{}'.format(self.systemId,
-                                            os.path.join(target_path, o.name)))
-                o.save()
-        self.update(name = head,
-                    agavePath = u'agave://{}/{}'.format(self.systemId,
-                                      os.path.join(self.path, head)))
+        if recursive and self.type == 'dir':
+            self.__class__.move_children(self.systemId, username,
+                                         os.path.join(self.path, self.name),
+                                         os.path.join(self.path, head))
+        self.name = head
+        self.agavePath = u'agave://{}/{}'.format(self.systemId,
+                                                 os.path.join(self.path, head))
         self.save()
         return self
 
     def save(self, **kwargs):
         """Overwrite to become save or update
+
+        Documents are saved using a deterministic id generated from the
+        system id and the full path of the file
+        (see :func:`~designsafe.libs.elasticsearch.utils.file_uuid`).
+        This makes saving an idempotent upsert and no search is necessary
+        to find an existing document. If the document was retrieved
+        with a different id (e.g. it was moved or renamed) the document
+        stored under the old id is deleted.
         """
-        doc = Object.from_file_path(self.systemId, self.full_path.split('/')[0], self.full_path)
-        if doc:
-            setattr(self.meta, 'index', doc.meta.index)
-            setattr(self.meta, 'id', doc.meta.id)
-            setattr(self.meta, 'doc_type', doc.meta.doc_type)
-            doc.update(**self.to_dict())
+        doc_id = file_uuid(self.systemId, self.path, self.name)
+        old_id = getattr(self.meta, 'id', None)
+        if old_id is not None and old_id != doc_id:
+            super(Object, self).delete(ignore=404)
+        setattr(self.meta, 'id', doc_id)
         return super(Object, self).save(**kwargs)
 
     def share(self, username, permissions, update_parent_path = True, recursive = True):
@@ -1,12 +1,13 @@
 from agavepy.agave import Agave, load_resource
 from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.data.agave.file import AgaveFile
-from designsafe.apps.api.tasks import reindex_agave, share_agave
+from designsafe.apps.api.tasks import reindex_agave, share_agave, es_recursive_operation
 from designsafe.apps.api.data.agave.agave_object import AgaveObject
 from designsafe.apps.api.data.agave.elasticsearch.documents import Object
 from designsafe.apps.api.notifications.models import Notification, Broadcast
 from designsafe.apps.api.data.abstract.filemanager import AbstractFileManager
 from designsafe.apps.data.managers.indexer import AgaveIndexer as AgaveFileIndexer
+from designsafe.apps.data.managers.indexer import concurrent_walk_levels, merge_listings
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
@@ -334,7 +335,12 @@ class FileManager(AbstractFileManager, AgaveObject):
                 logger.debug('copying {} to {}'.format(file_id, dest_full_path))
                 copied_file = source_file.copy(dest_full_path)
                 esf = Object.from_file_path(system, file_user, file_path)
-                esf.copy(dest_file_user, dest_full_path)
+                esf.copy(dest_file_user, dest_full_path, recursive=False)
+                if esf.type == 'dir':
+                    es_recursive_operation.apply_async(
+                        args=(dest_file_user, 'copy', system, esf.full_path,
+                              dest_full_path),
+                        queue='indexing')
                 return copied_file.to_dict()
 
             else:
@@ -372,7 +378,11 @@ class FileManager(AbstractFileManager, AgaveObject):
         f.delete()
 
         esf = Object.from_file_path(system, file_user, file_path)
-        esf.delete_recursive(file_user)
+        esf.delete_recursive(file_user, recursive=False)
+        if esf.type == 'dir':
+            es_recursive_operation.apply_async(
+                args=(file_user, 'delete', system, esf.full_path),
+                queue='indexing')
         return True
 
     def download(self, file_id, **kwargs):
@@ -481,7 +491,13 @@ class FileManager(AbstractFileManager, AgaveObject):
                 dest_full_path = os.path.join(dest_file_path, f.name)
                 f.move(dest_full_path)
                 esf = Object.from_file_path(system, file_user, file_path)
-                esf.move(dest_file_user, dest_full_path)
+                source_full_path = esf.full_path
+                esf.move(dest_file_user, dest_full_path, recursive=False)
+                if esf.type == 'dir':
+                    es_recursive_operation.apply_async(
+                        args=(dest_file_user, 'move', system, source_full_path,
+                              dest_full_path),
+                        queue='indexing')
                 return f.to_dict()
             else:
                 raise ApiException('Use transfer to move files between systems',
@@ -658,7 +674,13 @@ class FileManager(AbstractFileManager, AgaveObject):
                                          agave_client=self.agave_client)
             f.rename(target_name)
             esf = Object.from_file_path(system, self.username, file_path)
-            esf.rename(self.username, target_name)
+            source_full_path = esf.full_path
+            esf.rename(self.username, target_name, recursive=False)
+            if esf.type == 'dir':
+                es_recursive_operation.apply_async(
+                    args=(self.username, 'move', system, source_full_path,
+                          esf.full_path),
+                    queue='indexing')
             return f.to_dict()
         except HTTPError as e:
             logger.error('HTTP {}: {}: {}'.format(
@@ -950,7 +972,8 @@ class AgaveIndexer(AgaveObject):
             if bottom_up:
                 yield aff
 
-    def walk_levels(self, system_id, path, bottom_up = False):
+    def walk_levels(self, system_id, path, bottom_up = False, max_workers = None,
+                    page_size = None):
         """Walk a path in an agave filesystem.
 
         This generator walks the agavefilesystem making a call to `files.list`
@@ -963,6 +986,10 @@ class AgaveIndexer(AgaveObject):
         :param str path: path to walk
         :param bool bottom_up: if `True` walk the path bottom to top. Default `False`
             will walk the path top to bottom
+        :param int max_workers: max number of concurrent `files.list` calls.
+            Default ``settings.AGAVE_WALK_MAX_WORKERS``
+        :param int page_size: max number of files per `files.list` call.
+            Default ``settings.AGAVE_LISTING_PAGE_SIZE``
 
         :returns: A triple with the root fiele path string, a list with all the
             folders in the current level and a list with all the files in the
@@ -975,23 +1002,25 @@ class AgaveIndexer(AgaveObject):
         Pseudocode:
         -----------
 
-        1. call `files.list` on `path`
-        2. for each file in the listing
-
-            2.1. instantiate :class:`~designsafe.apps.api.agave.file.AgaveFile`
-            2.2. append object to the corresponding folders or files list
-
-        3. if is a top to bottom walk then yield (path, folders, files)
+        1. list `path` in a worker thread, see :meth:`_list_level`
+        2. wait for any listing in flight to finish
+        3. if is a top to bottom walk then yield (root, folders, files)
         4. for every folder in `folders`
 
-            4.1. yield returned triple from calling :meth:`walk_levels`
-                using the folder's path
+            4.1. submit the listing of the folder's path to the worker pool
 
-        5. if is a bottom to top walk then yield (path, folders, files)
+        5. if is a bottom to top walk and every folder below root has
+            been yielded then yield (root, folders, files)
+        6. repeat from 2. until there are no listings in flight
 
         Notes:
         ------
 
+            Levels are yielded as soon as their listing is retrieved.
+            This means the walk is not depth first and sibling levels
+            can be yielded in any order. See
+            :func:`~designsafe.apps.data.managers.indexer.concurrent_walk_levels`.
+
             Similar to :meth:`os.walk` the `files` and `folders` list can be
             modified inplace to modify future iterations. Modifying the
             `files` and `folders` lists inplace can be used to tell the
@@ -1017,25 +1046,40 @@ class AgaveIndexer(AgaveObject):
 
         """
 
-        resp = self.call_operation('files.list', systemId=system_id, filePath=urllib2.quote(path))
+        return concurrent_walk_levels(
+            lambda level_path: self._list_level(system_id, level_path, page_size),
+            path, bottom_up=bottom_up, max_workers=max_workers,
+            path_of=lambda aff: aff.full_path)
+
+    def _list_level(self, system_id, path, page_size=None):
+        """Lists every file in a level of an agave filesystem
+
+        Listings larger than `page_size` are retrieved with several
+        `files.list` calls.
+
+        :returns: A tuple with a list of folders and a list of files
+        :rtype: tuple
+        """
+        page_size = page_size or getattr(settings, 'AGAVE_LISTING_PAGE_SIZE', 100)
         folders = []
         files = []
-        for f in resp:
-            if f['name'] == '.':
-                continue
-            aff = AgaveFile(self.agave_client, wrap = f)
-            if aff.format == 'folder':
-                folders.append(aff)
-            else:
-                files.append(aff)
-        if not bottom_up:
-            yield (path, folders, files)
-        for aff in folders:
-            for (spath, sfolders, sfiles) in self.walk_levels(system_id, aff.full_path, bottom_up = bottom_up):
-                yield (spath, sfolders, sfiles)
-
-        if bottom_up:
-            yield (path, folders, files)
+        offset = 0
+        while True:
+            resp = self.call_operation('files.list', systemId=system_id,
+                                       filePath=urllib2.quote(path),
+                                       limit=page_size, offset=offset)
+            for f in resp:
+                if f['name'] == '.':
+                    continue
+                aff = AgaveFile(self.agave_client, wrap = f)
+                if aff.format == 'folder':
+                    folders.append(aff)
+                else:
+                    files.append(aff)
+            if len(resp) < page_size:
+                break
+            offset += page_size
+        return folders, files
 
     def _dedup_and_discover(self, system_id, username, root, files, folders):
         """Deduping and discovery of Agave Files in Elasticsearch (ES)
@@ -1061,47 +1105,29 @@ class AgaveIndexer(AgaveObject):
         Pseudocode
         ----------
 
-            1. construct a list of all the file names. This is so we can use it
-                to compare the documents retrieved from ES. We use only the
-                file name because we are operating on a specific filesystem level
-                meaning that the path is always going to be the same.
-            2. get all the documents that are direct children of the root path given.
-            3. for each document retrieved from ES
-
-                3.1. append document to the list of documents
-                3.2. if the name of the document is already in the list of
-                    document names then we assume is a duplicate and append it
-                    to the list of documents to delete.
-                    If the name of the document is not in the list of document
-                    names then append it
-
-            4. create the `objs_to_index` list by getting all the file objects
-                which names do not appear in the list of document names. Meaning,
-                we are getting all the file objects that we do not have in the
-                ES index.
-            5. create the `docs_to_delete` list by appending all the documents
-                which names do not appear in the file object names list to the
-                previously creatd duplicated documents list. Meaning, we are
-                appending all the ES documents for which there are no file in the
-                agave filesystem.
+            1. get all the documents that are direct children of the root path given.
+            2. sort the file objects and the documents by name and merge
+                both lists (see
+                :func:`~designsafe.apps.data.managers.indexer.merge_listings`).
+                We use only the file name because we are operating on a specific
+                filesystem level meaning that the path is always going to be the same.
+            3. for each merged pair
+
+                3.1. if there is no document append the file object to
+                    `objs_to_index`.
+                3.2. if there is no file object, the document is either
+                    a duplicate or there is no file in the agave filesystem
+                    for it. Append it to `docs_to_delete`.
         """
 
-        objs = folders + files
-        objs_names = [o.name for o in objs]
         r, s = Object.listing(system_id, username, root)
-        docs = []
-        doc_names = []
+        objs_to_index = []
         docs_to_delete = []
-
-        for d in s.scan():
-            docs.append(d)
-            if d.name in doc_names:
-                docs_to_delete.append(d)
-            else:
-                doc_names.append(d.name)
-
-        objs_to_index = [o for o in objs if o.name not in doc_names]
-        docs_to_delete += [o for o in docs if o.name not in objs_names]
+        for obj, doc in merge_listings(folders + files, s.scan()):
+            if doc is None:
+                objs_to_index.append(obj)
+            elif obj is None:
+                docs_to_delete.append(doc)
         return objs_to_index, docs_to_delete
 
     def index(self, system_id, path, username, bottom_up = False,
@@ -1176,9 +1202,12 @@ class AgaveIndexer(AgaveObject):
 
             objs_to_index, docs_to_delete = self._dedup_and_discover(system_id,
                                                 username, root, files, folders)
+            if docs_to_delete:
+                names = set(o.name for o in folders + files)
             for d in docs_to_delete:
                 logger.debug(u'delete_recursive: {}'.format(d.full_path))
-                docs_deleted += d.delete_recursive(username)
+                docs_deleted += d.delete_recursive(username,
+                                                   recursive = d.name not in names)
 
             if not full_indexing:
                 for o in objs_to_index:
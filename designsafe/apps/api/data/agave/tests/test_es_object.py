@@ -5,6 +5,7 @@ from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.data.agave.file import AgaveFile
 from designsafe.apps.api.data.agave.agave_object import AgaveObject
 from designsafe.apps.api.data.agave.elasticsearch.documents import Object
+from designsafe.libs.elasticsearch.utils import file_uuid
 from designsafe.apps.auth.models import AgaveOAuthToken
 from agavepy.agave import Agave
 import dateutil.parser
@@ -23,7 +24,8 @@ class MockListingRecursive(mock.MagicMock):
 
     def scan(self): 
         for o in self.listing_json:
-            doc = Object(**o)
+            doc = Object(meta = {'id': file_uuid(o['systemId'], o['path'], o['name'])},
+                         **o)
             #doc.to_dict.return_value = o
             yield doc       
         
@@ -118,197 +120,183 @@ class FileInitTestCase(FileBaseTestCase):
 
 class FileCopyTestCase(FileBaseTestCase):
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'listing_recursive') 
-    def test_copy_file(self, mock_listing_recursive, mock_save):
+    @mock.patch.object(Object, 'move_children')
+    def test_copy_file(self, mock_move_children, mock_save):
         doc = self.get_mock_object_file()
         target_name = 'file_copy.txt'
         doc_copy = doc.copy(self.user.username, target_name)
 
-        self.assertEqual(mock_save.call_count, 2)
+        self.assertEqual(mock_save.call_count, 1)
         self.assertEqual(doc_copy.name, target_name)
-        mock_listing_recursive.assert_not_called()
+        mock_move_children.assert_not_called()
 
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'listing_recursive') 
-    def test_copy_folder_is_creating_correct_objects(self, 
-                        mock_listing_recursive, mock_save):
-        lp = 'designsafe/apps/api/fixtures/object_listing_recursive.json'
-        with open(lp) as f:
-            listing_json = json.load(f)
-
-        s = MockListingRecursive()
-        mock_listing_recursive.return_value = (None, s)
-
+    @mock.patch.object(Object, 'move_children')
+    def test_copy_folder(self, mock_move_children, mock_save):
         doc = self.get_mock_object_folder()
-        doc.path, doc.name = os.path.split(listing_json[0]['path'])
-
         target_path = doc.path + '/another folder'
         target_name = 'folder_copy'
 
-        with mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.Object', spce = Object) as mock_obj_class:
-            mock_obj_class.save.return_value = None
-            doc_copy = doc.copy(self.user.username, os.path.join(target_path, target_name))
-            #print 'Obj class was called: %d times' % mock_obj_class.call_count
-            obj_class_calls = mock_obj_class.call_args_list
+        doc_copy = doc.copy(self.user.username, os.path.join(target_path, target_name))
 
-        for i, d in enumerate(listing_json):
-            args, d_call = obj_class_calls[i]
-            regex = r'^{}'.format(os.path.join(doc.path, doc.name))
-            self.assertEqual(d_call['path'], re.sub(regex, 
-                                os.path.join(target_path, target_name),
-                                d['path']))
-
-        mock_listing_recursive.assert_called_with(doc.systemId, 
-                self.user.username, os.path.join(doc.path, doc.name))
+        mock_move_children.assert_called_with(doc.systemId,
+                self.user.username, os.path.join(doc.path, doc.name),
+                os.path.join(target_path, target_name), copy = True)
+        self.assertEqual(doc_copy.path, target_path)
+        self.assertEqual(doc_copy.name, target_name)
+        self.assertEqual(mock_save.call_count, 1)
 
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'listing_recursive') 
-    def test_copy_folder_is_saving_objects(self, 
-                        mock_listing_recursive, mock_save):
+    @mock.patch.object(Object, 'move_children')
+    def test_copy_folder_not_recursive(self, mock_move_children, mock_save):
+        doc = self.get_mock_object_folder()
+        doc.copy(self.user.username, 'folder_copy', recursive = False)
+        mock_move_children.assert_not_called()
+
+
+class FileMoveChildrenTestCase(FileBaseTestCase):
+    def _actions(self, mock_bulk):
+        def _bulk(client, actions, **kwargs):
+            mock_bulk.actions = list(actions)
+            for action in mock_bulk.actions:
+                yield True, {action['_op_type']: {'status': 200}}
+        return _bulk
+
+    @mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.connections')
+    @mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.streaming_bulk')
+    @mock.patch.object(Object, 'search')
+    def test_move_children(self, mock_search, mock_bulk, mock_connections):
         lp = 'designsafe/apps/api/fixtures/object_listing_recursive.json'
         with open(lp) as f:
             listing_json = json.load(f)
+        mock_search.return_value = MockListingRecursive()
+        mock_bulk.side_effect = self._actions(mock_bulk)
+        source_path = 'ds_user/agavefs'
+        target_path = 'ds_user/moved/agavefs'
+
+        cnt = Object.move_children('designsafe.storage.default',
+                                   self.user.username, source_path, target_path)
+
+        self.assertEqual(cnt, len(listing_json))
+        index_actions = [a for a in mock_bulk.actions if a['_op_type'] == 'index']
+        delete_actions = [a for a in mock_bulk.actions if a['_op_type'] == 'delete']
+        self.assertEqual(len(index_actions), len(listing_json))
+        self.assertEqual(len(delete_actions), len(listing_json))
+        for action, d in zip(index_actions, listing_json):
+            self.assertEqual(action['_source']['path'],
+                             target_path + d['path'][len(source_path):])
+            self.assertEqual(action['_id'],
+                             file_uuid('designsafe.storage.default',
+                                       action['_source']['path'],
+                                       action['_source']['name']))
+
+    @mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.connections')
+    @mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.streaming_bulk')
+    @mock.patch.object(Object, 'search')
+    def test_copy_children(self, mock_search, mock_bulk, mock_connections):
+        mock_search.return_value = MockListingRecursive()
+        mock_bulk.side_effect = self._actions(mock_bulk)
+
+        Object.move_children('designsafe.storage.default', self.user.username,
+                             'ds_user/agavefs', 'ds_user/copy', copy = True)
+
+        self.assertTrue(all(a['_op_type'] == 'index' for a in mock_bulk.actions))
 
-        s = MockListingRecursive()
-        mock_listing_recursive.return_value = (None, s)
 
-        doc = self.get_mock_object_folder()
-
-        target_name = 'folder_copy'
-        
-        doc_copy = doc.copy(self.user.username, target_name)
-        self.assertEqual(mock_save.call_count, len(listing_json) + 2)
-        mock_listing_recursive.assert_called_with(doc.systemId, 
-                self.user.username, os.path.join(doc.path, doc.name))
- 
-     
 class FileDeleteTestCase(FileBaseTestCase):
     @mock.patch.object(Object, 'delete')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_delete_file(self, mock_listing_recursive, mock_delete):
+    @mock.patch.object(Object, 'delete_children')
+    def test_delete_file(self, mock_delete_children, mock_delete):
         doc = self.get_mock_object_file()
-        mock_listing_recursive.return_value = None
 
         doc.delete_recursive(self.user.username)
 
         self.assertTrue(mock_delete.called)
-        mock_listing_recursive.assert_not_called()
+        mock_delete_children.assert_not_called()
 
     @mock.patch.object(Object, 'delete')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_delete_folder(self, mock_listing_recursive, mock_delete):
-        lp = 'designsafe/apps/api/fixtures/object_listing_recursive.json'
-        with open(lp) as f:
-            listing_json = json.load(f)
-
-        s = MockListingRecursive()
-        mock_listing_recursive.return_value = (None, s)
-
+    @mock.patch.object(Object, 'delete_children')
+    def test_delete_folder(self, mock_delete_children, mock_delete):
+        mock_delete_children.return_value = 10
         doc = self.get_mock_object_folder()
 
         cnt = doc.delete_recursive(self.user.username)
 
-        mock_listing_recursive.assert_called_with(self.afolder_json['system'],
+        mock_delete_children.assert_called_with(self.afolder_json['system'],
                     self.user.username, self.afolder_json['path'])
-        self.assertEqual(mock_delete.call_count, len(listing_json) + 1)
+        self.assertEqual(mock_delete.call_count, 1)
+        self.assertEqual(cnt, 11)
+
+    @mock.patch('designsafe.apps.api.data.agave.elasticsearch.documents.connections')
+    def test_delete_children_by_query(self, mock_connections):
+        es_client = mock_connections.get_connection.return_value
+        es_client.delete_by_query.return_value = {'deleted': 27}
+
+        cnt = Object.delete_children('designsafe.storage.default',
+                                     self.user.username, 'ds_user/agavefs')
+
+        self.assertEqual(cnt, 27)
+        self.assertEqual(es_client.delete_by_query.call_count, 1)
 
 class FileMoveTestCase(FileBaseTestCase):
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'update')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_move_file(self, mock_listing_recursive, mock_update, mock_save):
+    @mock.patch.object(Object, 'move_children')
+    def test_move_file(self, mock_move_children, mock_save):
         doc = self.get_mock_object_file()
-        mock_listing_recursive.return_value = None
         target_path = 'path/to/new folder'
 
         doc.move(self.user.username, '%s/%s' % (target_path, doc.name))
-        
-        mock_update.assert_called_with(path = target_path,
-                    agavePath = 'agave://{}/{}'.format(self.afile_json['system'],
-                        os.path.join(target_path, self.afile_json['name'])))
+
+        self.assertEqual(doc.path, target_path)
+        self.assertEqual(doc.agavePath,
+                         'agave://{}/{}'.format(self.afile_json['system'],
+                             os.path.join(target_path, self.afile_json['name'])))
         self.assertTrue(mock_save.called)
-        mock_listing_recursive.assert_not_called()
+        mock_move_children.assert_not_called()
 
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'update')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_move_folder(self, mock_listing_recursive, mock_update, mock_save):
-        lp = 'designsafe/apps/api/fixtures/object_listing_recursive.json'
-        with open(lp) as f:
-            listing_json = json.load(f)
-
-        s = MockListingRecursive()
-        mock_listing_recursive.return_value = (None, s)
-
+    @mock.patch.object(Object, 'move_children')
+    def test_move_folder(self, mock_move_children, mock_save):
         doc = self.get_mock_object_folder()
         target_path = 'path/to/new folder'
         doc.move(self.user.username, '%s/%s' % (target_path, doc.name))
-        update_calls = mock_update.call_args_list
-
-        for i, d in enumerate(listing_json):
-            args, d_call = update_calls[i]
-            regex = r'^{}'.format(self.afolder_json['path'])
-            self.assertEqual(d_call['path'], 
-                             re.sub(regex, 
-                                os.path.join(target_path, self.afolder_json['name']),
-                                d['path']))
-
-        args, d_call = update_calls[-1]
-        self.assertEqual(d_call['path'], target_path)
-        self.assertEqual(mock_save.call_count, len(listing_json) + 1)
-        mock_listing_recursive.assert_called_with(self.afolder_json['system'],
-                self.user.username, self.afolder_json['path'])
-                                                        
+
+        mock_move_children.assert_called_with(self.afolder_json['system'],
+                self.user.username, self.afolder_json['path'],
+                os.path.join(target_path, doc.name))
+        self.assertEqual(doc.path, target_path)
+        self.assertEqual(mock_save.call_count, 1)
+
 class FileRenameTestcase(FileBaseTestCase):
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'update')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_rename_file(self, mock_listing_recursive, mock_update, mock_save):
+    @mock.patch.object(Object, 'move_children')
+    def test_rename_file(self, mock_move_children, mock_save):
         doc = self.get_mock_object_file()
-        mock_listing_recursive.return_value = None
         target_name = 'rename_file.txt'
 
         doc.rename(self.user.username, target_name)
-        
-        origin_path = os.path.split(self.afile_json['path'])[0]
 
-        mock_update.assert_called_with(name = target_name,
-                    agavePath = 'agave://{}/{}'.format(self.afile_json['system'],
-                        os.path.join(origin_path, target_name)))
+        origin_path = os.path.split(self.afile_json['path'])[0]
+        self.assertEqual(doc.name, target_name)
+        self.assertEqual(doc.agavePath,
+                         'agave://{}/{}'.format(self.afile_json['system'],
+                             os.path.join(origin_path, target_name)))
         self.assertTrue(mock_save.called)
-        mock_listing_recursive.assert_not_called()
+        mock_move_children.assert_not_called()
 
     @mock.patch.object(Object, 'save')
-    @mock.patch.object(Object, 'update')
-    @mock.patch.object(Object, 'listing_recursive')
-    def test_rename_folder(self, mock_listing_recursive, mock_update, mock_save):
-        lp = 'designsafe/apps/api/fixtures/object_listing_recursive.json'
-        with open(lp) as f:
-            listing_json = json.load(f)
-
-        s = MockListingRecursive()
-        mock_listing_recursive.return_value = (None, s)
-
+    @mock.patch.object(Object, 'move_children')
+    def test_rename_folder(self, mock_move_children, mock_save):
         doc = self.get_mock_object_folder()
         target_name = 'renamed folder'
         doc.rename(self.user.username, target_name)
-        update_calls = mock_update.call_args_list
 
         origin_path = os.path.split(self.afolder_json['path'])[0]
-        for i, d in enumerate(listing_json):
-            args, d_call = update_calls[i]
-            regex = r'^{}'.format(self.afolder_json['path'])
-            self.assertEqual(d_call['path'], 
-                             re.sub(regex, 
-                                os.path.join(origin_path, target_name),
-                                d['path']))
-
-        args, d_call = update_calls[-1]
-        self.assertEqual(d_call['name'], target_name)
-        self.assertEqual(mock_save.call_count, len(listing_json) + 1)
-        mock_listing_recursive.assert_called_with(self.afolder_json['system'],
-                self.user.username, self.afolder_json['path'])
-
+        mock_move_children.assert_called_with(self.afolder_json['system'],
+                self.user.username, self.afolder_json['path'],
+                os.path.join(origin_path, target_name))
+        self.assertEqual(doc.name, target_name)
+        self.assertEqual(mock_save.call_count, 1)
 
 class FileShareTestCase(FileBaseTestCase):
     @mock.patch.object(Object, 'listing_recursive')
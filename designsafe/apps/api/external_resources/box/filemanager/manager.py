@@ -2,14 +2,25 @@
 import os
 import re
 import sys
+import json
+import time
+import base64
+import hashlib
 import logging
 from designsafe.apps.api.tasks import reindex_agave
+from designsafe.apps.data.models.changes import FileChange
 from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.external_resources.box.models.files import BoxFile
+from designsafe.apps.api.external_resources.transfers import TransferEngine
+from designsafe.apps.api.external_resources.uploads import ChunkedUpload
 from designsafe.apps.api.notifications.models import Notification
 from designsafe.apps.box_integration.models import BoxUserToken
-from boxsdk.exception import BoxException, BoxOAuthException
+from boxsdk import Client
+from boxsdk.config import API
+from boxsdk.exception import BoxException, BoxOAuthException, BoxNetworkException, BoxAPIException
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import (JsonResponse, HttpResponseBadRequest)
 from requests import HTTPError
@@ -21,6 +32,8 @@ logger = logging.getLogger(__name__)
 class FileManager(object):
 
     NAME = 'box'
+    #: Box does not accept upload sessions for files smaller than 20MB
+    UPLOAD_SESSION_MIN_SIZE = 20 * 1024 * 1024
 
     def __init__(self, user_obj, **kwargs):
         self._user = user_obj
@@ -29,7 +42,8 @@ class FileManager(object):
             raise ApiException(status=403, message='Log in required to access Box files.')
 
         try:
-            self.box_api = user_obj.box_user_token.client
+            self._oauth = kwargs.get('oauth') or user_obj.box_user_token.oauth
+            self.box_api = Client(self._oauth)
         except BoxUserToken.DoesNotExist:
             message = 'Connect your Box account <a href="'+ reverse('box_integration:index') + '">here</a>'
             raise ApiException(status=400, message=message, extra={
@@ -37,6 +51,15 @@ class FileManager(object):
                 'action_label': 'Connect Box.com Account'
             })
 
+    def worker_manager(self):
+        """Manager for a transfer worker thread
+
+        Every worker has its own client, all of them share the OAuth2 of
+        this manager. Box refresh tokens can only be used once, the OAuth2
+        refreshes the access token once for every worker.
+        """
+        return FileManager(self._user, oauth=self._oauth)
+
     def parse_file_id(self, file_id):
         if file_id is not None:
             file_id = file_id.strip('/')
@@ -52,6 +75,46 @@ class FileManager(object):
 
         return file_type, file_id
 
+    @staticmethod
+    def _is_hierarchical_path(file_id):
+        """Checks if `file_id` is a hierarchical path instead of {type}/{id}"""
+        if file_id is None:
+            return False
+        try:
+            BoxFile.parse_file_id(file_id.strip('/'))
+            return False
+        except AssertionError:
+            return True
+
+    def _path_cache_prefix(self):
+        """Prefix of the cache keys of hierarchical paths.
+
+        Keys are scoped to the Box account, and to a generation number which
+        is bumped by :meth:`invalidate_paths`.
+        """
+        box_user_id = self._user.box_user_token.box_user_id
+        generation = cache.get('box_paths:{}'.format(box_user_id), 0)
+        return 'box_paths:{}:{}'.format(box_user_id, generation)
+
+    @staticmethod
+    def _path_cache_key(prefix, file_path):
+        """Cache key of a hierarchical path"""
+        return '{}:{}'.format(prefix, hashlib.md5(file_path.encode('utf-8')).hexdigest())
+
+    def invalidate_paths(self):
+        """Invalidates every cached path of the user.
+
+        Paths are cached per account, a move, rename or delete of a folder
+        changes the path of everything below it.
+        """
+        key = 'box_paths:{}'.format(self._user.box_user_token.box_user_id)
+        if cache.add(key, 1, None):
+            return
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
     def box_object_for_file_hierarchy_path(self, file_path):
         """
         Resolves a hierarchical path to a box_object. For example, given the file_path
@@ -59,6 +122,11 @@ class FileManager(object):
         All Files (folder/0), and looking for a child with the name of the next element in
         the path. If found, the BoxObject is returned. Otherwise, raises.
 
+        Resolved paths are cached for ``settings.BOX_PATH_CACHE_TTL`` seconds.
+        Resolution starts at the deepest cached ancestor. While paging through
+        a folder every child seen is cached, only the type, id and name of
+        the children are requested.
+
         Args:
             file_path: The hierarchical path to the BoxObject
 
@@ -70,19 +138,39 @@ class FileManager(object):
         if file_path is None or file_path == '' or file_path == 'All Files':
             return box_object
         path_c = file_path.split('/')
-        for c in path_c:
+        ttl = getattr(settings, 'BOX_PATH_CACHE_TTL', 60 * 10)
+        prefix = self._path_cache_prefix()
+
+        start = 0
+        cached = cache.get_many([self._path_cache_key(prefix, '/'.join(path_c[:i]))
+                                 for i in range(1, len(path_c) + 1)])
+        for i in range(len(path_c), 0, -1):
+            item = cached.get(self._path_cache_key(prefix, '/'.join(path_c[:i])))
+            if item is not None:
+                item_type, item_id = item
+                box_object = getattr(self.box_api, item_type)(item_id)
+                start = i
+                break
+
+        for i in range(start, len(path_c)):
+            c = path_c[i]
+            parent_path = '/'.join(path_c[:i])
 
             if box_object._item_type != 'folder':
                 # we've found a file, but there are still more path components to process
                 raise ApiException('The Box path "{0}" does not exist.'.format(file_path),
                                    status=404)
 
-            limit = 100
+            limit = 1000
             offset = 0
             next_object = None
             while next_object is None:
                 children = self.box_api.folder(box_object.object_id).get_items(
-                    limit=limit, offset=offset)
+                    limit=limit, offset=offset, fields=['type', 'id', 'name'])
+                cache.set_many(
+                    {self._path_cache_key(prefix, '/'.join(filter(None, [parent_path, child.name]))):
+                     (child._item_type, child.object_id) for child in children},
+                    ttl)
                 for child in children:
                     if child.name == c:
                         next_object = child
@@ -114,10 +202,16 @@ class FileManager(object):
         default_pems = 'ALL'
 
         try:
-            file_type, file_id = self.parse_file_id(file_id)
-
-            box_op = getattr(self.box_api, file_type)
-            box_item = box_op(file_id).get()
+            try:
+                file_type, box_id = self.parse_file_id(file_id)
+                box_item = getattr(self.box_api, file_type)(box_id).get()
+            except BoxAPIException as e:
+                # the cached path might point to an item which was moved or deleted
+                if e.status != 404 or not self._is_hierarchical_path(file_id):
+                    raise
+                self.invalidate_paths()
+                file_type, box_id = self.parse_file_id(file_id)
+                box_item = getattr(self.box_api, file_type)(box_id).get()
             if file_type == 'folder':
                 limit = int(kwargs.pop('limit', 100))
                 offset = int(kwargs.pop('offset', 0))
@@ -157,7 +251,7 @@ class FileManager(object):
     def is_search(self, *args, **kwargs):
         return False
 
-    def copy(self, username, src_file_id, dest_file_id, **kwargs):
+    def copy(self, username, src_file_id, dest_file_id, checkpoint_id=None, **kwargs):
         try:
             n = Notification(event_type='data',
                              status=Notification.INFO,
@@ -200,7 +294,8 @@ class FileManager(object):
                 downloaded_file_path = self.download_file(box_file_id, dest_real_path)
                 levels = 1
             elif box_file_type == 'folder':
-                downloaded_file_path = self.download_folder(box_file_id, dest_real_path)
+                downloaded_file_path = self.download_folder(box_file_id, dest_real_path,
+                                                            checkpoint_id=checkpoint_id)
 
             n = Notification(event_type='data',
                              status=Notification.SUCCESS,
@@ -216,11 +311,14 @@ class FileManager(object):
             else:
                 agave_file_path = downloaded_file_path.replace(base_mounted_path, '', 1).strip('/')
 
+            # The legacy index is read by the legacy file manager,
+            # the change feed only updates the files index.
             reindex_agave.apply_async(kwargs={
                                       'username': user.username,
                                       'file_id': '{}/{}'.format(agave_system_id, agave_file_path)
                                       },
                                       queue='indexing')
+            FileChange.record(FileChange.CREATE, agave_system_id, agave_file_path)
         except:
             logger.exception('Unexpected task failure: box_download', extra={
                 'username': username,
@@ -301,47 +399,57 @@ class FileManager(object):
 
         return file_download_path
 
-    def download_folder(self, box_folder_id, download_path):
+    def list_folder(self, box_folder_id):
         """
-        Recursively the folder for box_folder_id, and all of its contents, to the given
-        download_path.
+        Lists the folder for box_folder_id.
 
-        :param box_file_manager:
         :param box_folder_id:
-        :param download_path:
-        :return:
+        :return: tuple of the folder name, list of file ids and list of folder ids
         """
         box_folder = self.box_api.folder(box_folder_id).get()
-        # convert utf-8 chars
-        safe_dirname = box_folder.name.encode(sys.getfilesystemencoding(), 'ignore')
-        directory_path = os.path.join(download_path, safe_dirname)
-        logger.debug('Creating directory %s <= box://folder/%s', directory_path, box_folder_id)
-        try:
-            os.mkdir(directory_path, 0o0755)
-        except OSError as e:
-            if e.errno == 17:  # directory already exists?
-                pass
-            else:
-                logger.exception('Error creating directory: %s', directory_path)
-                raise
-
+        files = []
+        folders = []
         limit = 100
         offset = 0
         while True:
             items = box_folder.get_items(limit, offset)
             for item in items:
                 if item.type == 'file':
-                    self.download_file(item.object_id, directory_path)
+                    files.append(item.object_id)
                 elif item.type == 'folder':
-                    self.download_folder(item.object_id, directory_path)
+                    folders.append(item.object_id)
             if len(items) == limit:
                 offset += limit
             else:
                 break
 
-        return directory_path
+        return box_folder.name, files, folders
+
+    def create_folder(self, box_parent_folder_id, name):
+        """
+        Creates a folder named name in box_parent_folder_id.
 
-    def upload(self, username, src_file_id, dest_file_id):
+        :return: the id of the new folder
+        """
+        logger.info('Create directory %s in box folder/%s', name, box_parent_folder_id)
+        box_parent_folder = self.box_api.folder(box_parent_folder_id)
+        return box_parent_folder.create_subfolder(name).object_id
+
+    def download_folder(self, box_folder_id, download_path, checkpoint_id=None):
+        """
+        Downloads the folder for box_folder_id, and all of its contents, to the given
+        download_path. Files are downloaded in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
+
+        :param box_folder_id:
+        :param download_path:
+        :param checkpoint_id: id used to resume the transfer
+        :return: the full path to the downloaded folder
+        """
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        return engine.download_folder(box_folder_id, download_path)
+
+    def upload(self, username, src_file_id, dest_file_id, checkpoint_id=None):
         try:
             n = Notification(event_type='data',
                              status=Notification.INFO,
@@ -378,7 +486,8 @@ class FileManager(object):
             if os.path.isfile(src_real_path):
                 self.upload_file(box_file_id, src_real_path)
             elif os.path.isdir(src_real_path):
-                self.upload_directory(box_file_id, src_real_path)
+                self.upload_directory(box_file_id, src_real_path,
+                                      checkpoint_id=checkpoint_id)
             else:
                 logger.error('Unable to upload %s: file does not exist!',
                              src_real_path)
@@ -407,42 +516,115 @@ class FileManager(object):
             raise
 
     def upload_file(self, box_folder_id, file_real_path):
-        file_path, file_name = os.path.split(file_real_path)
-        with open(file_real_path, 'rb') as file_handle:
-            box_folder = self.box_api.folder(box_folder_id)
-            uploaded_file = box_folder.upload_stream(file_handle, file_name)
-            logger.info('Successfully uploaded %s to box:folder/%s as box:file/%s',
-                        file_real_path, box_folder_id, uploaded_file.object_id)
+        """Uploads a file to box
 
+        Box only accepts upload sessions for files larger than
+        :attr:`UPLOAD_SESSION_MIN_SIZE`. Smaller files are streamed in a
+        single request.
 
-    def upload_directory(self, box_parent_folder_id, dir_real_path):
+        :param str box_folder_id: box folder to upload the file to.
+        :param str file_real_path: real path of the file to upload.
         """
-        Recursively uploads the directory and all of its contents (subdirectories and files)
-        to the box folder specified by box_parent_folder_id.
+        file_path, file_name = os.path.split(file_real_path)
+        if os.path.getsize(file_real_path) < self.UPLOAD_SESSION_MIN_SIZE:
+            with open(file_real_path, 'rb') as file_handle:
+                box_folder = self.box_api.folder(box_folder_id)
+                uploaded_file = box_folder.upload_stream(file_handle, file_name)
+        else:
+            uploaded_file = self.upload_file_chunked(box_folder_id, file_real_path)
+        logger.info('Successfully uploaded %s to box:folder/%s as box:file/%s',
+                    file_real_path, box_folder_id, uploaded_file.object_id)
 
-        :param box_parent_folder_id: The box folder to upload the directory to.
-        :param dir_real_path: The real path on the filesystem of the directory to upload.
-        :return: The new box folder.
-        """
+    def upload_file_chunked(self, box_folder_id, file_real_path):
+        """Uploads a file to box using an upload session
 
-        dirparentpath, dirname = os.path.split(dir_real_path)
-        box_parent_folder = self.box_api.folder(box_parent_folder_id)
-        logger.info('Create directory %s in box folder/%s', dirname, box_parent_folder_id)
-        box_folder = box_parent_folder.create_subfolder(dirname)
+        Box decides the size of the parts when the session is created.
+        Parts are read from disk one at a time and the SHA1 of the whole
+        file, required to commit the session, is computed as the parts
+        are sent.
 
-        for dirpath, subdirnames, filenames in os.walk(dir_real_path):
-            # upload all the files
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                self.upload_file(box_folder.object_id, filepath)
+        .. note:: The sdk version we use does not wrap the upload sessions
+            API, the requests are made with :meth:`Client.make_request`.
 
-            # upload all the subdirectories
-            for subdirname in subdirnames:
-                subdirpath = os.path.join(dirpath, subdirname)
-                self.upload_directory(box_folder.object_id, subdirpath)
+        :param str box_folder_id: box folder to upload the file to.
+        :param str file_real_path: real path of the file to upload.
 
-            # prevent further walk, because recursion
-            subdirnames[:] = []
+        :returns: the uploaded file
+        :rtype: :class:`boxsdk.object.file.File`
+        """
+        file_path, file_name = os.path.split(file_real_path)
+        sessions_url = '{0}/files/upload_sessions'.format(API.UPLOAD_URL)
+        session = self.box_api.make_request(
+            'POST', sessions_url,
+            data=json.dumps({'folder_id': box_folder_id,
+                             'file_size': os.path.getsize(file_real_path),
+                             'file_name': file_name})).json()
+        session_url = '{0}/{1}'.format(sessions_url, session['id'])
+        upload = ChunkedUpload(file_real_path,
+                               chunk_size=session['part_size'],
+                               username=self._user.username,
+                               operation='box_upload',
+                               retry_on=(BoxNetworkException,))
+
+        def upload_part(data, offset):
+            headers = {
+                'Content-Type': 'application/octet-stream',
+                'Digest': 'SHA={0}'.format(
+                    base64.b64encode(hashlib.sha1(data).digest())),
+                'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                    offset, offset + len(data) - 1, upload.file_size),
+            }
+            return self.box_api.make_request(
+                'PUT', session_url, headers=headers, data=data).json()['part']
+
+        file_sha1 = hashlib.sha1()
+        parts = []
+        try:
+            for offset, data in upload.chunks():
+                parts.append(upload.retry(upload_part, data, offset))
+                file_sha1.update(data)
+                upload.progress(offset + len(data))
+
+            headers = {'Content-Type': 'application/json',
+                       'Digest': 'SHA={0}'.format(
+                           base64.b64encode(file_sha1.digest()))}
+            commit_timeout = getattr(settings, 'EXTERNAL_RESOURCES_UPLOADS',
+                                     {}).get('commit_timeout', 60 * 10)
+            deadline = time.time() + commit_timeout
+            while True:
+                response = upload.retry(self.box_api.make_request,
+                                        'POST', '{0}/commit'.format(session_url),
+                                        headers=headers,
+                                        data=json.dumps({'parts': parts}))
+                # Box answers 202 while the parts are still being processed.
+                if response.status_code != 202:
+                    break
+                if time.time() >= deadline:
+                    raise ApiException(
+                        'Box upload session {0} was not committed after {1}s'.format(
+                            session['id'], commit_timeout),
+                        status=504)
+                time.sleep(int(response.headers.get('Retry-After', 1)))
+        except Exception:
+            logger.exception('Error uploading %s, aborting box upload session %s',
+                             file_real_path, session['id'])
+            self.box_api.make_request('DELETE', session_url)
+            raise
+
+        upload.progress(upload.file_size, force=True)
+        file_id = response.json()['entries'][0]['id']
+        return self.box_api.file(file_id)
 
-        return box_folder
+    def upload_directory(self, box_parent_folder_id, dir_real_path, checkpoint_id=None):
+        """
+        Uploads the directory and all of its contents (subdirectories and files)
+        to the box folder specified by box_parent_folder_id. Files are uploaded
+        in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
 
+        :param box_parent_folder_id: The box folder to upload the directory to.
+        :param dir_real_path: The real path on the filesystem of the directory to upload.
+        :param checkpoint_id: id used to resume the transfer
+        """
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        engine.upload_directory(box_parent_folder_id, dir_real_path)
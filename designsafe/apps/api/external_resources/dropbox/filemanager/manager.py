@@ -5,11 +5,14 @@ import sys
 import logging
 from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.external_resources.dropbox.models.files import DropboxFile
+from designsafe.apps.api.external_resources.transfers import TransferEngine
+from designsafe.apps.api.external_resources.uploads import ChunkedUpload
 from designsafe.apps.api.notifications.models import Notification
 from designsafe.apps.api.tasks import reindex_agave
+from designsafe.apps.data.models.changes import FileChange
 #from designsafe.apps.api.tasks import dropbox_upload
 from designsafe.apps.dropbox_integration.models import DropboxUserToken
-from dropbox.exceptions import ApiError, AuthError
+from dropbox.exceptions import ApiError, AuthError, InternalServerError
 from dropbox.files import ListFolderResult, FileMetadata, FolderMetadata, UploadSessionCursor, CommitInfo
 from dropbox.dropbox import Dropbox
 from dropbox.oauth import DropboxOAuth2Flow, BadRequestException, BadStateException, CsrfException, NotApprovedException, ProviderException
@@ -140,7 +143,7 @@ class FileManager(object):
     def is_search(self, *args, **kwargs):
         return False
 
-    def copy(self, username, src_file_id, dest_file_id, **kwargs):
+    def copy(self, username, src_file_id, dest_file_id, checkpoint_id=None, **kwargs):
         try:
             n = Notification(event_type='data',
                              status=Notification.INFO,
@@ -182,7 +185,8 @@ class FileManager(object):
                 downloaded_file_path = self.download_file(path, dest_real_path)
                 levels = 1
             elif file_type == 'folder':
-                downloaded_file_path = self.download_folder(path, dest_real_path)
+                downloaded_file_path = self.download_folder(path, dest_real_path,
+                                                            checkpoint_id=checkpoint_id)
 
             n = Notification(event_type='data',
                              status=Notification.SUCCESS,
@@ -198,11 +202,14 @@ class FileManager(object):
             else:
                 agave_file_path = downloaded_file_path.replace(base_mounted_path, '', 1).strip('/')
 
+            # The legacy index is read by the legacy file manager,
+            # the change feed only updates the files index.
             reindex_agave.apply_async(kwargs={
                                       'username': user.username,
                                       'file_id': '{}/{}'.format(agave_system_id, agave_file_path)
                                       },
                                       queue='indexing')
+            FileChange.record(FileChange.CREATE, agave_system_id, agave_file_path)
         except:
             logger.exception('Unexpected task failure: dropbox_download', extra={
                 'username': username,
@@ -285,52 +292,52 @@ class FileManager(object):
         return file_download_path
 
 
-    def download_folder(self, path, download_path):
+    def list_folder(self, path):
         """
-        Recursively download the folder for path, and all of its contents, to the given
-        download_path.
+        Lists the folder for path.
 
         :param path:
-        :param download_path:
-        :return:
+        :return: tuple of the folder name, list of file paths and list of folder paths
         """
-        dropbox_folder = self.dropbox_api.files_list_folder(path)
-        has_more = dropbox_folder.has_more
-        cursor = dropbox_folder.cursor
         dropbox_folder_metadata = self.dropbox_api.files_alpha_get_metadata(path)
+        result = self.dropbox_api.files_list_folder(path)
+        files = []
+        folders = []
+        while True:
+            for item in result.entries:
+                if type(item) == FileMetadata:
+                    files.append(item.path_lower)
+                elif type(item) == FolderMetadata:
+                    folders.append(item.path_lower)
+            if not result.has_more:
+                break
+            result = self.dropbox_api.files_list_folder_continue(result.cursor)
 
-        # convert utf-8 chars
-        safe_dirname = dropbox_folder_metadata.name.encode(sys.getfilesystemencoding(), 'ignore')
-        directory_path = os.path.join(download_path, safe_dirname)
-        logger.debug('Creating directory %s <= dropbox://folder/%s', directory_path, path)
-        try:
-            os.mkdir(directory_path, 0o0755)
-        except OSError as e:
-            if e.errno == 17:  # directory already exists?
-                pass
-            else:
-                logger.exception('Error creating directory: %s', directory_path)
-                raise
+        return dropbox_folder_metadata.name, files, folders
 
-        items = dropbox_folder.entries
+    def create_folder(self, dropbox_parent_folder, name):
+        """
+        Dropbox creates the parent folders of an uploaded file, only the
+        path of the new folder is returned.
+        """
+        logger.info('Create directory %s in dropbox folder/%s', name, dropbox_parent_folder)
+        return '%s/%s' % (dropbox_parent_folder, name)
 
-        while True:
-            for item in items:
-                if type(item)==FileMetadata:
-                    self.download_file(item.path_lower, directory_path)
-                elif type(item)==FolderMetadata:
-                    self.download_folder(item.path_lower, directory_path)
-            if has_more:
-                folder = self.dropbox_api.files_list_folder_continue(cursor)
-                items = folder.entries
-                has_more = items.has_more
-                cursor = items.cursor
-            else:
-                break
+    def download_folder(self, path, download_path, checkpoint_id=None):
+        """
+        Downloads the folder for path, and all of its contents, to the given
+        download_path. Files are downloaded in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
 
-        return directory_path
+        :param path:
+        :param download_path:
+        :param checkpoint_id: id used to resume the transfer
+        :return: the full path to the downloaded folder
+        """
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        return engine.download_folder(path, download_path)
 
-    def upload(self, username, src_file_id, dest_file_id):
+    def upload(self, username, src_file_id, dest_file_id, checkpoint_id=None):
         try:
             n = Notification(event_type='data',
                              status=Notification.INFO,
@@ -367,7 +374,8 @@ class FileManager(object):
             if os.path.isfile(src_real_path):
                 self.upload_file(path, src_real_path)
             elif os.path.isdir(src_real_path):
-                self.upload_directory(path, src_real_path)
+                self.upload_directory(path, src_real_path,
+                                      checkpoint_id=checkpoint_id)
             else:
                 logger.error('Unable to upload %s: file does not exist!',
                              src_real_path)
@@ -396,58 +404,66 @@ class FileManager(object):
             raise
 
     def upload_file(self, dropbox_path, file_real_path):
-        file_path, file_name = os.path.split(file_real_path)
-        with open(file_real_path, 'rb') as file_handle:
-            f = file_handle.read()
-            file_size = os.path.getsize(file_path)
-
-            CHUNK_SIZE = 4 * 1024 * 1024 # 4MB
-
-            if file_size <= CHUNK_SIZE:
-                logger.debug('dropbox_path: %s, file_name: %s', dropbox_path, file_name),
-                self.dropbox_api.files_upload(f, '%s/%s' % (dropbox_path, file_name))
-            else:
-
-                upload_session_start_result = self.dropbox_api.files_upload_session_start(f.read(CHUNK_SIZE))
-                cursor = dropbox.files.UploadSessionCursor(session_id=upload_session_start_result.session_id,
-                                                           offset=f.tell())
-                commit = dropbox.files.CommitInfo(path=file_path)
-
-                while f.tell() < file_size:
-                    if ((file_size - f.tell()) <= CHUNK_SIZE):
-                        print self.dropbox_api.files_upload_session_finish(f.read(CHUNK_SIZE), cursor, commit)
-                    else:
-                        self.dropbox_api.files_upload_session_append(f.read(CHUNK_SIZE), cursor.session_id, cursor.offset)
-                        cursor.offset = f.tell()
-            logger.info('Successfully uploaded %s to dropbox:folder/%s',
-                        file_real_path, file_path)
+        """Uploads a file to dropbox
 
+        Files larger than a chunk are streamed with an upload session.
+        Only one chunk is in memory at a time and the session is resumed
+        at the offset dropbox expects after an error.
 
-    def upload_directory(self, dropbox_parent_folder, dir_real_path):
+        :param str dropbox_path: dropbox folder to upload the file to.
+        :param str file_real_path: real path of the file to upload.
         """
-        Recursively uploads the directory and all of its contents (subdirectories and files)
-        to the dropbox folder specified by dropbox_parent_folder.
+        file_path, file_name = os.path.split(file_real_path)
+        dest_path = '%s/%s' % (dropbox_path, file_name)
+        upload = ChunkedUpload(file_real_path,
+                               username=self._user.username,
+                               operation='dropbox_upload',
+                               retry_on=(InternalServerError,))
+        logger.debug('dropbox_path: %s, file_name: %s', dropbox_path, file_name)
+
+        if upload.file_size <= upload.chunk_size:
+            upload.retry(self.dropbox_api.files_upload,
+                         upload.read_chunk(0), dest_path)
+        else:
+            def start(data):
+                result = self.dropbox_api.files_upload_session_start(data)
+                return UploadSessionCursor(session_id=result.session_id,
+                                           offset=len(data))
+
+            def append(cursor, data, offset):
+                cursor.offset = offset
+                self.dropbox_api.files_upload_session_append_v2(data, cursor)
+
+            def finish(cursor, data, offset):
+                cursor.offset = offset
+                return self.dropbox_api.files_upload_session_finish(
+                    data, cursor, CommitInfo(path=dest_path))
+
+            def resume(cursor, exc):
+                if not isinstance(exc, ApiError):
+                    return None
+                error = exc.error
+                if hasattr(error, 'is_lookup_failed') and error.is_lookup_failed():
+                    error = error.get_lookup_failed()
+                if hasattr(error, 'is_incorrect_offset') and error.is_incorrect_offset():
+                    return error.get_incorrect_offset().correct_offset
+                return None
+
+            upload.upload(start, append, finish, resume)
+
+        logger.info('Successfully uploaded %s to dropbox:folder/%s',
+                    file_real_path, dropbox_path)
+
+    def upload_directory(self, dropbox_parent_folder, dir_real_path, checkpoint_id=None):
+        """
+        Uploads the directory and all of its contents (subdirectories and files)
+        to the dropbox folder specified by dropbox_parent_folder. Files are
+        uploaded in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
 
         :param dropbox_parent_folder: The dropbox folder to upload the directory to.
         :param dir_real_path: The real path on the filesystem of the directory to upload.
-        :return:
+        :param checkpoint_id: id used to resume the transfer
         """
-
-        dirparentpath, dirname = os.path.split(dir_real_path)
-        # dropbox_parent_folder = self.dropbox_api.folder(dropbox_parent_folder)
-        logger.info('Create directory %s in dropbox folder/%s', dirname, dropbox_parent_folder)
-        # box_folder = box_parent_folder.create_subfolder(dirname)
-
-        for dirpath, subdirnames, filenames in os.walk(dir_real_path):
-            # upload all the files
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                self.upload_file('%s/%s' % (dropbox_parent_folder, dirname), filepath)
-
-            # upload all the subdirectories
-            for subdirname in subdirnames:
-                subdirpath = os.path.join(dirpath, subdirname)
-                self.upload_directory('%s/%s' % (dropbox_parent_folder, dirname), subdirpath)
-
-            # prevent further walk, because recursion
-            subdirnames[:] = []
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        engine.upload_directory(dropbox_parent_folder, dir_real_path)
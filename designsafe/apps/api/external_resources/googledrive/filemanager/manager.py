@@ -4,10 +4,14 @@ import re
 import sys
 import logging
 import io
+import socket
 import time
 from designsafe.apps.api.tasks import reindex_agave
+from designsafe.apps.data.models.changes import FileChange
 from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.external_resources.googledrive.models.files import GoogleDriveFile
+from designsafe.apps.api.external_resources.transfers import TransferEngine
+from designsafe.apps.api.external_resources.uploads import ChunkedUpload
 from designsafe.apps.api.notifications.models import Notification
 from designsafe.apps.googledrive_integration.models import GoogleDriveUserToken
 from django.contrib.auth import get_user_model
@@ -123,7 +127,7 @@ class FileManager(object):
     def is_search(self, *args, **kwargs):
         return False
 
-    def copy(self, username, src_file_id, dest_file_id, **kwargs):
+    def copy(self, username, src_file_id, dest_file_id, checkpoint_id=None, **kwargs):
         try:
             file_type, file_id = self.parse_file_id(file_id=src_file_id)
 
@@ -168,7 +172,8 @@ class FileManager(object):
                     return None
 
             elif file_type == 'folder':
-                downloaded_file_path = self.download_folder(file_id, dest_real_path, username)
+                downloaded_file_path = self.download_folder(file_id, dest_real_path, username,
+                                                            checkpoint_id=checkpoint_id)
 
             n = Notification(event_type='data',
                              status=Notification.SUCCESS,
@@ -184,11 +189,14 @@ class FileManager(object):
             else:
                 agave_file_path = downloaded_file_path.replace(base_mounted_path, '', 1).strip('/')
 
+            # The legacy index is read by the legacy file manager,
+            # the change feed only updates the files index.
             reindex_agave.apply_async(kwargs={
                                       'username': user.username,
                                       'file_id': '{}/{}'.format(agave_system_id, agave_file_path)
                                       },
                                       queue='indexing')
+            FileChange.record(FileChange.CREATE, agave_system_id, agave_file_path)
         except Exception as e:
             logger.exception('Unexpected task failure: googledrive_copy', extra={
                 'username': username,
@@ -347,58 +355,59 @@ class FileManager(object):
 
         return file_download_path
 
-    def download_folder(self, folder_id, download_path, username):
+    def list_folder(self, folder_id):
         """
-        Recursively download the folder for folder_id, and all of its contents, to the given
-        download_path.
+        Lists the folder for folder_id.
 
         :param folder_id:
-        :param download_path:
-        :return:
+        :return: tuple of the folder name, list of file ids and list of folder ids
         """
         googledrive_folder = self.googledrive_api.files().get(fileId=folder_id, fields="name").execute()
-        # convert utf-8 chars
-        safe_dirname = googledrive_folder['name'].encode(sys.getfilesystemencoding(), 'ignore')
-        directory_path = os.path.join(download_path, safe_dirname)
-        logger.debug('Creating directory %s <= googledrive://folder/%s', directory_path, folder_id)
-        try:
-            os.mkdir(directory_path, 0o0755)
-        except OSError as e:
-            if e.errno == 17:  # directory already exists?
-                pass
-            else:
-                logger.exception('Error creating directory: %s', directory_path)
-                raise
+        files = []
+        folders = []
+        page_token = None
+        while True:
+            items = self.googledrive_api.files().list(
+                q="'{}' in parents and trashed=False".format(folder_id),
+                fields='nextPageToken, files(id, mimeType)',
+                pageToken=page_token).execute()
+            for item in items['files']:
+                if item['mimeType'] == 'application/vnd.google-apps.folder':
+                    folders.append(item['id'])
+                else:
+                    files.append(item['id'])
+            page_token = items.get('nextPageToken')
+            if page_token is None:
+                break
 
-        items = self.googledrive_api.files().list(q="'{}' in parents and trashed=False".format(folder_id)).execute()
-        for item in items['files']:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                self.download_folder(item['id'], directory_path, username)
-            else:
-                try:
-                    self.download_file(item['id'], directory_path, username)
-                    logger.info('Google File download complete: {}'.format('/'.join([directory_path, item['id']])))
-                except Exception as e:
-                    logger.exception('Unexpected task failure: googledrive_download', extra={
-                        'username': username,
-                        'file_id': item['id'],
-                        'dest_file_id': '/'.join([directory_path, item['id']]),
-                        'error_type': type(e),
-                        'error': str(e)
-                    })
-                    n = Notification(event_type='data',
-                                    status=Notification.ERROR,
-                                    operation='googledrive_download_error',
-                                    message='We were unable to download file from Google Drive. '
-                                            'Please try again...',
-                                    user=username,
-                                    extra={'path': item['name']})
-                    n.save()
-                    raise
+        return googledrive_folder['name'], files, folders
+
+    def create_folder(self, parent_folder_id, name):
+        """
+        Creates a folder named name in parent_folder_id.
+
+        :return: the id of the new folder
+        """
+        logger.info('Create directory %s in Google Drive folder/%s', name, parent_folder_id)
+        folder_metadata = {'name': name, 'parents': [parent_folder_id],
+                           'mimeType': 'application/vnd.google-apps.folder'}
+        return self.googledrive_api.files().create(body=folder_metadata, fields='id').execute()['id']
 
-        return directory_path
+    def download_folder(self, folder_id, download_path, username, checkpoint_id=None):
+        """
+        Downloads the folder for folder_id, and all of its contents, to the given
+        download_path. Files are downloaded in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
+
+        :param folder_id:
+        :param download_path:
+        :param checkpoint_id: id used to resume the transfer
+        :return: the full path to the downloaded folder
+        """
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        return engine.download_folder(folder_id, download_path, username)
 
-    def upload(self, username, src_file_id, dest_folder_id):
+    def upload(self, username, src_file_id, dest_folder_id, checkpoint_id=None):
         try:
             n = Notification(event_type='data',
                              status=Notification.INFO,
@@ -439,7 +448,8 @@ class FileManager(object):
             if os.path.isfile(src_real_path):
                 self.upload_file(folder_id, src_real_path)
             elif os.path.isdir(src_real_path):
-                self.upload_directory(folder_id, src_real_path)
+                self.upload_directory(folder_id, src_real_path,
+                                      checkpoint_id=checkpoint_id)
             else:
                 logger.error('Unable to upload %s: file does not exist!',
                              src_real_path)
@@ -469,7 +479,16 @@ class FileManager(object):
             raise
 
     def upload_file(self, folder_id, file_real_path):
+        """Uploads a file to Google Drive
+
+        Files larger than a chunk are sent with a resumable upload.
+        The client reads one chunk at a time from disk, retries server
+        errors and resumes the upload from the last byte Google Drive
+        received after an interruption.
 
+        :param str folder_id: Google Drive folder to upload the file to.
+        :param str file_real_path: real path of the file to upload.
+        """
         file_path, file_name = os.path.split(file_real_path)
         file_metadata = {'name': file_name, 'parents': [folder_id]}
         logger.debug('file_metadata:{}'.format(file_metadata))
@@ -478,56 +497,42 @@ class FileManager(object):
             # Required for files with names like '.astylerc'
             mimetype = "text/plain"
 
-        CHUNK_SIZE = 5 * 1024 * 1024 # 5MB
-        file_size = os.path.getsize(file_path)
+        upload = ChunkedUpload(file_real_path,
+                               username=self._user.username,
+                               operation='googledrive_upload',
+                               retry_on=(socket.error,))
 
-        if file_size < CHUNK_SIZE:
+        if upload.file_size <= upload.chunk_size:
             media = MediaFileUpload(file_real_path, mimetype=mimetype)
-            uploaded_file = self.googledrive_api.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            logger.info('Successfully uploaded %s to googledrive:folder/%s as googledrive:file/%s',
-                    file_real_path, folder_id, uploaded_file.get('id'))
+            request = self.googledrive_api.files().create(body=file_metadata, media_body=media, fields='id')
+            response = upload.retry(request.execute, num_retries=upload.max_retries)
         else:
-            media = MediaFileUpload(file_real_path, mimetype=mimetype, resumable=True)
-            request = self.googledrive_api.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            media.stream()
+            # Chunk size has to be a multiple of 256KB.
+            chunk_size = upload.chunk_size - upload.chunk_size % (256 * 1024)
+            media = MediaFileUpload(file_real_path, mimetype=mimetype,
+                                    chunksize=chunk_size, resumable=True)
+            request = self.googledrive_api.files().create(body=file_metadata, media_body=media, fields='id')
             response = None
             while response is None:
-                status, response = request.next_chunck()
+                status, response = upload.retry(request.next_chunk,
+                                                num_retries=upload.max_retries)
                 if status:
-                    logger.debug("Uploaded {}%% to google drive".format(status.progress() * 100))
-            logger.info('Successfully uploaded %s to googledrive:folder/%s as googledrive:file/%s',
-                    file_real_path, folder_id, response['id'])
+                    upload.progress(status.resumable_progress)
+            upload.progress(upload.file_size, force=True)
 
+        logger.info('Successfully uploaded %s to googledrive:folder/%s as googledrive:file/%s',
+                    file_real_path, folder_id, response['id'])
 
-    def upload_directory(self, parent_folder_id, dir_real_path):
+    def upload_directory(self, parent_folder_id, dir_real_path, checkpoint_id=None):
         """
-        Recursively uploads the directory and all of its contents (subdirectories and files)
-        to the Google Drive folder specified by parent_folder_id.
+        Uploads the directory and all of its contents (subdirectories and files)
+        to the Google Drive folder specified by parent_folder_id. Files are
+        uploaded in parallel, see
+        :class:`~designsafe.apps.api.external_resources.transfers.TransferEngine`.
 
         :param parent_folder_id: The Google Drive folder to upload the directory to.
         :param dir_real_path: The real path on the filesystem of the directory to upload.
-        :return: The new Google Drive folder.
+        :param checkpoint_id: id used to resume the transfer
         """
-
-        dirparentpath, dirname = os.path.split(dir_real_path)
-        logger.info('Create directory %s in Google Drive folder/%s', dirname, parent_folder_id)
-
-        folder_metadata = {'name': dirname, 'parents': parent_folder_id, 'mimeType':'application/vnd.google-apps.folder'}
-
-        googledrive_folder = self.googledrive_api.files().create(body=folder_metadata, fields='id').execute()
-
-        for dirpath, subdirnames, filenames in os.walk(dir_real_path):
-            # upload all the files
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                self.upload_file(googledrive_folder['id'], filepath)
-
-            # upload all the subdirectories
-            for subdirname in subdirnames:
-                subdirpath = os.path.join(dirpath, subdirname)
-                self.upload_directory(googledrive_folder['id'], subdirpath)
-
-            # prevent further walk, because recursion
-            subdirnames[:] = []
-
-        return googledrive_folder
+        engine = TransferEngine(self, checkpoint_id=checkpoint_id)
+        engine.upload_directory(parent_folder_id, dir_real_path)
@@ -0,0 +1,241 @@
+"""Parallel transfers of folders between the Data Depot and external resources.
+
+    A folder transfer is done in two steps. First the tree is planned:
+    the folders are walked and created on the destination. Then the files
+    are transferred by a bounded pool of workers. Every provider has its
+    own number of workers and rate limit, see
+    ``settings.EXTERNAL_RESOURCES_TRANSFERS``.
+
+    Completed items are checkpointed in the cache under the id of the
+    transfer, usually the celery task id. A retried task resumes the
+    transfer instead of starting over.
+
+    Managers used with :class:`TransferEngine` implement:
+
+        * ``list_folder(folder_id)``: returns ``(name, files, folders)``
+          where ``files`` and ``folders`` are lists of ids.
+        * ``create_folder(parent_id, name)``: returns the id of the new
+          folder.
+        * ``download_file(file_id, directory_path, *args)``
+        * ``upload_file(folder_id, file_real_path)``
+"""
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.cache import cache
+from designsafe.apps.data.managers.indexer import RateLimiter
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+
+class TransferError(Exception):
+    """Raised when some files could not be transferred.
+
+    :ivar list failed: ids or paths of the files which failed.
+    """
+    def __init__(self, message, failed=None):
+        super(TransferError, self).__init__(message)
+        self.failed = failed or []
+
+
+class TransferEngine(object):
+    """Transfers the files of a folder with a pool of workers.
+
+    :param manager: external resource file manager
+    :param str checkpoint_id: id used to checkpoint completed items,
+        e.g. the celery task id. Nothing is checkpointed if `None`.
+    :param int max_workers: number of files transferred at a time.
+    :param float rate_limit: max number of files started per second.
+
+    .. note:: API clients are not guaranteed to be thread safe
+        (e.g. ``httplib2`` used by Google Drive). Every worker uses its
+        own manager, built by ``manager.worker_manager()`` when the
+        manager implements it, e.g. to share credentials between workers.
+    """
+    def __init__(self, manager, checkpoint_id=None, max_workers=None,
+                 rate_limit=None):
+        transfers_settings = getattr(settings, 'EXTERNAL_RESOURCES_TRANSFERS', {})
+        provider_settings = transfers_settings.get(manager.NAME, {})
+        self.manager = manager
+        self.checkpoint_id = checkpoint_id
+        self.max_workers = max_workers or provider_settings.get('max_workers', 4)
+        self.rate_limit = rate_limit or provider_settings.get('rate_limit')
+        self.max_retries = transfers_settings.get('max_retries', 3)
+        self.retry_delay = transfers_settings.get('retry_delay', 2)
+        self.checkpoint_timeout = transfers_settings.get('checkpoint_timeout',
+                                                         60 * 60 * 24)
+        self._local = threading.local()
+
+    def _worker_manager(self):
+        """Manager used by the current worker thread"""
+        if getattr(self._local, 'manager', None) is None:
+            if hasattr(self.manager, 'worker_manager'):
+                self._local.manager = self.manager.worker_manager()
+            else:
+                self._local.manager = type(self.manager)(self.manager._user)
+        return self._local.manager
+
+    def _checkpoint_key(self, key):
+        return 'transfers:{}:{}'.format(
+            self.checkpoint_id,
+            hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def checkpointed(self, key):
+        """Returns the value checkpointed for `key` or `None`"""
+        if self.checkpoint_id is None:
+            return None
+        return cache.get(self._checkpoint_key(key))
+
+    def checkpoint(self, key, value=True):
+        """Records `key` as done"""
+        if self.checkpoint_id is None:
+            return
+        cache.set(self._checkpoint_key(key), value, self.checkpoint_timeout)
+
+    def plan_upload(self, dest_folder_id, dir_real_path):
+        """Creates the folder tree on the destination
+
+        :param str dest_folder_id: folder to upload the directory to.
+        :param str dir_real_path: real path of the directory to upload.
+
+        :returns: list of ``(file_real_path, folder_id)`` to upload.
+        """
+        items = []
+        stack = [(dest_folder_id, dir_real_path)]
+        while stack:
+            parent_id, real_path = stack.pop()
+            folder_key = 'folder:{}'.format(real_path)
+            folder_id = self.checkpointed(folder_key)
+            if folder_id is None:
+                folder_id = self.manager.create_folder(
+                    parent_id, os.path.basename(real_path))
+                self.checkpoint(folder_key, folder_id)
+
+            for name in sorted(os.listdir(real_path)):
+                path = os.path.join(real_path, name)
+                if os.path.isdir(path):
+                    stack.append((folder_id, path))
+                else:
+                    items.append((path, folder_id))
+        return items
+
+    def plan_download(self, folder_id, download_path):
+        """Creates the folder tree locally
+
+        :param str folder_id: folder to download.
+        :param str download_path: real path to download the folder to.
+
+        :returns: tuple of the real path of the downloaded folder and
+            a list of ``(file_id, directory_path)`` to download.
+        """
+        items = []
+        directory_path = None
+        stack = [(folder_id, download_path)]
+        while stack:
+            current_id, parent_path = stack.pop()
+            name, files, folders = self.manager.list_folder(current_id)
+            # convert utf-8 chars
+            safe_dirname = name.encode(sys.getfilesystemencoding(), 'ignore')
+            path = os.path.join(parent_path, safe_dirname)
+            if directory_path is None:
+                directory_path = path
+            logger.debug('Creating directory %s <= %s://folder/%s',
+                         path, self.manager.NAME, current_id)
+            try:
+                os.mkdir(path, 0o0755)
+            except OSError as e:
+                if e.errno != 17:  # directory already exists?
+                    logger.exception('Error creating directory: %s', path)
+                    raise
+            items += [(file_id, path) for file_id in files]
+            stack += [(child_id, path) for child_id in folders]
+        return directory_path, items
+
+    def _transfer(self, method, key, limiter, *args):
+        """Transfers one file retrying on errors"""
+        attempt = 0
+        while True:
+            limiter.wait()
+            try:
+                result = getattr(self._worker_manager(), method)(*args)
+                self.checkpoint(key)
+                return result
+            except Exception:  # pylint: disable=broad-except
+                # The next attempt uses a new manager.
+                self._local.manager = None
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning('Error transferring %s, retry %d in %ds',
+                               key, attempt, delay, exc_info=True)
+                time.sleep(delay)
+
+    def run(self, method, items, *args):
+        """Calls `method` of a worker manager for every item
+
+        Items already checkpointed are skipped.
+
+        :param str method: manager method, ``upload_file`` or ``download_file``.
+        :param list items: list of ``(item, destination)`` tuples.
+        :param args: extra arguments given to `method`.
+
+        :raises TransferError: when some items failed after retrying.
+        """
+        limiter = RateLimiter(self.rate_limit)
+        failed = []
+        skipped = 0
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for item, dest in items:
+                key = '{}:{}:{}'.format(method, item, dest)
+                if self.checkpointed(key):
+                    skipped += 1
+                    continue
+                future = executor.submit(self._transfer, method, key,
+                                         limiter, item, dest, *args)
+                futures[future] = item
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Unable to transfer %s', futures[future])
+                    failed.append(futures[future])
+
+        logger.info('Transferred %d files in %.1fs (%d already done, %d failed)',
+                    len(items) - skipped - len(failed), time.time() - start,
+                    skipped, len(failed))
+        if failed:
+            raise TransferError('Unable to transfer {} files'.format(len(failed)),
+                                failed)
+
+    def upload_directory(self, dest_folder_id, dir_real_path):
+        """Uploads a directory and all of its contents
+
+        :param str dest_folder_id: folder to upload the directory to.
+        :param str dir_real_path: real path of the directory to upload.
+        """
+        items = self.plan_upload(dest_folder_id, dir_real_path)
+        self.run('upload_file', items)
+
+    def download_folder(self, folder_id, download_path, *args):
+        """Downloads a folder and all of its contents
+
+        :param str folder_id: folder to download.
+        :param str download_path: real path to download the folder to.
+        :param args: extra arguments given to ``download_file``.
+
+        :returns: the real path of the downloaded folder.
+        """
+        directory_path, items = self.plan_download(folder_id, download_path)
+        self.run('download_file', items, *args)
+        return directory_path
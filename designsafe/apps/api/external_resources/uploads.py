@@ -0,0 +1,186 @@
+"""Chunked uploads to external resources.
+
+    Files copied from the Data Depot to Box, Dropbox or Google Drive can
+    be several GB. This module streams those files from disk in fixed-size
+    chunks so no more than one chunk is held in memory. Every chunk is
+    retried on transient errors and the progress of the upload is sent to
+    the user through the notifications websocket channel. Progress is not
+    stored, only the final status of the upload is saved as a
+    :class:`~designsafe.apps.api.notifications.models.Notification` by the
+    caller.
+"""
+import logging
+import os
+import time
+from django.conf import settings
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+
+class ChunkedUpload(object):
+    """Streams a local file to an external resource in chunks.
+
+    The external resource specific calls are given as callables. For
+    upload sessions use :meth:`upload`, for clients which already
+    implement a resumable protocol (e.g. Google Drive) use :meth:`retry`
+    and :meth:`progress` directly.
+
+    :param str file_real_path: real path of the file to upload
+    :param int chunk_size: size of every chunk in bytes.
+        Default ``settings.EXTERNAL_RESOURCES_UPLOADS['chunk_size']``
+    :param str username: user to notify the upload progress to
+    :param str operation: notification operation prefix,
+        e.g. ``dropbox_upload``
+    :param tuple retry_on: exception classes which are considered transient
+
+    .. rubric:: Example
+
+        >>> upload = ChunkedUpload('/path/to/file', username='user',
+        ...                        operation='dropbox_upload')
+        >>> upload.upload(start, append, finish)
+    """
+    TRANSIENT_ERRORS = (RequestsConnectionError, Timeout)
+
+    def __init__(self, file_real_path, chunk_size=None, username=None,
+                 operation='upload', retry_on=()):
+        uploads_settings = getattr(settings, 'EXTERNAL_RESOURCES_UPLOADS', {})
+        self.file_real_path = file_real_path
+        self.file_name = os.path.basename(file_real_path)
+        self.file_size = os.path.getsize(file_real_path)
+        self.chunk_size = chunk_size or uploads_settings.get('chunk_size',
+                                                             8 * 1024 * 1024)
+        self.username = username
+        self.operation = operation
+        self.retry_on = self.TRANSIENT_ERRORS + tuple(retry_on)
+        self.max_retries = uploads_settings.get('max_retries', 5)
+        self.retry_delay = uploads_settings.get('retry_delay', 2)
+        self.progress_interval = uploads_settings.get('progress_interval', 30)
+        self.max_resumes = uploads_settings.get('max_resumes', 5)
+        self._started = None
+        self._last_progress = None
+
+    def chunks(self, offset=0):
+        """Yields ``(offset, data)`` tuples reading one chunk at a time"""
+        with open(self.file_real_path, 'rb') as file_handle:
+            file_handle.seek(offset)
+            while True:
+                data = file_handle.read(self.chunk_size)
+                if not data:
+                    break
+                yield offset, data
+                offset += len(data)
+
+    def read_chunk(self, offset):
+        """Reads a single chunk starting at `offset`"""
+        with open(self.file_real_path, 'rb') as file_handle:
+            file_handle.seek(offset)
+            return file_handle.read(self.chunk_size)
+
+    def retry(self, func, *args, **kwargs):
+        """Calls `func` retrying on transient errors with exponential backoff"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except self.retry_on as exc:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning('Transient error uploading %s, retry %d in %ds: %s',
+                               self.file_real_path, attempt, delay, exc)
+                time.sleep(delay)
+
+    def progress(self, bytes_sent, force=False):
+        """Reports the upload progress
+
+        A progress message is sent at most every
+        ``settings.EXTERNAL_RESOURCES_UPLOADS['progress_interval']`` seconds.
+        """
+        from designsafe.apps.api.notifications.receivers import publish_progress
+        now = time.time()
+        if self._started is None:
+            self._started = self._last_progress = now
+        if not force and now - self._last_progress < self.progress_interval:
+            return
+
+        self._last_progress = now
+        elapsed = now - self._started
+        rate = bytes_sent / elapsed if elapsed else bytes_sent
+        logger.info('Uploaded %d/%d bytes of %s (%.1f bytes/s)', bytes_sent,
+                    self.file_size, self.file_real_path, rate)
+        if self.username is None:
+            return
+
+        publish_progress(self.username, '%s_progress' % self.operation,
+                         'Uploading %s: %d%% (%.1f MB/s).' % (
+                             self.file_name,
+                             bytes_sent * 100 / (self.file_size or 1),
+                             rate / (1024 * 1024)),
+                         {'name': self.file_name,
+                          'bytes_sent': bytes_sent,
+                          'file_size': self.file_size,
+                          'bytes_per_second': rate})
+
+    def upload(self, start, append, finish, resume=None):
+        """Uploads the file using an upload session
+
+        :param callable start: ``start(data)`` starts the session with the
+            first chunk and returns the session.
+        :param callable append: ``append(session, data, offset)`` uploads
+            a chunk.
+        :param callable finish: ``finish(session, data, offset)`` uploads
+            the last chunk, it might be empty, and returns the uploaded file.
+        :param callable resume: ``resume(session, exc)`` returns the offset
+            the external resource expects after an error, or `None` if the
+            error can not be recovered from by resuming the session.
+
+        :returns: the return value of `finish`
+
+        The session is resumed at most
+        ``settings.EXTERNAL_RESOURCES_UPLOADS['max_resumes']`` times, and
+        only if the expected offset moved forward since the last resume,
+        otherwise the error is raised.
+        """
+        self._started = self._last_progress = time.time()
+        offset = 0
+        resumes = 0
+        resume_offset = None
+        data = self.read_chunk(offset)
+        session = self.retry(start, data)
+        offset += len(data)
+        self.progress(offset)
+        while True:
+            data = self.read_chunk(offset)
+            is_last = offset + len(data) >= self.file_size
+            func = finish if is_last else append
+            try:
+                result = self.retry(func, session, data, offset)
+            except Exception as exc:  # pylint: disable=broad-except
+                last_resume_offset = resume_offset
+                resume_offset = resume(session, exc) if resume else None
+                if resume_offset is None:
+                    raise
+                resumes += 1
+                if resumes > self.max_resumes:
+                    logger.error('Upload session of %s resumed %d times, giving up',
+                                 self.file_real_path, self.max_resumes)
+                    raise
+                if last_resume_offset is not None and \
+                   resume_offset <= last_resume_offset:
+                    logger.error('Upload session of %s did not move past offset %d',
+                                 self.file_real_path, last_resume_offset)
+                    raise
+                logger.warning('Resuming upload session of %s at offset %d',
+                               self.file_real_path, resume_offset)
+                offset = resume_offset
+                continue
+
+            offset += len(data)
+            if is_last:
+                self.progress(offset, force=True)
+                return result
+            self.progress(offset)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations
+import jsonfield.fields
+
+
+def invalid_extra_to_json(apps, schema_editor):
+    """Replaces every `extra` which is not valid JSON with an empty object,
+    as ``to_dict`` used to, rows are loaded through JSONField afterwards"""
+    for model_name in ('Notification', 'Broadcast'):
+        model = apps.get_model('notifications_api', model_name)
+        model.objects.filter(extra='').update(extra='{}')
+        invalid = []
+        for pk, extra in model.objects.values_list('pk', 'extra').iterator():
+            try:
+                json.loads(extra)
+            except (TypeError, ValueError):
+                invalid.append(pk)
+        for start in range(0, len(invalid), 500):
+            model.objects.filter(pk__in=invalid[start:start + 500]).update(extra='{}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications_api', '0004_jobevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(invalid_extra_to_json, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='broadcast',
+            name='extra',
+            field=jsonfield.fields.JSONField(default=dict, dump_kwargs={'cls': DjangoJSONEncoder}),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='extra',
+            field=jsonfield.fields.JSONField(default=dict, dump_kwargs={'cls': DjangoJSONEncoder}),
+        ),
+        migrations.AlterIndexTogether(
+            name='notification',
+            index_together=set([('user', 'deleted', 'read', 'datetime')]),
+        ),
+    ]
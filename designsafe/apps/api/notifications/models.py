@@ -1,5 +1,9 @@
-from django.db import models
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
 from django.core.serializers.json import DjangoJSONEncoder
+from jsonfield import JSONField
 import datetime
 import logging
 import json
@@ -19,7 +23,7 @@ class BaseNotify(models.Model):
     jobId = models.CharField(max_length=255, blank=True)
     operation = models.CharField(max_length = 255, default = '')
     message = models.TextField(default='')
-    extra = models.TextField(default='')
+    extra = JSONField(default=dict, dump_kwargs={'cls': DjangoJSONEncoder})
     action_link = models.TextField(default='')
 
     SUCCESS = GREEN = 'SUCCESS'
@@ -36,57 +40,170 @@ class BaseNotify(models.Model):
     ACTION_LINK = 'action_link'
 
     def to_dict(self):
-        try:
-            extra = json.loads(self.extra)
-        except ValueError:
-            logger.debug('extra: %s, id: %s', self.extra, self.id)
-            extra = {}
         d = {
             'event_type': self.event_type,
             'datetime': self.datetime.strftime('%s'),
             'status': self.status,
             'operation': self.operation,
             'message': self.message,
-            'extra': extra,
+            'extra': self.extra,
             'pk': self.pk,
             'action_link': self.action_link
         }
         return d
 
     def save(self, *args, **kwargs):
-        if isinstance(self.extra, dict):
-            try:
-                self.extra = json.dumps(self.extra, cls=DjangoJSONEncoder)
-            except TypeError:
+        try:
+            super(BaseNotify, self).save(*args, **kwargs)
+        except TypeError:
+            if isinstance(self.extra, dict):
                 for key in six.iterkeys(self.extra):
                     try:
-                        json.dumps(self.extra[key])
+                        json.dumps(self.extra[key], cls=DjangoJSONEncoder)
                     except TypeError:
                         logger.debug('Keys with error: %s . Value: %s', key, self.extra[key])
-                        raise
-
-        super(BaseNotify, self).save(*args, **kwargs)
+            raise
 
     @property
     def extra_content(self):
-        return json.loads(self.extra)
+        return self.extra
 
     class Meta:
         abstract = True
 
+class NotificationManager(models.Manager):
+
+    @staticmethod
+    def _unread_key(username):
+        return 'notifications:unread:{}'.format(username)
+
+    def unread_count(self, username):
+        """Returns the number of unread notifications of a user
+
+        The count is cached and kept up to date by the paths which create,
+        read or delete notifications, see :meth:`adjust_unread`. It is
+        counted again after ``settings.NOTIFICATIONS_UNREAD_CACHE_TTL``
+        seconds, which bounds the error when a notification is created
+        while the count is computed.
+        """
+        key = self._unread_key(username)
+        count = cache.get(key)
+        if count is None:
+            count = self.filter(user=username, deleted=False, read=False).count()
+            cache.add(key, count,
+                      getattr(settings, 'NOTIFICATIONS_UNREAD_CACHE_TTL', 60 * 5))
+        return max(count, 0)
+
+    def adjust_unread(self, username, delta):
+        """Adds `delta` to the cached unread count of a user
+
+        :returns: the new count or `None` if it is not cached.
+        """
+        key = self._unread_key(username)
+        try:
+            if delta >= 0:
+                return cache.incr(key, delta)
+            return max(cache.decr(key, -delta), 0)
+        except ValueError:
+            return None
+
+    def reset_unread(self, username):
+        """Drops the cached unread count of a user, it is counted again
+        on the next :meth:`unread_count`"""
+        cache.delete(self._unread_key(username))
+
+    def bulk_notify(self, users, event_type, status, operation, message,
+                    extra=None, action_link='', job_id=''):
+        """Notifies many users of the same event.
+
+        Rows are inserted with a single ``bulk_create`` and the websocket
+        messages are published in a single redis pipeline. ``post_save``
+        is not sent.
+
+        .. note:: Only some databases (e.g. PostgreSQL) return the ids of
+            bulk inserted rows. Otherwise the ids are looked up by user,
+            operation and datetime, and a notification whose row cannot be
+            told apart from another one (e.g. a concurrent call in the same
+            microsecond) keeps a `None` pk.
+
+        :param list users: usernames to notify.
+        :param dict extra: extra content of the notifications.
+
+        :returns: the saved notifications
+        :rtype: list of :class:`Notification`
+        """
+        users = list(OrderedDict.fromkeys(users))
+        if not users:
+            return []
+
+        extra = extra if extra is not None else {}
+        now = datetime.datetime.now()
+        fields = dict(event_type=event_type, status=status,
+                      operation=operation, message=message, extra=extra,
+                      action_link=action_link, jobId=job_id, datetime=now)
+        with transaction.atomic():
+            notifications = self.bulk_create(
+                [self.model(user=user, **fields) for user in users])
+            if any(n.pk is None for n in notifications):
+                pks = {}
+                for user, pk in self.filter(datetime=now, operation=operation,
+                                            user__in=users).values_list('user', 'pk'):
+                    pks.setdefault(user, []).append(pk)
+                for n in notifications:
+                    user_pks = pks.get(n.user, [])
+                    n.pk = user_pks[0] if len(user_pks) == 1 else None
+
+        messages = []
+        for n in notifications:
+            data = {
+                'event_type': event_type,
+                'datetime': now.strftime('%s'),
+                'status': status,
+                'operation': operation,
+                'message': message,
+                'action_link': action_link,
+                'read': False,
+                'deleted': False,
+                'extra': extra,
+                'user': n.user,
+                'pk': n.pk
+            }
+            unread = self.adjust_unread(n.user, 1)
+            if unread is not None:
+                data['unread'] = unread
+            messages.append(({'users': [n.user]},
+                             json.dumps(data, cls=DjangoJSONEncoder)))
+        try:
+            from designsafe.apps.api.notifications.receivers import get_publisher
+            get_publisher().publish_messages(messages)
+        except Exception:  # pylint: disable=broad-except
+            logger.debug('Exception sending websocket messages', exc_info=True)
+        return notifications
+
 class Notification(BaseNotify):
     # what are the agave length defaults?
     user = models.CharField(max_length=20, db_index=True)
     read = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
 
+    objects = NotificationManager()
+
+    class Meta:
+        index_together = [('user', 'deleted', 'read', 'datetime')]
+
     def mark_read(self):
+        was_unread = not self.read and not self.deleted
         self.read = True
         self.save()
+        if was_unread:
+            Notification.objects.adjust_unread(self.user, -1)
 
     def mark_deleted(self):
+        was_unread = not self.read and not self.deleted
         self.deleted = True
         self.save()
+        if was_unread:
+            Notification.objects.adjust_unread(self.user, -1)
 
     def to_dict(self):
         event_data = super(Notification, self).to_dict()
@@ -106,3 +223,37 @@ class Broadcast(BaseNotify):
             'group': self.group
         })
         return event_data
+
+class JobEvent(models.Model):
+    """A job status webhook which has not been processed yet.
+
+    Webhooks sent by Agave are recorded as they are received and
+    processed in batches by
+    :func:`~designsafe.apps.workspace.tasks.process_job_events`.
+    Only the latest event of every job in a batch notifies the user.
+    """
+    job_id = models.CharField(max_length=255, db_index=True)
+    status = models.CharField(max_length=32)
+    body = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    @classmethod
+    def record(cls, job):
+        """Records a job status webhook
+
+        :param dict job: webhook data
+
+        :returns: the saved event
+        :rtype: :class:`JobEvent`
+        """
+        event = cls(job_id=job['id'], status=job.get('status', ''),
+                    body=json.dumps(job, cls=DjangoJSONEncoder))
+        event.save()
+        return event
+
+    @property
+    def job(self):
+        return json.loads(self.body)
@@ -1,4 +1,5 @@
 from django.dispatch import receiver
+from django.conf import settings
 from ws4redis.publisher import RedisPublisher
 from ws4redis.redis_store import RedisMessage
 from django.db.models.signals import post_save
@@ -7,11 +8,73 @@ import logging
 import json
 import six
 import cgi
+import threading
 
 logger = logging.getLogger(__name__)
 
 WEBSOCKETS_FACILITY = 'websockets'
 
+class BatchPublisher(RedisPublisher):
+    """Publishes websocket messages to many channels in one round trip.
+
+    The publisher is not bound to any channel, the channels are given
+    with every message. Use :func:`get_publisher` to reuse the
+    process-wide instance and its connection pool.
+    """
+    def __init__(self, facility=WEBSOCKETS_FACILITY):
+        super(BatchPublisher, self).__init__(facility=facility)
+        self.facility = facility
+        self.expire = getattr(settings, 'WS4REDIS_EXPIRE', 0)
+
+    def publish_messages(self, messages):
+        """Publishes messages in a single redis pipeline
+
+        :param list messages: list of ``(channels, message)`` tuples.
+            ``channels`` are keyword arguments of
+            :class:`~ws4redis.publisher.RedisPublisher`, e.g.
+            ``{'users': ['username']}`` or ``{'broadcast': True}``.
+            ``message`` is a json string.
+        """
+        pipeline = self._connection.pipeline(transaction=False)
+        for channels, message in messages:
+            message = RedisMessage(message)
+            for channel in self._get_message_channels(facility=self.facility,
+                                                      **channels):
+                pipeline.publish(channel, message)
+                if self.expire > 0:
+                    pipeline.setex(channel, self.expire, message)
+        pipeline.execute()
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    """Returns the process-wide :class:`BatchPublisher`"""
+    global _publisher  # pylint: disable=global-statement
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = BatchPublisher()
+    return _publisher
+
+def publish_progress(username, operation, message, extra):
+    """Sends a progress message through the notifications websocket channel.
+
+    Progress messages are not stored as :class:`Notification` rows,
+    only the final status of an operation is.
+    """
+    try:
+        get_publisher().publish_messages([({'users': [username]}, json.dumps({
+            'event_type': 'data',
+            'status': Notification.INFO,
+            'operation': operation,
+            'message': message,
+            'extra': extra,
+            'user': username
+        }))])
+    except Exception:  # pylint: disable=broad-except
+        logger.debug('Exception sending websocket message', exc_info=True)
+
 @receiver(post_save, sender=Notification, dispatch_uid='notification_msg')
 def send_notification_ws(sender, instance, created, **kwargs):
     #Only send WS message if it's a new notification not if we're updating.
@@ -19,11 +82,15 @@ def send_notification_ws(sender, instance, created, **kwargs):
     if not created:
         return
     try:
-        rp = RedisPublisher(facility = WEBSOCKETS_FACILITY, users=[instance.user])
         # logger.debug(instance.to_dict())
-        instance_dict = json.dumps(instance.to_dict())
-        msg = RedisMessage(instance_dict)
-        rp.publish_message(msg)
+        if instance.read or instance.deleted:
+            unread = Notification.objects.unread_count(instance.user)
+        else:
+            unread = Notification.objects.adjust_unread(instance.user, 1)
+            if unread is None:
+                unread = Notification.objects.unread_count(instance.user)
+        instance_dict = json.dumps(dict(instance.to_dict(), unread=unread))
+        get_publisher().publish_messages([({'users': [instance.user]}, instance_dict)])
         # logger.debug('WS socket msg sent: {}'.format(instance_dict))
     except Exception as e:
         # logger.debug('Exception sending websocket message',
@@ -39,10 +106,8 @@ def send_broadcast_ws(sender, instance, created, **kwargs):
         return
     try:
         event_type, user, body = decompose_message(instance)
-        rp = RedisPublisher(facility = WEBSOCKETS_FACILITY,broadcast=True)
         instance_dict = json.dumps(instance.to_dict())
-        msg = RedisMessage(instance_dict)
-        rp.publish_message(msg)
+        get_publisher().publish_messages([({'broadcast': True}, instance_dict)])
         logger.debug('WS socket msg sent: {}'.format(instance_dict))
     except Exception as e:
         logger.debug('Exception sending websocket message',
@@ -2,6 +2,7 @@ from django.test import TestCase
 from django.test import SimpleTestCase
 from django.test import Client
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.db.models.signals import post_save
 from django.urls import reverse
 import requests
@@ -10,7 +11,7 @@ import mock
 import os
 from django.dispatch import receiver
 
-from designsafe.apps.api.notifications.models import Notification
+from designsafe.apps.api.notifications.models import Notification, JobEvent
 
 import logging
 
@@ -37,6 +38,8 @@ class NotificationsTestCase(TestCase):
         self.user = user
         self.client = Client()
 
+        cache.clear()
+
         with open('designsafe/apps/api/fixtures/agave-model-config-meta.json') as f:
             model_config_meta = json.load(f)
         self.model_config_meta = model_config_meta
@@ -86,7 +89,80 @@ class NotificationsTestCase(TestCase):
 
         self.assertEqual(Notification.objects.count(), 2)
 
+    def test_job_events_same_jobId_are_coalesced(self):
+        from designsafe.apps.workspace.tasks import process_job_events
+        JobEvent.record(json.loads(webhook_body_pending))
+        JobEvent.record(json.loads(webhook_body_submitting))
 
-    
+        processed = process_job_events()
 
-    
\ No newline at end of file
+        self.assertEqual(processed, 2)
+        self.assertEqual(JobEvent.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 1)
+        n = Notification.objects.last()
+        self.assertEqual(n.to_dict()['extra']['status'], 'SUBMITTING')
+
+    @mock.patch('designsafe.apps.api.notifications.receivers.get_publisher')
+    def test_bulk_notify_publishes_one_batch(self, mock_get_publisher):
+        notifications = Notification.objects.bulk_notify(
+            ['ds_user', 'ds_user2', 'ds_user'], event_type='data',
+            status=Notification.SUCCESS, operation='share_finished',
+            message='Files were shared with you.', extra={'path': '/a'})
+
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertTrue(all(n.pk for n in notifications))
+        publish = mock_get_publisher.return_value.publish_messages
+        self.assertEqual(publish.call_count, 1)
+        messages = publish.call_args[0][0]
+        self.assertEqual(len(messages), 2)
+        channels, payload = messages[1]
+        self.assertEqual(channels, {'users': ['ds_user2']})
+        expected = Notification.objects.get(user='ds_user2').to_dict()
+        payload = json.loads(payload)
+        payload.pop('unread', None)
+        self.assertEqual(sorted(payload.keys()), sorted(expected.keys()))
+        expected.pop('datetime')
+        payload.pop('datetime')
+        self.assertEqual(payload, expected)
+
+    def test_list_notifications_with_cursor_marks_read(self):
+        for i in range(3):
+            Notification(event_type='data', status=Notification.INFO,
+                         operation='test', message='message %d' % i,
+                         user='ds_user', extra={'i': i}).save()
+        self.client.login(username='ds_user', password='password')
+        url = reverse('designsafe_api:index')
+
+        resp = self.client.get(url, {'limit': 2}).json()
+        self.assertEqual(len(resp['notifs']), 2)
+        self.assertEqual(resp['total'], 3)
+        self.assertIsNotNone(resp['next'])
+
+        resp2 = self.client.get(url, {'limit': 2, 'before': resp['next']}).json()
+        self.assertEqual(len(resp2['notifs']), 1)
+        self.assertIsNone(resp2['next'])
+        listed = [n['pk'] for n in resp['notifs'] + resp2['notifs']]
+        self.assertEqual(sorted(listed, reverse=True), listed)
+        self.assertEqual(Notification.objects.filter(read=False).count(), 0)
+
+    @mock.patch('designsafe.apps.api.notifications.receivers.get_publisher')
+    def test_unread_badge_follows_create_and_read(self, mock_get_publisher):
+        self.client.login(username='ds_user', password='password')
+        badge_url = reverse('designsafe_api:badge')
+        self.assertEqual(self.client.get(badge_url).json()['unread'], 0)
+
+        Notification(event_type='data', status=Notification.INFO,
+                     operation='test', message='message',
+                     user='ds_user', extra={}).save()
+        Notification.objects.bulk_notify(['ds_user'], event_type='data',
+                                         status=Notification.INFO,
+                                         operation='test', message='message')
+        payload = json.loads(mock_get_publisher.return_value
+                             .publish_messages.call_args[0][0][0][1])
+        self.assertEqual(payload['unread'], 2)
+        with mock.patch.object(Notification.objects, 'filter') as mock_filter:
+            self.assertEqual(self.client.get(badge_url).json()['unread'], 2)
+            self.assertFalse(mock_filter.called)
+
+        self.client.get(reverse('designsafe_api:index'))
+        self.assertEqual(self.client.get(badge_url).json()['unread'], 0)
@@ -3,6 +3,7 @@ from django.http.response import HttpResponseBadRequest
 from django.http import HttpResponse
 from django.core.urlresolvers import reverse
 from django.shortcuts import render
+from django.db.models import Q
 
 from designsafe.apps.api.notifications.models import Notification
 
@@ -18,33 +19,54 @@ logger = logging.getLogger(__name__)
 class ManageNotificationsView(SecureMixin, JSONResponseMixin, BaseApiView):
 
     def get(self, request, event_type = None, *args, **kwargs):
+        """Lists the notifications of the user, newest first
+
+        Pages are requested either with ``limit`` and ``page`` or, to
+        avoid counting the skipped rows, with ``limit`` and ``before``:
+        the ``next`` value of the previous page. The listed
+        notifications are marked as read.
+        """
         limit = request.GET.get('limit', 0)
         page = request.GET.get('page', 0)
+        before = request.GET.get('before')
 
+        notifs = Notification.objects.filter(deleted = False,
+                      user = request.user.username)
         if event_type is not None:
-            notifs = Notification.objects.filter(event_type = event_type,
-                          deleted = False,
-                          user = request.user.username).order_by('-datetime')
-            total = Notification.objects.filter(event_type = event_type,
-                          deleted = False,
-                          user = request.user.username).count()
-        else:
-            notifs = Notification.objects.filter(deleted = False,
-                          user = request.user.username).order_by('-datetime')
-            total = Notification.objects.filter(deleted = False,
-                          user = request.user.username).count()
+            notifs = notifs.filter(event_type = event_type)
+        total = notifs.count()
+        notifs = notifs.order_by('-datetime', '-pk')
+
+        if before:
+            try:
+                cursor = Notification.objects.values_list('datetime', flat=True).get(
+                    pk=int(before), user=request.user.username)
+            except (ValueError, Notification.DoesNotExist):
+                return HttpResponseBadRequest('Invalid cursor: %s' % before)
+            notifs = notifs.filter(Q(datetime__lt=cursor) |
+                                   Q(datetime=cursor, pk__lt=int(before)))
         if limit:
             limit = int(limit)
             page = int(page)
-            offset = page * limit
-            notifs = notifs[offset:offset+limit]
+            if before:
+                notifs = notifs[:limit]
+            else:
+                offset = page * limit
+                notifs = notifs[offset:offset+limit]
 
-        for n in notifs:
-            if not n.read:
-                n.mark_read()
+        notifs = list(notifs)
+        unread = [n.pk for n in notifs if not n.read]
+        if unread:
+            updated = Notification.objects.filter(pk__in=unread,
+                                                  read=False).update(read=True)
+            Notification.objects.adjust_unread(request.user.username, -updated)
+            for n in notifs:
+                n.read = True
 
+        next_cursor = notifs[-1].pk if limit and len(notifs) == limit else None
         notifs = [n.to_dict() for n in notifs]
-        return self.render_to_json_response({'notifs':notifs, 'page':page, 'total': total})
+        return self.render_to_json_response({'notifs':notifs, 'page':page,
+                                             'total': total, 'next': next_cursor})
         # return self.render_to_json_response(notifs)
 
     def post(self, request, *args, **kwargs):
@@ -63,9 +85,9 @@ class ManageNotificationsView(SecureMixin, JSONResponseMixin, BaseApiView):
         # n.deleted = deleted
         # n.save()
         if pk == 'all':
-            items=Notification.objects.filter(deleted=False, user=str(request.user))
-            for i in items:
-                i.mark_deleted()
+            Notification.objects.filter(deleted=False,
+                                        user=str(request.user)).update(deleted=True)
+            Notification.objects.reset_unread(str(request.user))
         else:
             x = Notification.objects.get(pk=pk)
             x.mark_deleted()
@@ -75,6 +97,5 @@ class ManageNotificationsView(SecureMixin, JSONResponseMixin, BaseApiView):
 class NotificationsBadgeView(SecureMixin, JSONResponseMixin, BaseApiView):
 
     def get(self, request, *args, **kwargs):
-        unread = Notification.objects.filter(deleted = False, read = False,
-                      user = request.user.username).count()
+        unread = Notification.objects.unread_count(request.user.username)
         return self.render_to_json_response({'unread': unread})
@@ -13,13 +13,13 @@ from celery import shared_task
 from requests import ConnectionError, HTTPError
 from agavepy.agave import Agave, AgaveException
 
-from designsafe.apps.api.notifications.models import Notification
+from designsafe.apps.api.notifications.models import Notification, JobEvent
 
 from designsafe.apps.api.views import BaseApiView
 from designsafe.apps.api.mixins import JSONResponseMixin, SecureMixin
 from designsafe.apps.api.exceptions import ApiException
 
-from designsafe.apps.workspace.tasks import handle_webhook_request
+from designsafe.apps.workspace.tasks import schedule_job_events
 
 import json
 import logging
@@ -44,15 +44,16 @@ class JobsWebhookView(JSONResponseMixin, BaseApiView):
 
     def post(self, request, *args, **kwargs):
         """
-        Calls handle_webhook_request on webhook JSON body
-        to notify the user of the progress of the job.
+        Records the webhook JSON body and returns. The user is notified
+        of the progress of the job by process_job_events.
 
         """
 
         job = json.loads(request.body)
         # logger.debug(job)
 
-        handle_webhook_request(job)
+        JobEvent.record(job)
+        schedule_job_events()
         return HttpResponse('OK')
         # don't need to parse everything
         # JOB_EVENT='job'
@@ -179,9 +180,9 @@ def index_job_outputs(user, job):
 
     from designsafe.apps.api.data.agave.filemanager import FileManager as AgaveFileManager
     mgr = AgaveFileManager(user)
-    mgr.indexer.index(system_id, archive_path, user.username,
-                      full_indexing = True, pems_indexing = True,
-                      index_full_path = True)
+    mgr.indexer.bulk_index(system_id, archive_path, user.username,
+                           full_indexing = True, pems_indexing = True,
+                           index_full_path = True)
 
 
 class FilesWebhookView(SecureMixin, JSONResponseMixin, BaseApiView):
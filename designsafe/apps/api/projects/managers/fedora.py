@@ -0,0 +1,220 @@
+"""Ingest of published projects into Fedora.
+
+    Every folder and file of a published project is created as a resource
+    under the project container, see ``settings.FEDORA_INGEST``. Folders
+    are created level by level, then the files are sent by a bounded pool
+    of workers sharing a pooled :class:`requests.Session`. File bodies are
+    streamed from disk with a ``Digest`` header so Fedora verifies the
+    checksum of what it stored.
+
+    Every resource sent is recorded in a manifest kept in the cache under
+    the id of the ingest, usually the project id, with the size and
+    modification time of the file. A retried ingest only sends the
+    resources which are missing or changed.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+from django.core.cache import cache
+from designsafe.apps.api.projects.managers.staging import _md5
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+_MAGIC = None
+_MAGIC_LOCK = threading.Lock()
+
+
+def guess_mimetype(path):
+    """Returns the mime type of a file
+
+    A single libmagic handle is used, libmagic handles are not thread safe
+    so calls are serialized.
+    """
+    global _MAGIC  # pylint: disable=global-statement
+    with _MAGIC_LOCK:
+        if _MAGIC is None:
+            import magic
+            _MAGIC = magic.Magic(mime=True)
+        return _MAGIC.from_file(path)
+
+
+class FedoraIngestError(Exception):
+    """Raised when some resources could not be sent.
+
+    :ivar list failed: paths of the resources which failed.
+    """
+    def __init__(self, message, failed=None):
+        super(FedoraIngestError, self).__init__(message)
+        self.failed = failed or []
+
+
+class FedoraIngest(object):
+    """Sends a published project to Fedora.
+
+    :param str root: real path of the published project.
+    :param str project_id: project id, the name of the project container.
+    :param str base_url: url of the publications container.
+        Default ``settings.FEDORA_INGEST['base_url']``
+    :param str ingest_id: id the manifest is saved under. Nothing is
+        recorded if `None`.
+    :param int max_workers: number of resources sent at a time.
+    :param session: :class:`requests.Session` to use, a pooled session
+        is created if `None`.
+
+    .. rubric:: Example
+
+        >>> ingest = FedoraIngest('/corral/published/PRJ-1234', 'PRJ-1234',
+        ...                       ingest_id='PRJ-1234')
+        >>> ingest.ingest()
+    """
+    def __init__(self, root, project_id, base_url=None, ingest_id=None,
+                 max_workers=None, session=None):
+        ingest_settings = getattr(settings, 'FEDORA_INGEST', {})
+        self.root = root
+        self.base_url = (base_url or ingest_settings['base_url']).rstrip('/')
+        self.project_url = '/'.join([self.base_url, project_id])
+        self.ingest_id = ingest_id
+        self.max_workers = max_workers or ingest_settings.get('max_workers', 8)
+        self.timeout = ingest_settings.get('timeout', 60 * 5)
+        self.manifest_timeout = ingest_settings.get('manifest_timeout',
+                                                    60 * 60 * 24 * 7)
+        self.session = session or self._session()
+
+    def _session(self):
+        # Bodies are streamed from open files which are not rewound,
+        # only errors raised before the request is sent are retried.
+        retries = Retry(total=3, read=False, backoff_factor=0.5)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers,
+                              max_retries=retries)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _manifest_key(self, path):
+        return 'fedora:{}:{}'.format(
+            self.ingest_id, hashlib.md5(path.encode('utf-8')).hexdigest())
+
+    def url(self, path):
+        """Url of the resource of a path relative to `root`"""
+        path = path.replace('[', '-').replace(']', '-')
+        return ''.join([self.project_url, urllib.quote('/' + path.strip('/'))])
+
+    def ensure_container(self, url):
+        """Creates a container if it does not exist"""
+        res = self.session.get(url, timeout=self.timeout)
+        if res.status_code in (404, 410):
+            self.session.put(url, timeout=self.timeout).raise_for_status()
+
+    def plan(self):
+        """Walks `root`
+
+        :returns: tuple of the list of folder paths, sorted by depth,
+            and the list of ``(path, version)`` of every file. Paths are
+            relative to `root`, the version is ``'<size>:<mtime>'``.
+        """
+        folders = []
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root)
+            rel_dir = '' if rel_dir == '.' else rel_dir
+            folders += [os.path.join(rel_dir, name) for name in dirnames]
+            for name in filenames:
+                stat = os.stat(os.path.join(dirpath, name))
+                files.append((os.path.join(rel_dir, name),
+                              '{}:{}'.format(stat.st_size, int(stat.st_mtime))))
+        folders.sort(key=lambda path: (path.count(os.sep), path))
+        return folders, files
+
+    def put_folder(self, path):
+        """Creates the resource of a folder"""
+        self.session.put(self.url(path), timeout=self.timeout).raise_for_status()
+
+    def put_file(self, path):
+        """Streams a file to its resource"""
+        full_path = os.path.join(self.root, path)
+        headers = {'Content-Type': guess_mimetype(full_path),
+                   'Digest': 'md5={}'.format(_md5(full_path))}
+        with open(full_path, 'rb') as file_handle:
+            res = self.session.put(self.url(path), data=file_handle,
+                                   headers=headers, timeout=self.timeout)
+        res.raise_for_status()
+
+    def _send(self, method, items):
+        """Calls `method` for every ``(path, version)`` not in the manifest
+
+        :returns: tuple of the number of items sent and the list of
+            paths which failed.
+        """
+        pending = []
+        for path, version in items:
+            if self.ingest_id is None or \
+               cache.get(self._manifest_key(path)) != version:
+                pending.append((path, version))
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(method, path): (path, version)
+                       for path, version in pending}
+            for future in as_completed(futures):
+                path, version = futures[future]
+                try:
+                    future.result()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Unable to send %s to Fedora', path)
+                    failed.append(path)
+                    continue
+                if self.ingest_id is not None:
+                    cache.set(self._manifest_key(path), version,
+                              self.manifest_timeout)
+        return len(pending), failed
+
+    def ingest(self):
+        """Sends the folders and files of `root` to Fedora
+
+        :raises FedoraIngestError: when some resources could not be sent.
+        """
+        start = time.time()
+        self.ensure_container(self.base_url)
+        self.ensure_container(self.project_url)
+        folders, files = self.plan()
+
+        sent = 0
+        failed = []
+        depth = None
+        level = []
+        # Parents must exist before their children, folders are created
+        # one level at a time.
+        for path in folders + [None]:
+            path_depth = path.count(os.sep) if path is not None else None
+            if level and path_depth != depth:
+                level_sent, level_failed = self._send(self.put_folder, level)
+                sent += level_sent
+                failed += level_failed
+                level = []
+            if path is not None:
+                depth = path_depth
+                level.append((path, 'folder'))
+        if failed:
+            raise FedoraIngestError(
+                'Unable to create {} folders'.format(len(failed)), failed)
+
+        files_sent, failed = self._send(self.put_file, files)
+        sent += files_sent
+        logger.info('Sent %d resources of %s to Fedora in %.1fs '
+                    '(%d already sent, %d failed)', sent, self.project_url,
+                    time.time() - start,
+                    len(folders) + len(files) - sent, len(failed))
+        if failed:
+            raise FedoraIngestError(
+                'Unable to send {} files'.format(len(failed)), failed)
@@ -1,13 +1,19 @@
 import re
+import time
 import logging
 import codecs
+import threading
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
+from concurrent.futures import ThreadPoolExecutor
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import cache
 import datetime
 import dateutil.parser
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +26,58 @@ TARGET_BASE = 'https://www.designsafe-ci.org/data/browser/public/designsafe.stor
 ENTITY_TARGET_BASE = 'https://www.designsafe-ci.org/data/browser/public/designsafe.storage.published/{project_id}/#details-{entity_uuid}'
 logger.debug('Using shoulder: %s', SHOULDER)
 
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+class EZIDError(Exception):
+    """Raised when EZID returns an error"""
+    pass
+
+def _doi_settings():
+    return getattr(settings, 'DOI_RESERVATION', {})
+
+def _session():
+    """Returns the pooled session used for every EZID request"""
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                pool_size = _doi_settings().get('max_workers', 8)
+                session = requests.Session()
+                session.auth = CREDS
+                session.headers['Content-Type'] = 'text/plain'
+                session.mount('https://', HTTPAdapter(pool_connections=1,
+                                                      pool_maxsize=pool_size))
+                _SESSION = session
+    return _SESSION
+
+def _request(method, url, idempotent=True, **kwargs):
+    """Sends a request to EZID retrying on transient errors
+
+    Requests which are not idempotent, e.g. minting a DOI, are only
+    retried when the connection could not be established.
+    """
+    doi_settings = _doi_settings()
+    max_retries = doi_settings.get('max_retries', 3)
+    retry_delay = doi_settings.get('retry_delay', 2)
+    retry_on = (ConnectionError, Timeout) if idempotent else (ConnectionError, )
+    attempt = 0
+    while True:
+        try:
+            res = getattr(_session(), method)(
+                url, timeout=doi_settings.get('timeout', 60), **kwargs)
+            if res.status_code < 500 or not idempotent:
+                return res
+            error = EZIDError('{} {}: {}'.format(res.status_code, url, res.text))
+        except retry_on as exc:
+            error = exc
+        attempt += 1
+        if attempt > max_retries:
+            raise error
+        delay = retry_delay * 2 ** (attempt - 1)
+        logger.warning('EZID error, retry %d in %ds: %s', attempt, delay, error)
+        time.sleep(delay)
+
 def pretty_print(xml):
     """Return a pretty-printed XML string for the Element.
     """
@@ -64,24 +122,36 @@ def format_req(metadata):
 def _reserve_doi(xml_obj, target):
     xml_str = ET.tostring(xml_obj, encoding="UTF-8", method="xml")
     metadata = {'_status': 'reserved', 'datacite': xml_str, '_target': target}
-    response = requests.post('{}/shoulder/{}'.format(BASE_URI, SHOULDER),
-                             data=format_req(metadata),
-                             auth=CREDS,
-                             headers={'Content-Type': 'text/plain'})
+    response = _request('post', '{}/shoulder/{}'.format(BASE_URI, SHOULDER),
+                        idempotent=False,
+                        data=format_req(metadata))
     res = parse_response(response.text)
     if 'success' in res:
         return res['success']
     else:
-        raise Exception(res['error'])
+        raise EZIDError(res['error'])
+
+def _reserve_entity_doi(xml_obj, target, entity_uuid):
+    """Reserves a DOI for an entity only once
+
+    The reserved DOI is recorded under the uuid of the entity, a retried
+    publication reuses it instead of minting a new one.
+    """
+    key = 'doi:reserved:{}'.format(entity_uuid)
+    reserve_res = cache.get(key)
+    if reserve_res is None:
+        reserve_res = _reserve_doi(xml_obj, target)
+        cache.set(key, reserve_res,
+                  _doi_settings().get('reservation_timeout', 60 * 60 * 24 * 30))
+    else:
+        logger.debug('Reusing DOI reserved for %s: %s', entity_uuid, reserve_res)
+    return reserve_res
 
 def _update_doi(doi, xml_obj=None, status='reserved'):
-    res = requests.get(
-        '{}/id/{}'.format(BASE_URI, doi),
-        auth=CREDS,
-        headers={'Content-Type': 'text/plain'}
-    )
-    if status == 'reserved' and res.status_code >= 200 and res.status_code <= 202:
-        status = parse_response(res.text).get('_status', status)
+    if status == 'reserved':
+        res = _request('get', '{}/id/{}'.format(BASE_URI, doi))
+        if res.status_code >= 200 and res.status_code <= 202:
+            status = parse_response(res.text).get('_status', status)
 
     if xml_obj is not None:
         xml_str = ET.tostring(xml_obj, encoding="UTF-8", method="xml")
@@ -89,15 +159,13 @@ def _update_doi(doi, xml_obj=None, status='reserved'):
     else:
         metadata = {'_status': status}
 
-    response = requests.post('{}/id/{}'.format(BASE_URI, doi),
-                             data=format_req(metadata),
-                             auth=CREDS,
-                             headers={'Content-Type': 'text/plain'})
+    response = _request('post', '{}/id/{}'.format(BASE_URI, doi),
+                        data=format_req(metadata))
     res = parse_response(response.text)
     if 'success' in res:
         return res['success']
     else:
-        raise Exception(res['error'])
+        raise EZIDError(res['error'])
 
 def _project_required_xml(publication):
     project_body = publication['project']
@@ -223,34 +291,41 @@ def _analysis_required_xml(users, analysis, created):
     desc.text = anl['description']
     return xml_obj
 
-def analysis_reserve_xml(publication, analysis, created):
+def analysis_reserve_xml(publication, analysis, created, update=True):
     anl = analysis['value']
     xml_obj = _analysis_required_xml(publication['users'], analysis,
                                      created)
     now = dateutil.parser.parse(created)
-    reserve_res = _reserve_doi(xml_obj, ENTITY_TARGET_BASE.format(
-        project_id=publication['project']['value']['projectId'], entity_uuid=analysis['uuid']))
-    doi, ark = reserve_res.split('|')
+    if not analysis.get('doi', ''):
+        reserve_res = _reserve_entity_doi(xml_obj, ENTITY_TARGET_BASE.format(
+            project_id=publication['project']['value']['projectId'],
+            entity_uuid=analysis['uuid']), analysis['uuid'])
+        doi, ark = reserve_res.split('|')
+    else:
+        doi = analysis.get('doi')
+        ark = analysis.get('doi')
     doi = doi.strip()
     ark = ark.strip()
     identifier = xml_obj.find('identifier')
     identifier.text = doi
     resource = xml_obj
-    _update_doi(doi, xml_obj)
+    if update:
+        _update_doi(doi, xml_obj)
     return (doi, ark, xml_obj)
 
-def experiment_reserve_xml(publication, experiment, created):
+def experiment_reserve_xml(publication, experiment, created, update=True):
     exp = experiment['value']
     xml_obj = _experiment_required_xml(publication['users'], experiment,
                                        created)
     now = dateutil.parser.parse(created)
     if not experiment.get('doi', ''):
-        reserve_res = _reserve_doi(
+        reserve_res = _reserve_entity_doi(
             xml_obj,
             ENTITY_TARGET_BASE.format(
                 project_id=publication['project']['value']['projectId'],
                 entity_uuid=experiment['uuid']
-            )
+            ),
+            experiment['uuid']
         )
         doi, ark = reserve_res.split('|')
     else:
@@ -293,16 +368,19 @@ def experiment_reserve_xml(publication, experiment, created):
         slt_subj = ET.SubElement(subjects, 'subject')
         slt_subj.text = slt['value']['title']
 
-    _update_doi(doi, xml_obj)
+    if update:
+        _update_doi(doi, xml_obj)
     return (doi, ark, xml_obj)
 
-def project_reserve_xml(publication):
+def project_reserve_xml(publication, update=True):
     project_body = publication['project']
     proj = project_body['value']
     xml_obj = _project_required_xml(publication)
     now = dateutil.parser.parse(publication['created'])
     if not project_body.get('doi', ''):
-        reserve_resp = _reserve_doi(xml_obj, TARGET_BASE.format(project_id=proj['projectId']))
+        reserve_resp = _reserve_entity_doi(
+            xml_obj, TARGET_BASE.format(project_id=proj['projectId']),
+            project_body['uuid'])
         doi, ark = reserve_resp.split('|')
     else:
         doi = project_body.get('doi')
@@ -354,10 +432,11 @@ def project_reserve_xml(publication):
     rights.attrib['rightsURI'] = 'http://opendatacommons.org/licenses/by/1-0/'
     rights.text = 'ODC-BY 1.0'
     logger.debug(pretty_print(xml_obj))
-    _update_doi(doi, xml_obj)
+    if update:
+        _update_doi(doi, xml_obj)
     return (doi, ark, xml_obj)
 
-def add_related(xml_obj, dois):
+def add_related(xml_obj, dois, update=True):
     doi = xml_obj.find('identifier').text
     resource = xml_obj
     related_ids = ET.SubElement(resource, 'relatedIdentifiers')
@@ -367,7 +446,8 @@ def add_related(xml_obj, dois):
         related.attrib['relationType'] = 'IsPartOf'
         related.text = _doi
 
-    _update_doi(doi, xml_obj)
+    if update:
+        _update_doi(doi, xml_obj)
     return (doi, xml_obj)
 
 def publish_project(doi, xml_obj):
@@ -375,53 +455,52 @@ def publish_project(doi, xml_obj):
     logger.debug(pretty_print(xml_obj))
     xml_str = ET.tostring(xml_obj, encoding="UTF-8", method="xml")
     metadata = {'_status': 'public', 'datacite': xml_str}
-    res = requests.post('{}/id/{}'.format(BASE_URI, doi),
-                        format_req(metadata),
-                        auth=CREDS,
-                        headers={'Content-Type': 'text/plain'})
+    res = _request('post', '{}/id/{}'.format(BASE_URI, doi),
+                   data=format_req(metadata))
     res = parse_response(res.text)
     if 'success' in res:
         return res['success'].split('|')
     else:
         logger.exception(res['error'])
-        raise Exception(res['error'])
+        raise EZIDError(res['error'])
 
 def reserve_publication(publication, analysis_doi=False):
-    proj_doi, proj_ark, proj_xml = project_reserve_xml(publication)
+    """Reserves and updates the DOIs of a publication
+
+    The project DOI is reserved first, the DOIs of the experiments and
+    analyses are then reserved concurrently, see
+    ``settings.DOI_RESERVATION['max_workers']``. Every DOI is updated once,
+    with its related identifiers and status ``public``. DOIs reserved by a
+    previous attempt are reused.
+    """
+    proj_doi, proj_ark, proj_xml = project_reserve_xml(publication, update=False)
     logger.debug('proj_doi: %s', proj_doi)
     logger.debug('proj_ark: %s', proj_ark)
     logger.debug('proj_xml: %s', proj_xml)
-    exps_dois = []
-    anl_dois = []
-    xmls = {proj_doi: proj_xml}
     publication['project']['doi'] = proj_doi
-    for exp in publication.get('experimentsList', []):
-        exp_doi, exp_ark, exp_xml = experiment_reserve_xml(publication,
-                                                           exp,
-                                                           publication['created'])
-        add_related(exp_xml, [proj_doi])
-        exps_dois.append(exp_doi)
-        exp['doi'] = exp_doi
-        xmls[exp_doi] = exp_xml
-        logger.debug('exp_doi: %s', exp_doi)
-        logger.debug('exp_ark: %s', exp_ark)
-        logger.debug('exp_xml: %s', exp_xml)
 
+    def _reserve(reserve_xml, entity):
+        doi, ark, xml_obj = reserve_xml(publication, entity,
+                                        publication['created'], update=False)
+        add_related(xml_obj, [proj_doi], update=False)
+        entity['doi'] = doi
+        logger.debug('entity doi: %s, ark: %s, uuid: %s', doi, ark, entity['uuid'])
+        return doi, xml_obj
+
+    entities = [(experiment_reserve_xml, exp)
+                for exp in publication.get('experimentsList', [])]
     if analysis_doi:
-        for anl in publication.get('analysisList', []):
-            anl_doi, anl_ark, anl_xml = analysis_reserve_xml(publication,
-                                                             anl,
-                                                             publication['created'])
-            add_related(anl_xml, [proj_doi])
-            anl_dois.append(anl_doi)
-            anl['doi'] = anl_doi
-            xmls[anl_doi] = anl_xml
-            logger.debug('anl_doi: %s', anl_doi)
-            logger.debug('anl_ark: %s', anl_ark)
-            logger.debug('anl_xml: %s', anl_xml)
-
-    add_related(proj_xml, exps_dois + anl_dois)
-    for _doi in [proj_doi] + exps_dois + anl_dois:
-        logger.debug('Final project doi: %s', _doi)
-        _update_doi(_doi, xmls[_doi], status='public')
+        entities += [(analysis_reserve_xml, anl)
+                     for anl in publication.get('analysisList', [])]
+
+    max_workers = _doi_settings().get('max_workers', 8)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reserved = list(executor.map(lambda args: _reserve(*args), entities))
+        entity_dois = [doi for doi, _ in reserved]
+        add_related(proj_xml, entity_dois, update=False)
+        xmls = [(proj_doi, proj_xml)] + reserved
+        for _doi, _ in xmls:
+            logger.debug('Final project doi: %s', _doi)
+        list(executor.map(lambda args: _update_doi(args[0], args[1], status='public'),
+                          xmls))
     return publication
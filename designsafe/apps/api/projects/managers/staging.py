@@ -0,0 +1,226 @@
+"""Staging of publication files to the published storage.
+
+    The files of a publication are copied from the project storage to the
+    published storage in two steps. First a manifest is built: the related
+    paths are walked, the folders are created on the destination and every
+    file is listed with its size and modification time. Then the files are
+    copied by a bounded pool of workers, see
+    ``settings.PUBLICATION_STAGING``.
+
+    A file is copied to a temporary name and renamed once complete, with
+    its modification time. Files already on the destination with the same
+    size and modification time (or checksum) are skipped, so a retried
+    task resumes the staging instead of starting over.
+
+    The progress of the staging, including throughput and ETA, is logged
+    and kept in the cache under ``staging:<id>:progress``.
+"""
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.cache import cache
+
+# pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+# pylint: enable=invalid-name
+
+
+class StagingError(Exception):
+    """Raised when some files could not be staged.
+
+    :ivar list failed: relative paths of the files which failed.
+    """
+    def __init__(self, message, failed=None):
+        super(StagingError, self).__init__(message)
+        self.failed = failed or []
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def _md5(path, chunk_size=8 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file_handle:
+        for data in iter(lambda: file_handle.read(chunk_size), b''):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+class PublicationStaging(object):
+    """Copies the related paths of a publication with a pool of workers.
+
+    :param str src_root: real path of the project storage.
+    :param str dest_root: real path of the publication on the published
+        storage.
+    :param str staging_id: id the progress is saved under, e.g. the
+        project id.
+    :param int max_workers: number of files copied at a time.
+    :param str verify: how staged files are recognized, ``mtime`` compares
+        the size and modification time, ``checksum`` also compares the
+        md5 checksum of both files.
+
+    .. rubric:: Example
+
+        >>> staging = PublicationStaging('/corral/projects/uuid',
+        ...                              '/corral/published/PRJ-1234',
+        ...                              staging_id='PRJ-1234')
+        >>> staging.stage(['Experiment', 'projectimage.jpg'])
+    """
+    def __init__(self, src_root, dest_root, staging_id=None, max_workers=None,
+                 verify=None):
+        staging_settings = getattr(settings, 'PUBLICATION_STAGING', {})
+        self.src_root = src_root
+        self.dest_root = dest_root
+        self.staging_id = staging_id
+        self.max_workers = max_workers or staging_settings.get('max_workers', 8)
+        self.verify = verify or staging_settings.get('verify', 'mtime')
+        self.progress_interval = staging_settings.get('progress_interval', 60)
+        self.progress_timeout = staging_settings.get('progress_timeout',
+                                                     60 * 60 * 24 * 7)
+        self._lock = threading.Lock()
+        self._progress = {}
+        self._last_progress = None
+
+    def manifest(self, filepaths):
+        """Walks the related paths and creates the folders on the destination
+
+        :param list filepaths: paths relative to `src_root`, files or folders.
+
+        :returns: sorted list of ``(path, size, mtime)`` of every file, the
+            path is relative to `src_root`.
+        """
+        entries = {}
+        _makedirs(self.dest_root)
+        for filepath in filepaths:
+            filepath = filepath.strip('/')
+            src_path = os.path.join(self.src_root, filepath)
+            if os.path.isdir(src_path):
+                for dirpath, _, filenames in os.walk(src_path):
+                    rel_dir = os.path.relpath(dirpath, self.src_root)
+                    _makedirs(os.path.join(self.dest_root, rel_dir))
+                    for name in filenames:
+                        rel_path = os.path.join(rel_dir, name)
+                        entries[rel_path] = os.stat(os.path.join(dirpath, name))
+            elif os.path.isfile(src_path):
+                _makedirs(os.path.dirname(os.path.join(self.dest_root, filepath)))
+                entries[filepath] = os.stat(src_path)
+            else:
+                logger.warning('Publication path does not exist: %s', src_path)
+
+        return sorted((path, stat.st_size, int(stat.st_mtime))
+                      for path, stat in entries.items())
+
+    def is_staged(self, path, size, mtime):
+        """Checks if a file is already on the destination"""
+        dest_path = os.path.join(self.dest_root, path)
+        try:
+            stat = os.stat(dest_path)
+        except OSError:
+            return False
+        if stat.st_size != size or int(stat.st_mtime) != mtime:
+            return False
+        if self.verify == 'checksum':
+            return _md5(dest_path) == _md5(os.path.join(self.src_root, path))
+        return True
+
+    def copy(self, path, size, mtime):
+        """Copies a single file, it only appears on the destination once
+        complete"""
+        src_path = os.path.join(self.src_root, path)
+        dest_path = os.path.join(self.dest_root, path)
+        tmp_path = '{}.staging'.format(dest_path)
+        try:
+            shutil.copy2(src_path, tmp_path)
+            os.rename(tmp_path, dest_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._update_progress(files=1, bytes=size)
+
+    def _update_progress(self, force=False, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._progress[key] += value
+            now = time.time()
+            if not force and now - self._last_progress < self.progress_interval:
+                return
+            self._last_progress = now
+            progress = self._progress
+            elapsed = now - progress['started']
+            rate = progress['bytes'] / elapsed if elapsed else 0
+            remaining = progress['total_bytes'] - progress['bytes'] - \
+                progress['skipped_bytes']
+            progress.update(elapsed=elapsed, bytes_per_second=rate,
+                            eta=remaining / rate if rate else None)
+            logger.info('Staged %d/%d files of %s, %d/%d bytes '
+                        '(%.1f MB/s, ETA %ss)',
+                        progress['files'] + progress['skipped'],
+                        progress['total_files'], self.dest_root,
+                        progress['bytes'] + progress['skipped_bytes'],
+                        progress['total_bytes'], rate / (1024 * 1024),
+                        int(progress['eta']) if progress['eta'] is not None else '-')
+            if self.staging_id is not None:
+                cache.set('staging:{}:progress'.format(self.staging_id),
+                          dict(progress), self.progress_timeout)
+
+    def stage(self, filepaths):
+        """Copies the related paths to the destination
+
+        :param list filepaths: paths relative to `src_root`, files or folders.
+
+        :returns: the final progress.
+        :rtype: dict
+
+        :raises StagingError: when some files could not be copied.
+        """
+        entries = self.manifest(filepaths)
+        pending = []
+        skipped_bytes = 0
+        for path, size, mtime in entries:
+            if self.is_staged(path, size, mtime):
+                skipped_bytes += size
+            else:
+                pending.append((path, size, mtime))
+
+        self._last_progress = time.time()
+        self._progress = {
+            'started': self._last_progress,
+            'total_files': len(entries),
+            'total_bytes': sum(entry[1] for entry in entries),
+            'skipped': len(entries) - len(pending),
+            'skipped_bytes': skipped_bytes,
+            'files': 0,
+            'bytes': 0,
+            'failed': 0,
+        }
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.copy, *entry): entry[0]
+                       for entry in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (IOError, OSError):
+                    logger.exception('Unable to stage %s', futures[future])
+                    failed.append(futures[future])
+                    self._update_progress(failed=1)
+
+        self._update_progress(force=True)
+        if failed:
+            raise StagingError('Unable to stage {} files'.format(len(failed)),
+                               failed)
+        return dict(self._progress)
@@ -90,7 +90,8 @@ class Project(BaseMetadataResource):
         logger.info('Adding collaborator "{}" to project "{}"'.format(username, self.uuid))
 
         # Set permissions on the metadata record
-        pem = BaseMetadataPermissionResource(self.uuid, self._agave)
+        pem = BaseMetadataPermissionResource(self.uuid, self._agave,
+                                             metadata_name=self.name)
         pem.username = username
         pem.read = True
         pem.write = True
@@ -109,7 +110,8 @@ class Project(BaseMetadataResource):
         self.value['teamMembers'] = team_members
 
         # Set permissions on the metadata record
-        pem = BaseMetadataPermissionResource(self.uuid, self._agave)
+        pem = BaseMetadataPermissionResource(self.uuid, self._agave,
+                                             metadata_name=self.name)
         pem.username = username
         pem.read = False
         pem.write = False
@@ -20,6 +20,7 @@ from designsafe.apps.projects.models.agave.base import Project as BaseProject
 from designsafe.apps.api.agave import get_service_account_client
 from designsafe.apps.data.models.agave.metadata import BaseMetadataPermissionResource
 from designsafe.apps.data.models.agave.files import BaseFileResource
+from designsafe.apps.data.models.agave import cache as metadata_cache
 from designsafe.apps.data.models.agave.util import AgaveJSONEncoder
 from designsafe.apps.accounts.models import DesignSafeProfile
 from designsafe.apps.projects.models.utils import lookup_model as project_lookup_model
@@ -456,6 +457,7 @@ class ProjectMetaView(BaseApiView, SecureMixin, ProjectMetaLookupMixin):
         model = self._lookup_model(meta_obj['name'])
         meta = model(**meta_obj)
         ag.meta.deleteMetadata(uuid=uuid)
+        metadata_cache.invalidate(uuid=uuid, name=meta_obj['name'])
         return JsonResponse(meta.to_body_dict(), safe=False)
 
     @profile_fn
@@ -500,7 +502,8 @@ class ProjectMetaView(BaseApiView, SecureMixin, ProjectMetaLookupMixin):
             pems = BaseMetadataPermissionResource.list_permissions(project_id, ag)
             #Loop permissions and set them in whatever metadata object we're saving
             for pem in pems:
-                _pem = BaseMetadataPermissionResource(resp.uuid, ag)
+                _pem = BaseMetadataPermissionResource(resp.uuid, ag,
+                                                      metadata_name=resp.name)
                 _pem.username = pem.username
                 _pem.read = pem.read
                 _pem.write = pem.write
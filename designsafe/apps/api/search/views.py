@@ -4,9 +4,12 @@
    and for authenticated users any private data that they can
    access.
 """
+import hashlib
 import logging
-from elasticsearch_dsl import Q, Search
+from elasticsearch_dsl import Q, Search, MultiSearch
 from elasticsearch import TransportError, ConnectionTimeout
+from django.conf import settings
+from django.core.cache import cache
 from django.http import (HttpResponseBadRequest,
                          JsonResponse)
 
@@ -39,12 +42,43 @@ class SearchView(BaseApiView):
         elif type_filter == 'private_files':
             es_query = self.search_my_data(self.request.user.username, q, offset, limit)
 
+        username = None
+        if request.user.is_authenticated:
+            username = request.user.username
+        counts_key = self._counts_cache_key(q, username)
+        counts = cache.get(counts_key)
+
+        # The hits and the count of every tab are requested with
+        # a single msearch round trip. Tab counts are cached for
+        # a short time since they only depend on the query string.
+        multi_search = MultiSearch().add(es_query)
+        count_searches = []
+        if counts is None:
+            count_searches = [
+                ('public_files_total', self.search_public_files(q, 0, 0)),
+                ('published_total', self.search_published(q, 0, 0)),
+                ('cms_total', self.search_cms_content(q, 0, 0)),
+            ]
+            if username:
+                count_searches.append(
+                    ('private_files_total', self.search_my_data(username, q, 0, 0)))
+            for _, search in count_searches:
+                multi_search = multi_search.add(search)
+
         try:
-            res = es_query.execute()
+            responses = multi_search.execute()
         except (TransportError, ConnectionTimeout) as err:
             if getattr(err, 'status_code', 500) == 404:
                 raise
-            res = es_query.execute()
+            responses = multi_search.execute(ignore_cache=True)
+
+        res = responses[0]
+        if counts is None:
+            counts = {'private_files_total': 0}
+            for (key, _), count_res in zip(count_searches, responses[1:]):
+                counts[key] = count_res.hits.total
+            cache.set(counts_key, counts,
+                      getattr(settings, 'SEARCH_COUNTS_CACHE_TTL', 60))
 
         results = [r for r in res]
         out = {}
@@ -60,15 +94,17 @@ class SearchView(BaseApiView):
 
         out['total_hits'] = res.hits.total
         out['hits'] = hits
-        out['public_files_total'] = self.search_public_files(q, offset, limit).count()
-        out['published_total'] = self.search_published(q, offset, limit).count()
-        out['cms_total'] = self.search_cms_content(q, offset, limit).count()
-        out['private_files_total'] = 0
-        if request.user.is_authenticated:
-            out['private_files_total'] = self.search_my_data(self.request.user.username, q, offset, limit).count()
+        out.update(counts)
 
         return JsonResponse(out, safe=False)
 
+    @staticmethod
+    def _counts_cache_key(q, username=None):
+        """Cache key of the tab counts for a query string"""
+        key = u'{}:{}'.format(username or '', q or '')
+        return 'search_counts:{}'.format(
+            hashlib.md5(key.encode('utf-8')).hexdigest())
+
     def search_cms_content(self, q, offset, limit):
         """search cms content """
         search = Search(index="cms").query(
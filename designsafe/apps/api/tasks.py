@@ -4,7 +4,6 @@ import re
 import os
 import sys
 import json
-import urllib
 from datetime import datetime
 from celery import shared_task
 from django.core.urlresolvers import reverse
@@ -14,6 +13,8 @@ from requests.exceptions import HTTPError
 
 from designsafe.apps.api.notifications.models import Notification, Broadcast
 from designsafe.apps.api.agave import get_service_account_client
+from designsafe.apps.data.models.changes import FileChange
+from designsafe.apps.data.models.shares import SharedRoot
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +48,57 @@ def reindex_agave(self, username, file_id, full_indexing=True,
     #                           levels = 1)
 
 
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def es_recursive_operation(self, username, operation, system_id, file_path,
+                           target_path=None):
+    """Deletes, moves or copies every ES document below a folder.
+
+    :param str username: username making the request
+    :param str operation: ``delete``, ``move`` or ``copy``. A rename is a
+        ``move`` within the same parent folder.
+    :param str system_id: system id
+    :param str file_path: path of the folder
+    :param str target_path: new path of the folder when moving or copying
+    """
+    from elasticsearch import TransportError, ConnectionTimeout
+    from designsafe.apps.api.data.agave.elasticsearch.documents import Object
+    from designsafe.apps.api.notifications.receivers import publish_progress
+    extra = {'system': system_id, 'path': file_path, 'target_path': target_path}
+
+    def progress(cnt):
+        publish_progress(username, 'index_%s_progress' % operation,
+                         '%d files updated.' % cnt, dict(extra, count=cnt))
+
+    try:
+        if operation == 'delete':
+            cnt = Object.delete_children(system_id, username, file_path)
+        elif operation in ['move', 'copy']:
+            cnt = Object.move_children(system_id, username, file_path, target_path,
+                                       copy=operation == 'copy', progress=progress)
+        else:
+            raise ValueError('Invalid operation: %s' % operation)
+    except (TransportError, ConnectionTimeout) as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        logger.exception('Error updating index', extra=extra)
+        n = Notification(event_type='data',
+                         status=Notification.ERROR,
+                         operation='index_%s_error' % operation,
+                         message='We were unable to update the search index for %s.' % file_path,
+                         user=username,
+                         extra=extra)
+        n.save()
+        return
+
+    n = Notification(event_type='data',
+                     status=Notification.SUCCESS,
+                     operation='index_%s_finished' % operation,
+                     message='Search index updated for %s.' % file_path,
+                     user=username,
+                     extra=dict(extra, count=cnt))
+    n.save()
+
+
 @shared_task(bind=True)
 def share_agave(self, username, file_id, permissions, recursive):
     try:
@@ -84,6 +136,9 @@ def share_agave(self, username, file_id, permissions, recursive):
 
         esf = Object.from_file_path(system_id, username, file_path)
         esf.share(username, permissions, recursive)
+        for pem in permissions:
+            SharedRoot.record_share(system_id, file_path, pem['user_to_share'],
+                                    pem['permission'])
 
         # Notify owner share completed
         n = Notification(event_type = 'data',
@@ -95,16 +150,14 @@ def share_agave(self, username, file_id, permissions, recursive):
         n.save()
 
         # Notify users they have new shared files
-        for pem in permissions:
-            if pem['permission'] != 'NONE':
-                message = '%s shared some files with you.' % user.get_full_name()
-                n = Notification(event_type = 'data',
-                                 status = 'SUCCESS',
-                                 operation = 'share_finished',
-                                 message = message,
-                                 user = pem['user_to_share'],
-                                 extra = f_dict)
-                n.save()
+        Notification.objects.bulk_notify(
+            [pem['user_to_share'] for pem in permissions
+             if pem['permission'] != 'NONE'],
+            event_type='data',
+            status='SUCCESS',
+            operation='share_finished',
+            message='%s shared some files with you.' % user.get_full_name(),
+            extra=f_dict)
 
     except:
         logger.error('Error sharing file/folder', exc_info=True,
@@ -438,8 +491,11 @@ def copy_public_to_mydata(self, username, src_resource, src_file_id, dest_resour
                 notify_status = 'ERROR'
                 logger.error('The request copy source=%s does not exist!', src_resource)
 
-            system, username, path = dest_fm.parse_file_id(dest_file_id)
+            system, file_user, path = dest_fm.parse_file_id(dest_file_id)
+            # The legacy index is read by the legacy file manager,
+            # the change feed only updates the files index.
             dest_fm.indexer.index(system, path, username, levels = 1)
+            FileChange.record(FileChange.CREATE, system, os.path.join(path, dirname))
 
             n = Notification(event_type = 'data',
                              status = notify_status,
@@ -484,7 +540,7 @@ def copy_public_to_mydata(self, username, src_resource, src_file_id, dest_resour
                          # extra = {})
         n.save()
 
-@shared_task(bind=True)
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def external_resource_upload(self, username, dest_resource, src_file_id, dest_file_id):
     """
     :param self:
@@ -493,7 +549,12 @@ def external_resource_upload(self, username, dest_resource, src_file_id, dest_fi
     :param src_file_id:
     :param dest_file_id:
     :return:
+
+    Folders are transferred in parallel and completed files are
+    checkpointed under the task id. When some files fail the task is
+    retried and resumes the transfer.
     """
+    from designsafe.apps.api.external_resources.transfers import TransferError
     logger.debug('Initializing external_resource_upload. username: %s, src_file_id: %s, dest_resource: %s, dest_file_id: %s ', username, src_file_id, dest_resource, dest_file_id)
 
     from designsafe.apps.api.external_resources.box.filemanager.manager \
@@ -513,7 +574,11 @@ def external_resource_upload(self, username, dest_resource, src_file_id, dest_fi
         fmgr = GoogleDriveFileManager(user)
 
     logger.debug('fmgr.upload( %s, %s, %s)', username, src_file_id, dest_file_id)
-    fmgr.upload(username, src_file_id, dest_file_id)
+    try:
+        fmgr.upload(username, src_file_id, dest_file_id,
+                    checkpoint_id=self.request.id)
+    except TransferError as exc:
+        raise self.retry(exc=exc)
     # try:
     #     n = Notification(event_type='data',
     #                      status=Notification.INFO,
@@ -581,7 +646,7 @@ def external_resource_upload(self, username, dest_resource, src_file_id, dest_fi
     #     n.save()
     #     raise
 
-@shared_task(bind=True)
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def external_resource_download(self, file_mgr_name, username, src_file_id, dest_file_id):
     """
     :param self:
@@ -589,7 +654,12 @@ def external_resource_download(self, file_mgr_name, username, src_file_id, dest_
     :param src_file_id:
     :param dest_file_id:
     :return:
+
+    Folders are transferred in parallel and completed files are
+    checkpointed under the task id. When some files fail the task is
+    retried and resumes the transfer.
     """
+    from designsafe.apps.api.external_resources.transfers import TransferError
     logger.debug('Downloading %s://%s for user %s to %s',
                  file_mgr_name, src_file_id, username, dest_file_id)
 
@@ -609,7 +679,11 @@ def external_resource_download(self, file_mgr_name, username, src_file_id, dest_
     elif file_mgr_name == 'googledrive':
         fmgr = GoogleDriveFileManager(user)
 
-    fmgr.copy(username, src_file_id, dest_file_id)
+    try:
+        fmgr.copy(username, src_file_id, dest_file_id,
+                  checkpoint_id=self.request.id)
+    except TransferError as exc:
+        raise self.retry(exc=exc)
 
     # try:
     #     n = Notification(event_type='data',
@@ -739,11 +813,12 @@ def set_project_id(self, project_uuid):
     service.meta.updateMetadata(body=id_meta, uuid=id_meta['uuid'])
     logger.debug('updated id record=%s', id_meta['uuid'])
 
-@shared_task(bind=True, max_retries=5)
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
 def copy_publication_files_to_corral(self, project_id):
     from designsafe.apps.api.agave.filemanager.public_search_index import Publication
     from designsafe.apps.api.agave.models.files import BaseFileResource
-    import shutil
+    from designsafe.apps.api.projects.managers.staging import (PublicationStaging,
+                                                               StagingError)
     publication = Publication(project_id=project_id)
     filepaths = publication.related_file_paths()
     if not len(filepaths):
@@ -763,32 +838,13 @@ def copy_publication_files_to_corral(self, project_id):
     filepaths = sorted(filepaths)
     base_path = ''.join(['/', publication.projectId])
     prefix_dest = '/corral-repl/tacc/NHERI/published/{}'.format(project_id)
-    if not os.path.isdir(prefix_dest):
-        os.mkdir(prefix_dest)
-
     prefix_src = '/corral-repl/tacc/NHERI/projects/{}'.format(publication.project['uuid'])
-    for filepath in filepaths:
-        local_src_path = '{}/{}'.format(prefix_src, filepath)
-        local_dst_path = '{}/{}'.format(prefix_dest, filepath)
-        logger.info('Trying to copy: %s to %s', local_src_path, local_dst_path)
-        if os.path.isdir(local_src_path):
-            try:
-                #os.mkdir(local_dst_path)
-                shutil.copytree(local_src_path, local_dst_path)
-            except OSError as exc:
-                logger.info(exc)
-            except IOError as exc:
-                logger.info(exc)
-        else:
-            try:
-                if not os.path.isdir(os.path.dirname(local_dst_path)):
-                    os.mkdir(os.path.dirname(local_dst_path))
-
-                shutil.copy(local_src_path, local_dst_path)
-            except OSError as exc:
-                logger.info(exc)
-            except IOError as exc:
-                logger.info(exc)
+    staging = PublicationStaging(prefix_src, prefix_dest, staging_id=project_id)
+    try:
+        staging.stage(filepaths)
+    except StagingError as exc:
+        logger.error('Proj Id: %s. %s: %s', project_id, exc, exc.failed)
+        raise self.retry(exc=exc)
 
     #for filepath in filepaths:
     #    filepath = filepath.strip('/')
@@ -849,46 +905,13 @@ def save_publication(self, project_id):
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=60)
 def save_to_fedora(self, project_id):
-    import requests
-    import magic
     from designsafe.apps.api.agave.filemanager.public_search_index import Publication  
+    from designsafe.apps.api.projects.managers.fedora import FedoraIngest
     try:
         pub = Publication(project_id=project_id)
         pub.update(status='published')
         _root = os.path.join('/corral-repl/tacc/NHERI/published', project_id)
-        fedora_base = 'http://fedoraweb01.tacc.utexas.edu:8080/fcrepo/rest/publications_01'
-        res = requests.get(fedora_base)
-        if res.status_code == 404 or res.status_code == 410:
-            requests.put(fedora_base)
-        
-        fedora_project_base = ''.join([fedora_base, '/', project_id])
-        res = requests.get(fedora_project_base)
-        if res.status_code == 404 or res.status_code == 410:
-            requests.put(fedora_project_base)
-
-        headers = {'Content-Type': 'text/plain'}
-        #logger.debug('walking: %s', _root)
-        for root, dirs, files in os.walk(_root):
-            for name in files:
-                mime = magic.Magic(mime=True)
-                headers['Content-Type'] = mime.from_file(os.path.join(root, name))
-                #files
-                full_path = os.path.join(root, name)
-                _path = full_path.replace(_root, '', 1)
-                _path = _path.replace('[', '-')
-                _path = _path.replace(']', '-')
-                url = ''.join([fedora_project_base, urllib.quote(_path)])
-                #logger.debug('uploading: %s', url)
-                with open(os.path.join(root, name), 'rb') as _file:
-                    requests.put(url, data=_file, headers=headers)
-
-            for name in dirs:
-                #dirs
-                full_path = os.path.join(root, name)
-                _path = full_path.replace(_root, '', 1)
-                url = ''.join([fedora_project_base, _path])
-                #logger.debug('creating: %s', _path)
-                requests.put(url)
+        FedoraIngest(_root, project_id, ingest_id=project_id).ingest()
     except Exception as exc:
         logger.error('Proj Id: %s. %s', project_id, exc)
         raise self.retry(exc=exc)
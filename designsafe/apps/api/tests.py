@@ -1,11 +1,13 @@
 from django.test import TestCase, RequestFactory
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 from designsafe.apps.projects.models.agave.experimental import ExperimentalProject, ModelConfig, FileModel
 
 from agavepy.agave import Agave
 import mock
+import os
 import json
 
 import logging
@@ -68,3 +70,238 @@ class InitFileModel(ProjectDataModelsTestCase):
         #file_meta.modelconfiguration_set()
         #logger.debug('file meta dict: %s',
         #             json.dumps(file_meta.to_body_dict(), indent=4))
+
+class PublicationStagingTestCase(TestCase):
+
+    def setUp(self):
+        import tempfile
+        import shutil
+        self.src = tempfile.mkdtemp()
+        self.dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src)
+        self.addCleanup(shutil.rmtree, self.dest)
+        cache.clear()
+
+        import os
+        os.makedirs(os.path.join(self.src, 'Experiment', 'data'))
+        for path in ['Experiment/a.txt', 'Experiment/data/b.txt', 'image.jpg']:
+            with open(os.path.join(self.src, path), 'w') as f:
+                f.write(path)
+
+    def test_stage_skips_staged_files(self):
+        import os
+        from designsafe.apps.api.projects.managers.staging import PublicationStaging
+        staging = PublicationStaging(self.src, os.path.join(self.dest, 'PRJ-1'),
+                                     staging_id='PRJ-1', max_workers=2)
+        progress = staging.stage(['Experiment', 'image.jpg', 'missing.txt'])
+        self.assertEqual(progress['files'], 3)
+        self.assertEqual(progress['skipped'], 0)
+        with open(os.path.join(self.dest, 'PRJ-1', 'Experiment/data/b.txt')) as f:
+            self.assertEqual(f.read(), 'Experiment/data/b.txt')
+
+        with open(os.path.join(self.src, 'image.jpg'), 'a') as f:
+            f.write('changed')
+        progress = staging.stage(['Experiment', 'image.jpg'])
+        self.assertEqual(progress['files'], 1)
+        self.assertEqual(progress['skipped'], 2)
+
+    @mock.patch('designsafe.apps.api.projects.managers.staging.os.rename')
+    def test_failed_copy_removes_temporary_file(self, mock_rename):
+        import os
+        from designsafe.apps.api.projects.managers.staging import PublicationStaging
+        mock_rename.side_effect = OSError('No space left on device')
+        staging = PublicationStaging(self.src, self.dest)
+        with self.assertRaises(OSError):
+            staging.copy('image.jpg', 9, 0)
+        self.assertEqual(os.listdir(self.dest), [])
+
+class FedoraIngestTestCase(TestCase):
+
+    def setUp(self):
+        import os
+        import shutil
+        import tempfile
+        import threading
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, 'Experiment [1]', 'data'))
+        for path in ['Experiment [1]/data/a.txt', 'readme.txt']:
+            with open(os.path.join(self.root, path), 'w') as f:
+                f.write(path)
+        cache.clear()
+
+        requests_received = self.requests = []
+
+        class FedoraHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(404)
+                self.end_headers()
+
+            def do_PUT(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                requests_received.append((self.path, self.headers.get('Digest'), body))
+                self.send_response(201)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), FedoraHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = 'http://127.0.0.1:{}/rest/publications'.format(
+            self.server.server_port)
+
+    def test_ingest_sends_missing_resources(self):
+        import hashlib
+        from designsafe.apps.api.projects.managers.fedora import FedoraIngest
+        with mock.patch('designsafe.apps.api.projects.managers.fedora.guess_mimetype',
+                        return_value='text/plain'):
+            FedoraIngest(self.root, 'PRJ-1', base_url=self.base_url,
+                         ingest_id='PRJ-1', max_workers=2).ingest()
+            paths = [req[0] for req in self.requests]
+            self.assertEqual(paths[:4], ['/rest/publications',
+                                         '/rest/publications/PRJ-1',
+                                         '/rest/publications/PRJ-1/Experiment%20-1-',
+                                         '/rest/publications/PRJ-1/Experiment%20-1-/data'])
+            self.assertEqual(sorted(paths[4:]), [
+                '/rest/publications/PRJ-1/Experiment%20-1-/data/a.txt',
+                '/rest/publications/PRJ-1/readme.txt'])
+            readme = [req for req in self.requests if req[0].endswith('readme.txt')][0]
+            self.assertEqual(readme[1], 'md5=' + hashlib.md5('readme.txt').hexdigest())
+            self.assertEqual(readme[2], 'readme.txt')
+
+            del self.requests[:]
+            FedoraIngest(self.root, 'PRJ-1', base_url=self.base_url,
+                         ingest_id='PRJ-1', max_workers=2).ingest()
+            self.assertEqual([req[0] for req in self.requests],
+                             ['/rest/publications', '/rest/publications/PRJ-1'])
+
+class TransferEngineTestCase(TestCase):
+
+    class Manager(object):
+        NAME = 'test'
+
+        def __init__(self, uploads, workers):
+            self.uploads = uploads
+            self.workers = workers
+            self.folders = []
+
+        def worker_manager(self):
+            self.workers.append(1)
+            return self
+
+        def create_folder(self, parent_id, name):
+            self.folders.append((parent_id, name))
+            return '{}/{}'.format(parent_id, name)
+
+        def upload_file(self, folder_id, file_real_path):
+            self.uploads.append((folder_id, os.path.basename(file_real_path)))
+            if len(self.uploads) == 1:
+                raise ValueError('expired token')
+
+    def setUp(self):
+        import tempfile
+        import shutil
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, 'data', 'sub'))
+        for path in ['data/a.txt', 'data/sub/b.txt']:
+            with open(os.path.join(self.root, path), 'w') as f:
+                f.write(path)
+
+    @mock.patch('designsafe.apps.api.external_resources.transfers.time.sleep')
+    def test_upload_directory_retries_and_resumes(self, mock_sleep):
+        from designsafe.apps.api.external_resources.transfers import TransferEngine
+        uploads = []
+        workers = []
+        manager = self.Manager(uploads, workers)
+        engine = TransferEngine(manager, checkpoint_id='task-1', max_workers=1)
+        engine.upload_directory('0', os.path.join(self.root, 'data'))
+
+        self.assertEqual(manager.folders, [('0', 'data'), ('0/data', 'sub')])
+        self.assertEqual(sorted(set(uploads)), [('0/data', 'a.txt'),
+                                                ('0/data/sub', 'b.txt')])
+        self.assertEqual(len(uploads), 3)
+        # A new worker manager is built after an error.
+        self.assertEqual(len(workers), 2)
+
+        manager = self.Manager([], [])
+        TransferEngine(manager, checkpoint_id='task-1').upload_directory(
+            '0', os.path.join(self.root, 'data'))
+        self.assertEqual(manager.folders, [])
+        self.assertEqual(manager.uploads, [])
+
+class ChunkedUploadTestCase(TestCase):
+
+    def test_resume_must_move_forward(self):
+        import tempfile
+        import os
+        from designsafe.apps.api.external_resources.uploads import ChunkedUpload
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        os.write(fd, b'0123456789')
+        os.close(fd)
+        upload = ChunkedUpload(path, chunk_size=4)
+        append = mock.Mock(side_effect=ValueError('incorrect_offset'))
+        resume = mock.Mock(return_value=4)
+
+        with self.assertRaises(ValueError):
+            upload.upload(mock.Mock(), append, mock.Mock(), resume)
+        self.assertEqual(resume.call_count, 2)
+
+class DOIReservationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('designsafe.apps.api.projects.managers.publication._reserve_doi')
+    def test_reserved_doi_is_reused(self, mock_reserve):
+        from designsafe.apps.api.projects.managers.publication import _reserve_entity_doi
+        mock_reserve.side_effect = ['doi:10.5072/FK2A | ark:/b5072/fk2a',
+                                    'doi:10.5072/FK2B | ark:/b5072/fk2b']
+        first = _reserve_entity_doi(mock.Mock(), 'https://target', 'entity-uuid')
+        second = _reserve_entity_doi(mock.Mock(), 'https://target', 'entity-uuid')
+        self.assertEqual(first, second)
+        self.assertEqual(mock_reserve.call_count, 1)
+
+    @mock.patch('designsafe.apps.api.projects.managers.publication.time.sleep')
+    @mock.patch('designsafe.apps.api.projects.managers.publication._session')
+    def test_request_retries_server_errors(self, mock_session, mock_sleep):
+        from designsafe.apps.api.projects.managers.publication import _request
+        mock_session.return_value.post.side_effect = [
+            mock.Mock(status_code=503, text='unavailable'),
+            mock.Mock(status_code=201, text='success: doi:10.5072/FK2A')]
+        res = _request('post', 'https://ezid/id/doi', data='_status: public')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(mock_session.return_value.post.call_count, 2)
+
+        mock_session.return_value.post.reset_mock()
+        mock_session.return_value.post.side_effect = [
+            mock.Mock(status_code=503, text='unavailable')]
+        res = _request('post', 'https://ezid/shoulder/doi', idempotent=False)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(mock_session.return_value.post.call_count, 1)
+
+class TextPreviewTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_text_preview_downloads_sample_once(self):
+        from designsafe.apps.api.agave.views import text_preview
+        f = mock.Mock(system='designsafe.storage.default', path='ds_user/out.log',
+                      last_modified='2018-05-01T10:00:00.000-05:00')
+        f.download_range.return_value = u'caf\xe9 '.encode('utf-8') * 4
+        with self.settings(TEXT_PREVIEW_MAX_SIZE=10):
+            preview = text_preview(f)
+            self.assertEqual(text_preview(f), preview)
+
+        f.download_range.assert_called_once_with(11)
+        self.assertEqual(preview, (u'caf\xe9 caf'.encode('utf-8'), True))
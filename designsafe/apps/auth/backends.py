@@ -11,6 +11,7 @@ import logging
 import re
 import requests
 from requests.auth import HTTPBasicAuth
+from designsafe.apps.auth.clients import registry
 
 
 @receiver(user_logged_out)
@@ -173,3 +174,4 @@ class AgaveOAuthBackend(ModelBackend):
             auth=HTTPBasicAuth(settings.AGAVE_CLIENT_KEY, settings.AGAVE_CLIENT_SECRET),
             data={'token': user.access_token})
         self.logger.info("revoke response is %s" % response)
+        registry.discard(user.user.username)
@@ -0,0 +1,124 @@
+"""
+.. module: designsafe.apps.auth.clients
+   :synopsis: Process-wide registry of Agave clients sharing a pooled session.
+"""
+import logging
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from six.moves.http_cookiejar import CookiePolicy
+from agavepy.agave import Agave
+from django.conf import settings
+
+#pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+#pylint: enable=invalid-name
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+class BlockAll(CookiePolicy):
+    """Cookie policy which never stores nor sends cookies"""
+    return_ok = set_ok = domain_return_ok = path_return_ok = \
+        lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+
+def shared_session():
+    """Returns the process-wide `requests.Session` used by Agave clients.
+
+    Connections to the tenant are kept alive and reused by every client.
+    Idempotent requests are retried on connection errors and on
+    ``502``, ``503`` and ``504`` responses. The session carries the
+    requests of every user, cookies are blocked so none of them is sent
+    on behalf of another user.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                pool_size = getattr(settings, 'AGAVE_HTTP_POOL_SIZE', 20)
+                retries = Retry(total=getattr(settings, 'AGAVE_HTTP_MAX_RETRIES', 3),
+                                backoff_factor=0.5,
+                                status_forcelist=(502, 503, 504),
+                                raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=pool_size,
+                                      pool_maxsize=pool_size,
+                                      max_retries=retries)
+                session = requests.Session()
+                session.cookies.set_policy(BlockAll())
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _SESSION = session
+    return _SESSION
+
+
+class PooledAgave(Agave):
+    """Agave client which sends every request through :func:`shared_session`.
+
+    Agavepy creates a new http client, and a new session, on
+    instantiation and on every token refresh. The session is swapped
+    every time the resources are built.
+    """
+    def resource(self, auth_type, *args):
+        client = super(PooledAgave, self).resource(auth_type, *args)
+        if client is not None:
+            client.http_client.session = shared_session()
+        return client
+
+
+class AgaveClientRegistry(object):
+    """Caches an Agave client per user.
+
+    Building a client processes the tenant resources and authenticates
+    the resources, it is reused as long as the token it was built with
+    is the current token of the user. Clients are evicted in least
+    recently used order after ``settings.AGAVE_CLIENT_CACHE_SIZE``.
+    """
+    def __init__(self):
+        self._clients = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, access_token, factory):
+        """Returns the cached client for `key` or builds it
+
+        :param str key: cache key, e.g. the username.
+        :param str access_token: current access token. A cached client
+            built with a different token is replaced.
+        :param callable factory: builds a new client.
+        """
+        with self._lock:
+            client = self._clients.pop(key, None)
+            if client is None or getattr(client, '_token', None) != access_token:
+                client = factory()
+            self._clients[key] = client
+            max_size = getattr(settings, 'AGAVE_CLIENT_CACHE_SIZE', 500)
+            while len(self._clients) > max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def refreshed(self, key, client, callback):
+        """Returns a token callback which keeps the cache entry up to date
+
+        The refreshed client replaces the cache entry under the lock
+        before the new token is persisted by `callback`.
+        """
+        def _callback(**kwargs):
+            with self._lock:
+                self._clients[key] = client
+                callback(**kwargs)
+        return _callback
+
+    def discard(self, key):
+        """Removes the client for `key`, e.g. after the token is revoked"""
+        with self._lock:
+            self._clients.pop(key, None)
+
+
+#pylint: disable=invalid-name
+registry = AgaveClientRegistry()
+#pylint: enable=invalid-name
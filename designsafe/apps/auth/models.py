@@ -9,6 +9,7 @@ import requests
 from requests import HTTPError
 # from .signals import *
 from designsafe.libs.common.decorators import deprecated
+from designsafe.apps.auth.clients import PooledAgave, registry
 
 logger = logging.getLogger(__name__)
 
@@ -64,13 +65,23 @@ class AgaveOAuthToken(models.Model):
 
     @property
     def client(self):
-        return Agave(api_server=getattr(settings, 'AGAVE_TENANT_BASEURL'),
-                     api_key=getattr(settings, 'AGAVE_CLIENT_KEY'),
-                     api_secret=getattr(settings, 'AGAVE_CLIENT_SECRET'),
-                     token=self.access_token,
-                     resources=AGAVE_RESOURCES,
-                     refresh_token=self.refresh_token,
-                     token_callback=self.update)
+        """Agave client of the user.
+
+        Clients are cached per process and share a pooled session, see
+        :mod:`designsafe.apps.auth.clients`. The cached client is reused
+        while its token is the current token of the user.
+        """
+        key = self.user.username
+        client = registry.get(
+            key, self.access_token,
+            lambda: PooledAgave(api_server=getattr(settings, 'AGAVE_TENANT_BASEURL'),
+                                api_key=getattr(settings, 'AGAVE_CLIENT_KEY'),
+                                api_secret=getattr(settings, 'AGAVE_CLIENT_SECRET'),
+                                token=self.access_token,
+                                resources=AGAVE_RESOURCES,
+                                refresh_token=self.refresh_token))
+        client.token_callback = registry.refreshed(key, client, self.update)
+        return client
 
     def update(self, **kwargs):
         for k, v in six.iteritems(kwargs):
@@ -0,0 +1,67 @@
+from django.test import TestCase, override_settings
+import mock
+import requests
+from requests.cookies import create_cookie, MockRequest
+
+from designsafe.apps.auth.clients import AgaveClientRegistry, shared_session
+
+
+class AgaveClientRegistryTestCase(TestCase):
+
+    def setUp(self):
+        self.registry = AgaveClientRegistry()
+
+    def _factory(self, token):
+        return lambda: mock.Mock(_token=token)
+
+    def test_client_is_reused_until_token_changes(self):
+        client = self.registry.get('ds_user', 'token-1', self._factory('token-1'))
+        self.assertIs(self.registry.get('ds_user', 'token-1', self._factory('token-1')),
+                      client)
+
+        rebuilt = self.registry.get('ds_user', 'token-2', self._factory('token-2'))
+        self.assertIsNot(rebuilt, client)
+        self.assertEqual(rebuilt._token, 'token-2')
+
+    @override_settings(AGAVE_CLIENT_CACHE_SIZE=2)
+    def test_least_recently_used_client_is_evicted(self):
+        first = self.registry.get('user-1', 'token', self._factory('token'))
+        self.registry.get('user-2', 'token', self._factory('token'))
+        self.registry.get('user-1', 'token', self._factory('token'))
+        self.registry.get('user-3', 'token', self._factory('token'))
+
+        self.assertIs(self.registry.get('user-1', 'token', self._factory('token')),
+                      first)
+        factory = mock.Mock(return_value=mock.Mock(_token='token'))
+        self.registry.get('user-2', 'token', factory)
+        self.assertEqual(factory.call_count, 1)
+
+    def test_refreshed_callback_replaces_client(self):
+        client = self.registry.get('ds_user', 'token-1', self._factory('token-1'))
+        refreshed = mock.Mock(_token='token-2')
+        callback = mock.Mock()
+        self.registry.refreshed('ds_user', refreshed, callback)(
+            access_token='token-2', refresh_token='refresh')
+
+        callback.assert_called_once_with(access_token='token-2',
+                                         refresh_token='refresh')
+        self.assertIs(self.registry.get('ds_user', 'token-2', self._factory('token-2')),
+                      refreshed)
+        self.assertIsNot(refreshed, client)
+
+    def test_discard(self):
+        client = self.registry.get('ds_user', 'token', self._factory('token'))
+        self.registry.discard('ds_user')
+        self.assertIsNot(self.registry.get('ds_user', 'token', self._factory('token')),
+                         client)
+
+
+class SharedSessionTestCase(TestCase):
+
+    def test_cookies_are_not_stored(self):
+        session = shared_session()
+        request = requests.Request('GET', 'https://api.example.com/files/v2').prepare()
+        session.cookies.set_cookie_if_ok(
+            create_cookie('sessionid', 'ds_user', domain='api.example.com'),
+            MockRequest(request))
+        self.assertEqual(len(session.cookies), 0)
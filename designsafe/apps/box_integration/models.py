@@ -39,11 +39,18 @@ class BoxUserToken(models.Model):
         """
         return self.access_token, self.refresh_token
 
+    @property
+    def oauth(self):
+        """
+        OAuth2 object for the stored tokens. Box refresh tokens can only be
+        used once, clients used at the same time must share one OAuth2.
+        """
+        return OAuth2(client_id=settings.BOX_APP_CLIENT_ID,
+                      client_secret=settings.BOX_APP_CLIENT_SECRET,
+                      access_token=self.access_token,
+                      refresh_token=self.refresh_token,
+                      store_tokens=self.update_tokens)
+
     @property
     def client(self):
-        oauth = OAuth2(client_id=settings.BOX_APP_CLIENT_ID,
-                       client_secret=settings.BOX_APP_CLIENT_SECRET,
-                       access_token=self.access_token,
-                       refresh_token=self.refresh_token,
-                       store_tokens=self.update_tokens)
-        return Client(oauth)
+        return Client(self.oauth)
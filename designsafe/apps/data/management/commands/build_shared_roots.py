@@ -0,0 +1,46 @@
+import logging
+from django.core.management.base import BaseCommand
+from elasticsearch_dsl.query import Q
+from designsafe.apps.data.models.elasticsearch import IndexedFile
+from designsafe.apps.data.models.shares import SharedRoot
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    """This command builds the shared roots from the files index.
+
+    Every document with permissions for a user other than the owner
+    of the path, or for ``WORLD``, is recorded as a share. Documents are
+    scanned sorted by path so parents are recorded before their children
+    and only the top-most shared paths are kept.
+    """
+    help = 'Build the shared roots used to list $SHARE from the files index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--system', help="System to build the shared roots for",
+                            default='designsafe.storage.default')
+        parser.add_argument('--clear', help="Delete the existing shared roots first",
+                            action="store_true", default=False)
+
+    def handle(self, *args, **options):
+        system = options.get('system')
+        if options.get('clear'):
+            SharedRoot.objects.filter(system=system).delete()
+
+        search = IndexedFile.search()
+        search = search.query(Q('term', **{'system._exact': system}))
+        search = search.sort('path._exact', 'name._exact')
+        search = search.params(preserve_order=True)
+        cnt = 0
+        for doc in search.scan():
+            full_path = '/'.join([doc.path.strip('/'), doc.name]).strip('/')
+            owner = full_path.split('/')[0]
+            for pem in getattr(doc, 'permissions', []):
+                username = pem['username']
+                if username == owner or not pem['permission']['read']:
+                    continue
+                SharedRoot.record_share(system, full_path, username, 'READ')
+                cnt += 1
+        self.stdout.write('Shares recorded: %d' % cnt)
+        self.stdout.write('Shared roots: %d' %
+                          SharedRoot.objects.filter(system=system).count())
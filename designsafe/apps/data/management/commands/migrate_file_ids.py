@@ -0,0 +1,104 @@
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import elasticsearch
+from elasticsearch.helpers import scan, streaming_bulk
+from designsafe.libs.elasticsearch.utils import file_uuid
+
+logger = logging.getLogger(__name__)
+
+#: Field names used by each files index to store the system id.
+SYSTEM_FIELDS = {
+    'files': 'system',
+    'legacy': 'systemId',
+}
+
+class Command(BaseCommand):
+    """This command rewrites file documents to use deterministic ids.
+
+    Every document whose id does not match
+    :func:`~designsafe.libs.elasticsearch.utils.file_uuid` is created
+    again under the new id and the old document is deleted.
+    Duplicated documents (same system and path) collapse into a single one:
+    a document which already exists under the new id is never overwritten,
+    the duplicates are only deleted.
+    """
+    help = 'Rewrite file documents to use ids derived from system + path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', help="Files index to migrate. 'files' (default) "\
+                            "for the files index or 'legacy' for the 'designsafe' index",
+                            choices=sorted(SYSTEM_FIELDS.keys()), default='files')
+        parser.add_argument('--batch-size', help="Number of documents per bulk request",
+                            default=500, type=int)
+        parser.add_argument('--timeout', help="Bulk request timeout", default=120, type=int)
+        parser.add_argument('--dry-run', help="Only count documents to migrate",
+                            action="store_true", default=False)
+
+    def _actions(self, es_client, index, doc_type, system_field, stats):
+        for hit in scan(es_client, index=index, doc_type=doc_type,
+                        query={"query": {"match_all": {}}}):
+            source = hit['_source']
+            stats['total'] += 1
+            if not source.get('name') or not source.get(system_field):
+                stats['skipped'] += 1
+                continue
+
+            doc_id = file_uuid(source[system_field], source.get('path', '/'),
+                               source['name'])
+            if hit['_id'] == doc_id:
+                continue
+
+            stats['migrated'] += 1
+            yield {
+                '_op_type': 'create',
+                '_index': hit['_index'],
+                '_type': hit['_type'],
+                '_id': doc_id,
+                '_source': source,
+            }
+            yield {
+                '_op_type': 'delete',
+                '_index': hit['_index'],
+                '_type': hit['_type'],
+                '_id': hit['_id'],
+            }
+
+    def handle(self, *args, **options):
+        index_key = options.get('index')
+        if index_key == 'files':
+            index = settings.ES_INDICES['files']['name']
+            doc_type = settings.ES_INDICES['files']['documents'][0]['name']
+        else:
+            index = 'designsafe'
+            doc_type = 'objects'
+        system_field = SYSTEM_FIELDS[index_key]
+
+        es_client = elasticsearch.Elasticsearch(
+            settings.ES_CONNECTIONS[settings.DESIGNSAFE_ENVIRONMENT]['hosts'],
+            request_timeout=options.get('timeout'))
+        if not es_client.indices.exists(index):
+            raise CommandError('Index %s does not exist.' % index)
+
+        stats = {'total': 0, 'migrated': 0, 'skipped': 0, 'duplicates': 0,
+                 'errors': 0}
+        actions = self._actions(es_client, index, doc_type, system_field, stats)
+        if options.get('dry_run'):
+            for _ in actions:
+                pass
+        else:
+            for ok, item in streaming_bulk(es_client, actions,
+                                           chunk_size=options.get('batch_size'),
+                                           raise_on_error=False):
+                if not ok and item.get('create', {}).get('status') == 409:
+                    # Document already exists under its new id.
+                    stats['duplicates'] += 1
+                elif not ok:
+                    stats['errors'] += 1
+                    logger.error('Error migrating document: %s', item)
+
+        self.stdout.write('Documents scanned: %d' % stats['total'])
+        self.stdout.write('Documents migrated: %d' % stats['migrated'])
+        self.stdout.write('Documents skipped: %d' % stats['skipped'])
+        self.stdout.write('Duplicates deleted: %d' % stats['duplicates'])
+        self.stdout.write('Errors: %d' % stats['errors'])
@@ -3,8 +3,11 @@ import logging
 import os
 # import urllib2
 # import json
+from elasticsearch.helpers import streaming_bulk
 from elasticsearch_dsl.query import Q
+from elasticsearch_dsl.connections import connections
 from designsafe.apps.data.models.elasticsearch import IndexedFile
+from designsafe.libs.elasticsearch.utils import file_uuid, normalize_file_path
 
 # pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
@@ -73,6 +76,122 @@ class FileManager(object):
         res = search.execute()
         return res, search
 
+    @staticmethod
+    def _subtree_query(system, file_path, children_only=False):
+        """Query matching a file and every folder's children"""
+        term_system_query = Q(
+            'term',
+            **{'system._exact': system}
+        )
+        term_path_query = Q('term', **{'path._path': file_path})
+        bool_query = Q('bool')
+        bool_query.must = [term_system_query]
+        bool_query.should = [term_path_query]
+        if not children_only:
+            self_query = Q('bool')
+            self_query.must = [
+                Q('term', **{'path._exact': os.path.dirname(file_path) or '/'}),
+                Q('term', **{'name._exact': os.path.basename(file_path)})
+            ]
+            bool_query.should.append(self_query)
+        bool_query.minimum_should_match = 1
+        return bool_query
+
+    def delete_recursive(
+            self,
+            system='designsafe.storage.default',
+            path='/',
+            children_only=False):
+        """Deletes a file and every folder's children
+
+        This is a single `delete_by_query` request. The permissions
+        filter is not applied, this is meant to clean up documents of
+        files that do not exist anymore.
+
+        :param str system: System Id. Default: designsafe.storage.default
+        :param str path: Full path of the file
+        :param bool children_only: if `True` the document of the file
+            itself is not deleted.
+
+        :returns: count of how many documents were deleted
+        :rtype: int
+        """
+        file_path = normalize_file_path(path)
+        bool_query = self._subtree_query(system, file_path,
+                                         children_only=children_only)
+        es_client = connections.get_connection()
+        resp = es_client.delete_by_query(
+            index=IndexedFile._doc_type.index,
+            doc_type=IndexedFile._doc_type.name,
+            body={'query': bool_query.to_dict()},
+            conflicts='proceed'
+        )
+        logger.debug('delete_recursive %s: %s',
+                     os.path.join(system, file_path), resp)
+        return resp.get('deleted', 0)
+
+    def move_recursive(
+            self,
+            system='designsafe.storage.default',
+            path='/',
+            new_path='/',
+            chunk_size=500):
+        """Moves a file and every folder's children
+
+        Document ids are derived from the file path, a path change is
+        a change of id. Every document is scanned once and a bulk `index`
+        action with the new path and id is sent together with a bulk
+        `delete` action of the old id.
+        The permissions filter is not applied.
+
+        :param str system: System Id. Default: designsafe.storage.default
+        :param str path: Full path of the file
+        :param str new_path: New full path of the file
+        :param int chunk_size: number of documents per bulk request
+
+        :returns: count of how many documents were moved
+        :rtype: int
+        """
+        file_path = normalize_file_path(path)
+        new_file_path = normalize_file_path(new_path)
+        search = IndexedFile.search()
+        search = search.query(self._subtree_query(system, file_path))
+        es_client = connections.get_connection()
+
+        def _actions():
+            for doc in search.scan():
+                source = doc.to_dict()
+                doc_path = normalize_file_path(source['path'], source['name'])
+                doc_path = new_file_path + doc_path[len(file_path):]
+                source['path'] = os.path.dirname(doc_path) or '/'
+                source['name'] = os.path.basename(doc_path)
+                yield {
+                    '_op_type': 'index',
+                    '_index': IndexedFile._doc_type.index,
+                    '_type': IndexedFile._doc_type.name,
+                    '_id': file_uuid(system, doc_path),
+                    '_source': source
+                }
+                yield {
+                    '_op_type': 'delete',
+                    '_index': IndexedFile._doc_type.index,
+                    '_type': IndexedFile._doc_type.name,
+                    '_id': doc.meta.id
+                }
+
+        cnt = 0
+        for ok, item in streaming_bulk(es_client, _actions(),
+                                       chunk_size=chunk_size,
+                                       raise_on_error=False):
+            op_type, result = item.popitem()
+            if not ok:
+                logger.error('Bulk %s error: %s', op_type, result)
+            elif op_type == 'index':
+                cnt += 1
+        logger.debug('move_recursive %s -> %s: %d',
+                     os.path.join(system, file_path), new_file_path, cnt)
+        return cnt
+
     def get(self, system='designsafe.storage.default', path='/', name=''):
         """Gets a file"""
         search = IndexedFile.search()
@@ -96,43 +215,50 @@ class FileManager(object):
         return res, search
 
     def index(self, file_object, pems):
-        """Indexes an Agave response file object (json) to an IndexedFile"""
-        res, search = self.get(file_object.system,
-                               os.path.dirname(file_object.path.strip('/')),
-                               os.path.basename(file_object.path.strip('/')))
-        if res.hits.total > 1:
-            for doc in res[1:]:
-                doc.delete(ignore=404)
-        if res.hits.total >= 1:
-            document = res[0]
-            file_object.pop('_links')
-            file_object.pop('permissions')
-            document.update(**file_object)
-        else:
-            document = IndexedFile(
-                name=os.path.basename(file_object.path.strip('/')),
-                path=os.path.dirname(file_object.path.strip('/')) or '/',
-                lastModified=file_object.lastModified.isoformat(),
-                length=file_object.length,
-                format=file_object.format,
-                mimeType=file_object.mimeType,
-                type=file_object.type,
-                system=file_object.system,
-            )
-            if pems is None or not pems:
-                document.permissions = [{
-                    'username': self.username,
-                    'permission': {
-                        'read': True,
-                        'write': True,
-                        'execute': True
-                    }
-                }]
-            document.save()
+        """Indexes an Agave response file object (json) to an IndexedFile
+
+        The document id is derived from the system and the file path
+        (see :func:`~designsafe.libs.elasticsearch.utils.file_uuid`),
+        so this is a single upsert request and no search is done to find
+        an existing document. "Optimistic permissions" are only set
+        when the document is created.
 
+        :returns: the stored document, as returned by the update request.
+        """
+        file_path = file_object.path.strip('/')
+        body = {
+            'name': os.path.basename(file_path),
+            'path': os.path.dirname(file_path) or '/',
+            'lastModified': file_object.lastModified.isoformat(),
+            'length': file_object.length,
+            'format': file_object.format,
+            'mimeType': file_object.mimeType,
+            'type': file_object.type,
+            'system': file_object.system,
+        }
         if pems:
             for pem in pems:
                 pem.pop('_links', None)
                 pem.pop('internalUsername', None)
-            document.update(permissions=pems)
-        return document
+            body['permissions'] = pems
+        upsert = dict(body)
+        if not pems:
+            upsert['permissions'] = [{
+                'username': self.username,
+                'permission': {
+                    'read': True,
+                    'write': True,
+                    'execute': True
+                }
+            }]
+
+        doc_id = file_uuid(body['system'], body['path'], body['name'])
+        es_client = connections.get_connection()
+        res = es_client.update(
+            index=IndexedFile._doc_type.index,
+            doc_type=IndexedFile._doc_type.name,
+            id=doc_id,
+            body={'doc': body, 'upsert': upsert},
+            _source=True
+        )
+        return IndexedFile(meta={'id': doc_id}, **res['get']['_source'])
@@ -1,14 +1,168 @@
 import logging
 import datetime
 import os
+import threading
+import time
 import urllib2
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from requests import HTTPError
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch_dsl.connections import connections
 from designsafe.apps.data.models.elasticsearch import IndexedFile
 from designsafe.apps.data.managers.elasticsearch import FileManager as ESFileManager
+from designsafe.libs.elasticsearch.utils import file_uuid
 
 #pylint: disable=invalid-name
 logger = logging.getLogger(__name__)
 #pylint: enable=invalid-name
 
+def _batches(actions, batch_size, flush_interval):
+    """Groups bulk actions into batches.
+
+    A batch is yielded when it holds ``batch_size`` actions or when
+    ``flush_interval`` seconds have passed since its first action was
+    added, whichever comes first.
+
+    .. note:: The flush interval is checked every time a new action
+        is generated. A slow ``files.list`` call will delay the flush
+        until the walk produces the next action.
+    """
+    batch = []
+    started = time.time()
+    for action in actions:
+        if not batch:
+            started = time.time()
+        batch.append(action)
+        if len(batch) >= batch_size or time.time() - started >= flush_interval:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def concurrent_walk_levels(list_level, path, bottom_up=False,
+                           max_workers=None, path_of=None):
+    """Walks a filesystem listing several levels concurrently.
+
+    This generator keeps up to ``max_workers`` calls to ``list_level``
+    in flight and yields ``(root, folders, files)`` triples as the
+    listings arrive. The triples are **not** yielded in a depth first order.
+
+    When walking top to bottom the ``folders`` list can be modified
+    inplace (e.g. ``del folders[:]``) to prune the walk, same as
+    :meth:`os.walk`. The children of a level are only listed after
+    the consumer resumes the generator.
+    When walking bottom to top a level is yielded only after every
+    level below it has been yielded.
+
+    :param callable list_level: function receiving a path and returning
+        a ``(folders, files)`` tuple
+    :param str path: path to walk
+    :param bool bottom_up: if `True` walk the path bottom to top.
+    :param int max_workers: max number of concurrent ``list_level`` calls.
+        Default ``settings.AGAVE_WALK_MAX_WORKERS``
+    :param callable path_of: function returning the path of a folder object.
+        Default returns the ``path`` attribute.
+    """
+    max_workers = max_workers or getattr(settings, 'AGAVE_WALK_MAX_WORKERS', 8)
+    if path_of is None:
+        path_of = lambda folder: folder.path
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {}
+    # bottom up bookkeeping.
+    # parents: child path -> parent path
+    # pending: path -> [unfinished children count, folders, files]
+    parents = {}
+    pending = {}
+    try:
+        futures[executor.submit(list_level, path)] = path
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                root = futures.pop(future)
+                folders, files = future.result()
+                if not bottom_up:
+                    yield (root, folders, files)
+
+                for folder in folders:
+                    folder_path = path_of(folder)
+                    if bottom_up:
+                        parents[folder_path] = root
+                    futures[executor.submit(list_level, folder_path)] = folder_path
+
+                if bottom_up:
+                    pending[root] = [len(folders), folders, files]
+                    node = root
+                    while node is not None and not pending[node][0]:
+                        _, node_folders, node_files = pending.pop(node)
+                        yield (node, node_folders, node_files)
+                        node = parents.pop(node, None)
+                        if node is not None:
+                            pending[node][0] -= 1
+    finally:
+        executor.shutdown(wait=False)
+
+class RateLimiter(object):
+    """Thread safe limiter of calls per second.
+
+    Every caller of :meth:`wait` gets the next free time slot and sleeps
+    until then. Slots are ``1 / rate`` seconds apart.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed"""
+        with self.lock:
+            now = time.time()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def merge_listings(objs, docs, name_of=None):
+    """Merges a filesystem listing with an ES listing of the same level.
+
+    Both listings are sorted by name and walked once side by side,
+    instead of checking every name against the other listing.
+    Yields ``(obj, doc)`` tuples:
+
+        * ``(obj, None)`` the file has no document.
+        * ``(None, doc)`` the document has no file, or it is a duplicate
+          of a document already yielded.
+        * ``(obj, doc)`` the file has a document.
+
+    :param list objs: file objects (e.g. Agave response file objects)
+    :param list docs: ES documents with a ``name`` attribute
+    :param callable name_of: function returning the name of a file object.
+        Default returns the ``name`` attribute.
+    """
+    if name_of is None:
+        name_of = lambda obj: obj.name
+    objs = sorted(objs, key=name_of)
+    docs = sorted(docs, key=lambda doc: doc.name)
+    i = j = 0
+    prev_name = None
+    while i < len(objs) or j < len(docs):
+        if j < len(docs) and docs[j].name == prev_name:
+            yield (None, docs[j])
+            j += 1
+        elif j >= len(docs) or (i < len(objs) and name_of(objs[i]) < docs[j].name):
+            yield (objs[i], None)
+            i += 1
+        elif i >= len(objs) or docs[j].name < name_of(objs[i]):
+            prev_name = docs[j].name
+            yield (None, docs[j])
+            j += 1
+        else:
+            prev_name = docs[j].name
+            yield (objs[i], docs[j])
+            i += 1
+            j += 1
+
 class AgaveIndexer(object):
     """Indexer class for all indexing needs.
 
@@ -125,7 +279,8 @@ class AgaveIndexer(object):
             if bottom_up:
                 yield _file
 
-    def walk_levels(self, system_id, path, bottom_up = False):
+    def walk_levels(self, system_id, path, bottom_up=False, max_workers=None,
+                    page_size=None):
         """Walk a path in an agave filesystem.
 
         This generator walks the agavefilesystem making a call to `files.list`
@@ -138,6 +293,10 @@ class AgaveIndexer(object):
         :param str path: path to walk
         :param bool bottom_up: if `True` walk the path bottom to top. Default `False`
             will walk the path top to bottom
+        :param int max_workers: max number of concurrent `files.list` calls.
+            Default ``settings.AGAVE_WALK_MAX_WORKERS``
+        :param int page_size: max number of files per `files.list` call.
+            Default ``settings.AGAVE_LISTING_PAGE_SIZE``
 
         :returns: A triple with the root fiele path string, a list with all the
             folders in the current level and a list with all the files in the
@@ -150,23 +309,24 @@ class AgaveIndexer(object):
         Pseudocode:
         -----------
 
-        1. call `files.list` on `path`
-        2. for each file in the listing
-
-            2.1. instantiate :class:`~designsafe.apps.api.agave.file.AgaveFile`
-            2.2. append object to the corresponding folders or files list
-
-        3. if is a top to bottom walk then yield (path, folders, files)
+        1. list `path` in a worker thread, see :meth:`_list_level`
+        2. wait for any listing in flight to finish
+        3. if is a top to bottom walk then yield (root, folders, files)
         4. for every folder in `folders`
 
-            4.1. yield returned triple from calling :meth:`walk_levels`
-                using the folder's path
+            4.1. submit the listing of the folder's path to the worker pool
 
-        5. if is a bottom to top walk then yield (path, folders, files)
+        5. if is a bottom to top walk and every folder below root has
+            been yielded then yield (root, folders, files)
+        6. repeat from 2. until there are no listings in flight
 
         Notes:
         ------
 
+            Levels are yielded as soon as their listing is retrieved.
+            This means the walk is not depth first and sibling levels
+            can be yielded in any order. See :func:`concurrent_walk_levels`.
+
             Similar to :meth:`os.walk` the `files` and `folders` list can be
             modified inplace to modify future iterations. Modifying the
             `files` and `folders` lists inplace can be used to tell the
@@ -192,27 +352,51 @@ class AgaveIndexer(object):
 
         """
 
-        resp = self.ag.files.list(systemId=system_id, filePath=urllib2.quote(path))
+        return concurrent_walk_levels(
+            lambda level_path: self._list_level(system_id, level_path, page_size),
+            path, bottom_up=bottom_up, max_workers=max_workers)
+
+    def _list_level(self, system_id, path, page_size=None):
+        """Lists every file in a level of an agave filesystem
+
+        Listings larger than `page_size` are retrieved with several
+        `files.list` calls.
+
+        :returns: A tuple with a list of folders and a list of files
+        :rtype: tuple
+        """
+        page_size = page_size or getattr(settings, 'AGAVE_LISTING_PAGE_SIZE', 100)
         folders = []
         files = []
-        for _file in resp:
-            if _file.name == '.':
-                continue
-            if _file.format == 'folder':
-                folders.append(_file)
-            else:
-                files.append(_file)
-        if not bottom_up:
-            yield (path, folders, files)
-        for _folder in folders:
-            for (spath, sfolders, sfiles) in self.walk_levels(system_id, _folder.path,
-                                                              bottom_up=bottom_up):
-                yield (spath, sfolders, sfiles)
-
-        if bottom_up:
-            yield (path, folders, files)
-
-    def _dedup_and_discover(self, system_id, username, root, files, folders):
+        offset = 0
+        while True:
+            resp = self.ag.files.list(systemId=system_id,
+                                      filePath=urllib2.quote(path),
+                                      limit=page_size, offset=offset)
+            for _file in resp:
+                if _file.name == '.':
+                    continue
+                if _file.format == 'folder':
+                    folders.append(_file)
+                else:
+                    files.append(_file)
+            if len(resp) < page_size:
+                break
+            offset += page_size
+        return folders, files
+
+    @staticmethod
+    def _doc_outdated(file_object, doc):
+        """Checks if a document's data differs from an Agave file object"""
+        last_modified = doc.lastModified
+        if isinstance(last_modified, datetime.datetime):
+            last_modified = last_modified.isoformat()
+        return (doc.length != file_object.length or
+                doc.type != file_object.type or
+                last_modified != file_object.lastModified.isoformat())
+
+    def _dedup_and_discover(self, system_id, username, root, files, folders,
+                            reconcile=False):
         """Deduping and discovery of Agave Files in Elasticsearch (ES)
 
         This helper function process a list of folders and files to discover
@@ -224,6 +408,8 @@ class AgaveIndexer(object):
         :param str root: root path
         :param list files: a list of :class:`~designsafe.apps.api.data.agave.file.AgaveFile` objects
         :param list folders: a list of :class:`~designsafe.apps.api.data.agave.file.AgaveFile` objects
+        :param bool reconcile: if `True` file objects which data differs
+            from their ES document are also returned to be indexed.
 
         :returns: `(objs_to_index, docs_to_delete)` A tuple with two lists
             `objs_to_index` is a list of :class:`~designsafe.apps.api.data.agave.file.AgaveFile`
@@ -236,52 +422,37 @@ class AgaveIndexer(object):
         Pseudocode
         ----------
 
-            1. construct a list of all the file names. This is so we can use it
-                to compare the documents retrieved from ES. We use only the
+            1. get all the documents that are direct children of the root path given.
+            2. sort the file objects and the documents by name and merge
+                both lists (see :func:`merge_listings`). We use only the
                 file name because we are operating on a specific filesystem level
                 meaning that the path is always going to be the same.
-            2. get all the documents that are direct children of the root path given.
-            3. for each document retrieved from ES
-
-                3.1. append document to the list of documents
-                3.2. if the name of the document is already in the list of
-                    document names then we assume is a duplicate and append it
-                    to the list of documents to delete.
-                    If the name of the document is not in the list of document
-                    names then append it
-
-            4. create the `objs_to_index` list by getting all the file objects
-                which names do not appear in the list of document names. Meaning,
-                we are getting all the file objects that we do not have in the
-                ES index.
-            5. create the `docs_to_delete` list by appending all the documents
-                which names do not appear in the file object names list to the
-                previously creatd duplicated documents list. Meaning, we are
-                appending all the ES documents for which there are no file in the
-                agave filesystem.
+            3. for each merged pair
+
+                3.1. if there is no document append the file object to
+                    `objs_to_index`.
+                3.2. if there is no file object, the document is either
+                    a duplicate or there is no file in the agave filesystem
+                    for it. Append it to `docs_to_delete`.
+                3.3. if `reconcile` is `True` and the document data differs
+                    from the file object append the file object to `objs_to_index`.
         """
-        objs = folders + files
-        objs_names = [o.name for o in objs]
         mgr = ESFileManager(username)
         r, s = mgr.listing(system_id, root)
-        docs = []
-        doc_names = []
+        objs_to_index = []
         docs_to_delete = []
-
-        for d in s.scan():
-            docs.append(d)
-            if d.name in doc_names:
-                docs_to_delete.append(d)
-            else:
-                doc_names.append(d.name)
-
-        objs_to_index = [o for o in objs if o.name not in doc_names]
-        docs_to_delete += [o for o in docs if o.name not in objs_names]
+        for obj, doc in merge_listings(folders + files, s.scan()):
+            if doc is None:
+                objs_to_index.append(obj)
+            elif obj is None:
+                docs_to_delete.append(doc)
+            elif reconcile and self._doc_outdated(obj, doc):
+                objs_to_index.append(obj)
         return objs_to_index, docs_to_delete
 
     def index(self, system_id, path, username, bottom_up = False,
               levels = 0, index_full_path = True, full_indexing = False,
-              pems_indexing = False):
+              pems_indexing = False, reconcile = False):
         """Indexes a file path
 
         This method walks an agave file path and indexes the file's information
@@ -302,6 +473,10 @@ class AgaveIndexer(object):
             no deduping or discovery is performed. Default `False`
         :param bool pems_indexing: if `True` "optimistic permissions" will not be
             used and the response to `files.listPermissions` will get indexed.
+        :param bool reconcile: if `True` existing documents are also updated
+            when their data differs from the agave file. This is cheaper than
+            `full_indexing` since only outdated documents are touched.
+            Default `False`
 
         :returns: a tuple with the count of documents created and documents deleted
         :rtype: list
@@ -315,7 +490,9 @@ class AgaveIndexer(object):
 
             3 for each document to delete
 
-                3.1 delete ES document recursevly.
+                3.1 if it is a duplicate delete only the ES document.
+                3.2 if there is no agave file for it delete the ES document
+                    and its children with a single `delete_by_query` request.
 
             4. if `full_indexing` is **not** `True`
 
@@ -352,16 +529,19 @@ class AgaveIndexer(object):
             logger.debug('system_id: %s, path: %s', system_id, root)
 
             objs_to_index, docs_to_delete = self._dedup_and_discover(system_id,
-                                                username, root, files, folders)
+                                                username, root, files, folders,
+                                                reconcile=reconcile)
+            if docs_to_delete:
+                names = set(o.name for o in folders + files)
             for d in docs_to_delete:
-                logger.debug(u'delete_recursive: %s', os.path.join(d.path, d.name))
-                res, search = mgr.listing_recursive(username)
-                if res.hits.total:
-                    for doc in search.scan():
-                        doc.delete(ignore=404)
-
-                d.delete(ignore=404)
-                docs_deleted += res.hits.total + 1
+                if d.name in names:
+                    logger.debug(u'delete duplicate: %s', d.meta.id)
+                    d.delete(ignore=404)
+                    docs_deleted += 1
+                    continue
+                doc_path = os.path.join(d.path, d.name)
+                logger.debug(u'delete_recursive: %s', doc_path)
+                docs_deleted += mgr.delete_recursive(system_id, doc_path)
 
             if not full_indexing:
                 for o in objs_to_index:
@@ -403,7 +583,69 @@ class AgaveIndexer(object):
                 path_comp.pop()
         return docs_indexed, docs_deleted
 
-    def index_permissions(self, system_id, path, username, bottom_up = True, levels = 0):
+    def apply_change(self, change, username):
+        """Applies a recorded file operation to the files index
+
+        Deletes and moves are applied to the existing documents and to the
+        shared roots without any calls to Agave. Creates and permission changes index the
+        file itself and walk only the subtree below it, if it is a folder.
+
+        :param change: :class:`~designsafe.apps.data.models.changes.FileChange`
+        :param str username: username making the request
+
+        :returns: count of documents touched
+        :rtype: int
+        """
+        from designsafe.apps.data.models.changes import FileChange
+        from designsafe.apps.data.models.shares import SharedRoot
+        mgr = ESFileManager(username=username)
+        if change.operation == FileChange.DELETE:
+            SharedRoot.delete_path(change.system, change.path)
+            return mgr.delete_recursive(change.system, change.path)
+        elif change.operation == FileChange.MOVE:
+            SharedRoot.move_path(change.system, change.path, change.new_path)
+            return mgr.move_recursive(change.system, change.path,
+                                      change.new_path)
+
+        file_path = change.path or '/'
+        try:
+            afs = self.ag.files.list(systemId=change.system,
+                                     filePath=urllib2.quote(file_path),
+                                     limit=1)
+        except HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 404:
+                raise
+            logger.debug(u'File does not exist anymore: %s', change)
+            return 0
+
+        af = afs[0]
+        pems = self.ag.files.listPermissions(systemId=change.system,
+                                             filePath=urllib2.quote(file_path))
+        mgr.index(af, pems=pems)
+        cnt = 1
+        if af.type == 'dir':
+            docs_indexed, docs_deleted = self.bulk_index(
+                change.system, file_path, username, index_full_path=False,
+                full_indexing=change.operation == FileChange.PEMS,
+                pems_indexing=True)
+            cnt += docs_indexed + docs_deleted
+        return cnt
+
+    @staticmethod
+    def _clean_pems(pems):
+        """Removes the keys of a `files.listPermissions` response
+        which are not part of the permissions mapping"""
+        cleaned = []
+        for pem in pems:
+            pem = dict(pem)
+            pem.pop('_links', None)
+            pem.pop('internalUsername', None)
+            cleaned.append(pem)
+        return cleaned
+
+    def index_permissions(self, system_id, path, username, bottom_up = True,
+                          levels = 0, max_workers = None, rate_limit = None,
+                          inherit = False):
         """Indexes the permissions
 
         This method works from the indexed documents. It searches for all the
@@ -414,14 +656,40 @@ class AgaveIndexer(object):
         :param str system_id: system id
         :param str path: path to walk
         :param str username: username who is making the request
-        :param bool bottom_up: if `True` iterate through the ES documents from the bottom
-            to the top based on path length
-        :param int levels: number of levels to iterate through. If `bottom_up` is set
-            to `True` this does not do anything.
+        :param bool bottom_up: not used. Documents are always processed from
+            the top to the bottom so inherited permissions can be reused.
+            Kept for backwards compatibility.
+        :param int levels: number of levels to iterate through. Only the
+            documents whose parent path has at most `levels` components are
+            updated, the document of `path` is always updated.
+        :param int max_workers: max number of concurrent `files.listPermissions`
+            calls. Default ``settings.AGAVE_WALK_MAX_WORKERS``
+        :param float rate_limit: max number of `files.listPermissions` calls
+            per second. Default ``settings.AGAVE_PEMS_RATE_LIMIT``
+        :param bool inherit: if `True` the permissions of a folder are
+            reused for its children when every permission of the folder
+            is recursive, instead of calling agave for every child. Only
+            use it when no child of `path` is shared on its own, e.g. job
+            outputs, otherwise those shares are overwritten. Default `False`
 
         :returns: count of documents updated
         :rtype: int
 
+        Pseudocode
+        ----------
+
+            1. get all the documents that are children of `path` and group
+                them by depth.
+            2. for every depth, starting with the document of `path`
+
+                2.1 for every document, if the closest ancestor already processed
+                    has only recursive permissions use the ancestor's
+                    permissions.
+                2.2 if not, get the permissions with `files.listPermissions`
+                    using a pool of workers and a rate limit.
+
+            3. send a bulk `update` action for every document.
+
         Notes
         -----
 
@@ -429,29 +697,303 @@ class AgaveIndexer(object):
             we use a search that searches on `path._path` property of the document
             this is set with a hierarchy tokenizer.
 
-            This means that with one search we can get all the children documents
-            of a given path in one call, but they are not necessarily going
-            to be sorted. In order to sort the files we sort them by the length
-            of their paths. This is not necessarily correct but it is good enough
-            for updating permissions.
+            **Warning** when `inherit` is `True` permissions given directly to
+            a child of a folder shared recursively are replaced by the
+            permissions of the folder.
         """
-        import urllib
-        cnt = 0
+        max_workers = max_workers or getattr(settings, 'AGAVE_WALK_MAX_WORKERS', 8)
+        rate_limit = rate_limit or getattr(settings, 'AGAVE_PEMS_RATE_LIMIT', 20)
+        started = time.time()
         mgr = ESFileManager(username=username)
-        r, s = mgr.listing_recursive(system_id, path)
-        objs = sorted(s.scan(), key = lambda x: len(x.path.split('/')), reverse=bottom_up)
-        if levels:
-            objs = filter(lambda x: len(x.path.split('/')) <= levels, objs)
-        p, n = os.path.split(path)
-        if p == '':
-            p = '/'
-        objs.append(mgr.get(system_id, os.path.join(p, n)))
-        for o in objs:
-            if len(o.path.split('/')) == 1 and o.name == 'Shared with me':
+        file_path = path.strip('/')
+        res, _ = mgr.get(system_id, os.path.dirname(file_path) or '/',
+                         os.path.basename(file_path))
+        depths = {}
+        if res.hits.total:
+            depths[0] = [res[0]]
+        _, search = mgr.listing_recursive(system_id, file_path)
+        base_depth = len(file_path.split('/'))
+        for doc in search.scan():
+            if levels and len(doc.path.split('/')) > levels:
                 continue
-            pems = self.ag.files.listPermissions(
-                filePath=urllib.quote(os.path.join(o.path, o.name)),
-                systemId=system_id)
-            o.update(permissions = pems)
-            cnt += 1
+            depth = len(doc.path.strip('/').split('/')) - base_depth + 1
+            depths.setdefault(depth, []).append(doc)
+
+        limiter = RateLimiter(rate_limit)
+
+        def _list_pems(doc):
+            limiter.wait()
+            return self._clean_pems(self.ag.files.listPermissions(
+                systemId=system_id,
+                filePath=urllib2.quote(os.path.join(doc.path, doc.name))))
+
+        # full path -> permissions of the folders processed.
+        # `None` when the permissions can not be inherited.
+        inherited = {}
+        actions = []
+        calls = 0
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for depth in sorted(depths):
+                futures = {}
+                for doc in depths[depth]:
+                    if len(doc.path.split('/')) == 1 and doc.name == 'Shared with me':
+                        continue
+                    pems = None
+                    if inherit:
+                        pems = inherited.get(doc.path.strip('/'))
+                    if pems is None:
+                        futures[executor.submit(_list_pems, doc)] = doc
+                        continue
+                    self._add_pems_action(actions, inherited, doc, pems)
+
+                calls += len(futures)
+                for future in futures:
+                    self._add_pems_action(actions, inherited, futures[future],
+                                          future.result())
+        finally:
+            executor.shutdown(wait=False)
+
+        cnt = 0
+        es_client = connections.get_connection()
+        batch_size = getattr(settings, 'ES_BULK_INDEXING', {}).get('batch_size', 500)
+        for ok, item in streaming_bulk(es_client, actions, chunk_size=batch_size,
+                                       raise_on_error=False):
+            op_type, result = item.popitem()
+            if ok:
+                cnt += 1
+            else:
+                logger.error('Bulk %s error: %s', op_type, result)
+
+        elapsed = time.time() - started
+        logger.info(
+            'Permissions indexed for %s/%s: %d docs in %.2fs (%.1f docs/s), '
+            '%d listPermissions calls',
+            system_id, file_path, cnt, elapsed,
+            cnt / elapsed if elapsed else cnt, calls)
         return cnt
+
+    @staticmethod
+    def _add_pems_action(actions, inherited, doc, pems):
+        """Appends the bulk action to update a document's permissions and
+        keeps track of the permissions its children can inherit"""
+        actions.append({
+            '_op_type': 'update',
+            '_index': doc.meta.index,
+            '_type': doc.meta.doc_type,
+            '_id': doc.meta.id,
+            'doc': {'permissions': pems},
+        })
+        if doc.format == 'folder':
+            recursive = pems and all(pem.get('recursive') for pem in pems)
+            inherited[os.path.join(doc.path, doc.name).strip('/')] = \
+                pems if recursive else None
+
+    @staticmethod
+    def _doc_body(file_object, pems=None):
+        """Constructs an :class:`IndexedFile` source from an Agave file object
+
+        :param file_object: Agave response file object
+        :param list pems: response from `files.listPermissions`. If given,
+            the permissions will be part of the returned body.
+
+        :returns: document source
+        :rtype: dict
+        """
+        file_path = file_object.path.strip('/')
+        body = {
+            'name': os.path.basename(file_path),
+            'path': os.path.dirname(file_path) or '/',
+            'lastModified': file_object.lastModified.isoformat(),
+            'length': file_object.length,
+            'format': file_object.format,
+            'mimeType': file_object.mimeType,
+            'type': file_object.type,
+            'system': file_object.system,
+        }
+        if pems:
+            body['permissions'] = AgaveIndexer._clean_pems(pems)
+        return body
+
+    def _bulk_file_action(self, file_object, username, doc_id=None,
+                          full_indexing=False, pems_indexing=False):
+        """Constructs the bulk action to index a single Agave file object
+
+        If `doc_id` is `None` the file is not indexed yet and an `index`
+        action with a deterministic id is returned.
+        Otherwise, and only if `full_indexing` is set, an `update`
+        action for the existing document is returned.
+
+        :returns: bulk action or `None` if there is nothing to do
+        :rtype: dict
+        """
+        if doc_id is not None and not full_indexing:
+            return None
+
+        pems = None
+        if pems_indexing:
+            pems = self.ag.files.listPermissions(
+                systemId=file_object.system, filePath=file_object.path)
+        body = self._doc_body(file_object, pems=pems)
+        action = {
+            '_index': IndexedFile._doc_type.index,
+            '_type': IndexedFile._doc_type.name,
+        }
+        if doc_id is None:
+            if not pems:
+                body['permissions'] = [{
+                    'username': username,
+                    'permission': {
+                        'read': True,
+                        'write': True,
+                        'execute': True
+                    }
+                }]
+            action.update({
+                '_op_type': 'index',
+                '_id': file_uuid(body['system'], body['path'], body['name']),
+                '_source': body,
+            })
+        else:
+            action.update({
+                '_op_type': 'update',
+                '_id': doc_id,
+                'doc': body,
+            })
+        return action
+
+    @staticmethod
+    def _bulk_delete_action(doc):
+        """Constructs the bulk action to delete a single document"""
+        return {
+            '_op_type': 'delete',
+            '_index': doc.meta.index,
+            '_type': doc.meta.doc_type,
+            '_id': doc.meta.id,
+        }
+
+    def _bulk_actions(self, system_id, path, username, levels=0,
+                      index_full_path=True, full_indexing=False,
+                      pems_indexing=False, stats=None):
+        """Walks an agave file path and yields ES bulk actions
+
+        The walk is lazy, actions for a level are yielded before the
+        next `files.list` call is done.
+        The children of a folder that does not exist anymore are deleted
+        with a single `delete_by_query` request, instead of a bulk action
+        per child. The count is added to ``stats['deleted']``.
+        """
+        mgr = ESFileManager(username=username)
+        if stats is None:
+            stats = {}
+        stats.setdefault('deleted', 0)
+        for root, folders, files in self.walk_levels(system_id, path):
+            logger.debug('system_id: %s, path: %s', system_id, root)
+            _, search = mgr.listing(system_id, root)
+            prev = None
+            for obj, doc in merge_listings(folders + files, search.scan()):
+                if obj is None:
+                    if doc.format == 'folder' and (prev is None or
+                                                   prev.name != doc.name):
+                        stats['deleted'] += mgr.delete_recursive(
+                            system_id, os.path.join(doc.path, doc.name),
+                            children_only=True)
+                    yield self._bulk_delete_action(doc)
+                    continue
+
+                prev = doc
+                action = self._bulk_file_action(
+                    obj, username, doc_id=doc.meta.id if doc else None,
+                    full_indexing=full_indexing, pems_indexing=pems_indexing)
+                if action is not None:
+                    yield action
+
+            if levels and (len(root.split('/')) - len(path.split('/')) + 1) >= levels:
+                del folders[:]
+
+        if index_full_path:
+            path_comp = path.split('/')
+            while path_comp:
+                file_path = '/'.join(path_comp)
+                afs = self.ag.files.list(systemId=system_id, filePath=file_path)
+                af = afs[0]
+                logger.debug(u'Get or create file: {}'.format(af.path))
+                af_path = af.path.strip('/')
+                res, _ = mgr.get(system_id, os.path.dirname(af_path) or '/',
+                                 os.path.basename(af_path))
+                doc_id = res[0].meta.id if res.hits.total else None
+                yield self._bulk_file_action(af, username, doc_id=doc_id,
+                                             full_indexing=True,
+                                             pems_indexing=pems_indexing)
+                path_comp.pop()
+
+    def bulk_index(self, system_id, path, username, levels=0,
+                   index_full_path=True, full_indexing=False,
+                   pems_indexing=False, batch_size=None, flush_interval=None):
+        """Indexes a file path using ES bulk requests
+
+        This is the streaming counterpart of :meth:`index`. Instead of
+        doing a search, a save and an update per file, the create,
+        update and delete actions generated while walking the path are
+        sent to ES in batches using
+        :func:`elasticsearch.helpers.streaming_bulk`.
+        New documents are created with a deterministic id
+        (see :func:`~designsafe.libs.elasticsearch.utils.file_uuid`).
+
+        :param str system_id: system id
+        :param str path: path to index
+        :param str username: username making the request, this will be
+            used for "optimistic permissions"
+        :param int levels: number of levels deep to index. Default `0` which means
+            to index all the levels.
+        :param bool index_full_path: if `True` each of the parent folders will get
+            indexed. Default `True`
+        :param bool full_indexing: if `True` existing documents are updated with
+            the data of the agave file objects. Default `False`
+        :param bool pems_indexing: if `True` "optimistic permissions" will not be
+            used and the response to `files.listPermissions` will get indexed.
+        :param int batch_size: max number of actions per bulk request.
+            Default ``settings.ES_BULK_INDEXING['batch_size']``
+        :param int flush_interval: max number of seconds actions are buffered
+            before sending a bulk request.
+            Default ``settings.ES_BULK_INDEXING['flush_interval']``
+
+        :returns: a tuple with the count of documents indexed and documents deleted
+        :rtype: tuple
+        """
+        bulk_settings = getattr(settings, 'ES_BULK_INDEXING', {})
+        batch_size = batch_size or bulk_settings.get('batch_size', 500)
+        if flush_interval is None:
+            flush_interval = bulk_settings.get('flush_interval', 5)
+
+        es_client = connections.get_connection()
+        stats = {'deleted': 0}
+        actions = self._bulk_actions(system_id, path, username, levels=levels,
+                                     index_full_path=index_full_path,
+                                     full_indexing=full_indexing,
+                                     pems_indexing=pems_indexing,
+                                     stats=stats)
+        docs_indexed = 0
+        docs_deleted = 0
+        for batch_num, batch in enumerate(_batches(actions, batch_size,
+                                                   flush_interval), 1):
+            started = time.time()
+            errors = 0
+            for ok, item in streaming_bulk(es_client, batch,
+                                           chunk_size=batch_size,
+                                           raise_on_error=False):
+                op_type, result = item.popitem()
+                if ok and op_type == 'delete':
+                    docs_deleted += 1
+                elif ok:
+                    docs_indexed += 1
+                elif op_type != 'delete' or result.get('status') != 404:
+                    errors += 1
+                    logger.error('Bulk %s error: %s', op_type, result)
+            elapsed = time.time() - started
+            logger.info(
+                'Bulk batch %d for %s/%s: %d actions in %.2fs '
+                '(%.1f docs/s), %d errors',
+                batch_num, system_id, path, len(batch), elapsed,
+                len(batch) / elapsed if elapsed else len(batch), errors)
+        return docs_indexed, docs_deleted + stats['deleted']
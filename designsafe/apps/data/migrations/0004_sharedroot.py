@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_filechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SharedRoot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('system', models.CharField(max_length=255)),
+                ('owner', models.CharField(max_length=255)),
+                ('grantee', models.CharField(db_index=True, max_length=255)),
+                ('path', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['path'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='sharedroot',
+            index_together=set([('system', 'grantee')]),
+        ),
+    ]
@@ -0,0 +1,2 @@
+from designsafe.apps.data.models.changes import FileChange
+from designsafe.apps.data.models.shares import SharedRoot
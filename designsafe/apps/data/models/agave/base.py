@@ -5,6 +5,7 @@ import json
 import re
 import logging
 import datetime
+from designsafe.apps.data.models.agave import cache as metadata_cache
 
 logger = logging.getLogger(__name__)
 
@@ -19,9 +20,15 @@ class RelatedQuery(object):
         self.rel_cls = rel_cls
         query = {'name': related_obj_name, 'associationIds': []}
         self._query = query
+        self._result = None
 
     def __call__(self, agave_client):
-        metas = agave_client.meta.listMetadata(q=json.dumps(self.query))
+        if self._result is not None:
+            return self._result
+        query = self.query
+        if not query:
+            return []
+        metas = metadata_cache.list_metadata(agave_client, query)
         return  [self.rel_cls(**meta) for meta in metas]
 
     def add(self, uuid):
@@ -65,6 +72,25 @@ class RelatedQuery(object):
     def serialize(self, value):
         return self.to_python(value)
 
+def _list_in(agave_client, query, attrname, values, chunk_size=100):
+    """Lists the metadata matching `query` and ``{attrname: {"$in": values}}``
+
+    Values are sent in chunks to keep the query string short and every
+    chunk is paginated.
+    """
+    for i in range(0, len(values), chunk_size):
+        chunk_query = dict(query)
+        chunk_query[attrname] = {'$in': values[i:i + chunk_size]}
+        offset = 0
+        while True:
+            metas = metadata_cache.list_metadata(agave_client, chunk_query,
+                                                 offset=offset, limit=chunk_size)
+            for meta in metas:
+                yield meta
+            if len(metas) < chunk_size:
+                break
+            offset += chunk_size
+
 def register_lazy_rel(cls, field_name, related_obj_name, multiple, rel_cls):
     reg_key = '{}.{}'.format(cls.model_name, cls.__name__)
     LAZY_OPS.append((reg_key,
@@ -112,11 +138,12 @@ class Manager(object):
 
     def get(self, agave_client, uuid=None, project_id=None):
         if uuid is not None:
-            meta = agave_client.meta.getMetadata(uuid=uuid)
+            meta = metadata_cache.get_metadata(agave_client, uuid)
         elif project_id is not None:
-            metas = agave_client.meta.listMetadata(
-                privileged=False,
-                q='{{"value.projectId": "{project_id}"}}'.format(project_id=project_id))
+            metas = metadata_cache.list_metadata(
+                agave_client,
+                {'value.projectId': project_id},
+                privileged=False)
             if len(metas):
                 meta = metas[0]
             else:
@@ -129,10 +156,10 @@ class Manager(object):
 
     def list(self, agave_client, association_id=None):
         if association_id is None:
-            metas = agave_client.meta.listMetadata(q=json.dumps({'name': self.model_cls.model_name}))
+            metas = metadata_cache.list_metadata(agave_client, {'name': self.model_cls.model_name})
         else:
-            metas = agave_client.meta.listMetadata(q=json.dumps({'name': self.model_cls.model_name,
-                                                 'associationIds': association_id}))
+            metas = metadata_cache.list_metadata(agave_client, {'name': self.model_cls.model_name,
+                                                                'associationIds': association_id})
         for meta in metas:
             yield self.model_cls(**meta)
 
@@ -291,8 +318,11 @@ class Model(object):
             _setattr(self, attrname, RelatedQuery(uuids=value, rel_cls=field.related))
 
         for attrname in opts._reverse_fields:
-            field = getattr(self, attrname)
-            field.uuid = self.uuid
+            # reverse fields are set on the class, every instance needs its own
+            field = getattr(cls, attrname)
+            _setattr(self, attrname, RelatedQuery(uuid=self.uuid,
+                                                  related_obj_name=field.related_obj_name,
+                                                  rel_cls=field.rel_cls))
         
         if self.name is None:
             self.name = self._meta.model_name
@@ -370,6 +400,7 @@ class Model(object):
     def set_pem(self, username, pem):
         pem = self.manager().agave_client.meta.updateMetadataPermissions(
             uuid=self.uuid, body={'username': username, 'permission': pem})
+        metadata_cache.invalidate(uuid=self.uuid, name=self.name)
         self.permissions = pem
         return self
 
@@ -448,6 +479,7 @@ class Model(object):
             logger.debug('Updating Metadata: %s, with: %s', self.uuid, body)
             ret = agave_client.meta.updateMetadata(uuid=self.uuid, body=body)
         self.update(**ret)
+        metadata_cache.invalidate(uuid=self.uuid, name=self.name)
         return ret
 
     def associate(self, value):
@@ -464,6 +496,69 @@ class Model(object):
     def manager(cls):
         return cls._meta.model_manager
 
+    @staticmethod
+    def prefetch_related(agave_client, entities, attrnames=None):
+        """Resolves the related fields of several entities at once.
+
+        Instead of every :class:`RelatedQuery` making its own request,
+        one query is made per relation type for every entity, similar to
+        django's ``prefetch_related``:
+
+            * Forward fields: ``{"uuid": {"$in": [...]}}`` with the uuids
+              of every entity.
+            * Reverse fields: ``{"name": "...", "associationIds": {"$in": [...]}}``
+              with the uuids of every entity.
+
+        The graph is assembled in memory, calling a related field of any
+        of the entities afterwards does not make a request.
+
+        :param agave_client: agave client
+        :param list entities: list of :class:`Model` instances
+        :param list attrnames: related fields to resolve. Default every
+            related field, reverse fields to ``designsafe.file`` are only
+            resolved if given explicitly.
+
+        :returns: the entities
+        """
+        forward = {}
+        reverse = {}
+        for ent in entities:
+            for attrname in ent._meta._related_fields:
+                if attrnames is None or attrname in attrnames:
+                    rel = getattr(ent, attrname)
+                    forward.setdefault(rel.rel_cls, []).append(rel)
+            for attrname in ent._meta._reverse_fields:
+                rel = getattr(ent, attrname)
+                if attrnames is None and rel.related_obj_name == 'designsafe.file':
+                    continue
+                if attrnames is None or attrname in attrnames:
+                    reverse.setdefault((rel.related_obj_name, rel.rel_cls), []).append(rel)
+
+        for rel_cls, rels in six.iteritems(forward):
+            uuids = set()
+            for rel in rels:
+                if isinstance(rel.uuids, basestring):
+                    rel.uuids = [rel.uuids]
+                uuids.update(rel.uuids)
+            objs = {}
+            for meta in _list_in(agave_client, {}, 'uuid', sorted(uuids)):
+                objs[meta['uuid']] = rel_cls(**meta)
+            for rel in rels:
+                rel._result = [objs[uuid] for uuid in rel.uuids if uuid in objs]
+
+        for (related_obj_name, rel_cls), rels in six.iteritems(reverse):
+            uuids = sorted(set([rel.uuid for rel in rels if rel.uuid]))
+            objs = {}
+            for meta in _list_in(agave_client, {'name': related_obj_name},
+                                 'associationIds', uuids):
+                obj = rel_cls(**meta)
+                for uuid in meta['associationIds']:
+                    objs.setdefault(uuid, []).append(obj)
+            for rel in rels:
+                rel._result = objs.get(rel.uuid, [])
+
+        return entities
+
 class BaseAgaveResource(object):
     """
     Base Class that all Agave API Resource objects inherit from.
@@ -0,0 +1,166 @@
+""" Read-through cache for agave metadata lookups.
+
+    Metadata records are cached by uuid and queries by the query and the
+    caller's token, since results depend on the caller's permissions.
+
+    Every cached value is stored with the versions it was read at. A save
+    or delete bumps the version of the record's uuid and name, which
+    invalidates the record and every query for that name at once.
+    Queries without a name (e.g. by uuid or by ``value.projectId``) depend
+    on a global version bumped on every write.
+
+    Lookups are memoized for the duration of a request by
+    :class:`~designsafe.middleware.MetadataCacheMiddleware` and cached
+    across requests for ``settings.AGAVE_METADATA_CACHE_TTL`` seconds.
+"""
+import hashlib
+import json
+import logging
+import threading
+import six
+from agavepy.agave import AttrDict
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_VERSION = 'meta:version:*'
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'memo_hits': 0, 'hits': 0, 'misses': 0}
+
+
+def start_request():
+    """Starts request-scoped memoization"""
+    _local.memo = {}
+
+
+def end_request():
+    """Stops request-scoped memoization"""
+    _local.memo = None
+
+
+def stats():
+    """Returns the hit and miss counters of this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def _plain(value):
+    """Converts agavepy's `AttrDict`, which does not unpickle, to dicts"""
+    if isinstance(value, dict):
+        return {key: _plain(val) for key, val in six.iteritems(value)}
+    elif isinstance(value, list):
+        return [_plain(val) for val in value]
+    return value
+
+
+def _attrs(value):
+    """Converts dicts back to `AttrDict`"""
+    if isinstance(value, dict):
+        return AttrDict({key: _attrs(val) for key, val in six.iteritems(value)})
+    elif isinstance(value, list):
+        return [_attrs(val) for val in value]
+    return value
+
+
+def _version_key(kind, value):
+    return 'meta:version:{}:{}'.format(kind, value)
+
+
+def _query_names(query):
+    """Metadata names a query is restricted to, or `None`"""
+    name = query.get('name') if isinstance(query, dict) else None
+    if isinstance(name, six.string_types):
+        return [name]
+    elif isinstance(name, dict) and isinstance(name.get('$in'), list):
+        return sorted(name['$in'])
+    return None
+
+
+def _scope(agave_client):
+    token = getattr(agave_client, '_token', None) or ''
+    return hashlib.md5(token.encode('utf-8')).hexdigest()
+
+
+def _cached(key, version_keys, fetch):
+    """Returns the memoized or cached value of `key`, or calls `fetch`"""
+    memo = getattr(_local, 'memo', None)
+    if memo is not None and key in memo:
+        _count('memo_hits')
+        return _attrs(memo[key])
+
+    values = cache.get_many(version_keys + [key])
+    versions = [values.get(vkey, 0) for vkey in version_keys]
+    entry = values.get(key)
+    if entry is not None and entry['versions'] == versions:
+        _count('hits')
+        value = entry['value']
+    else:
+        _count('misses')
+        value = _plain(fetch())
+        cache.set(key, {'versions': versions, 'value': value},
+                  getattr(settings, 'AGAVE_METADATA_CACHE_TTL', 60))
+
+    if memo is not None:
+        memo[key] = value
+    return _attrs(value)
+
+
+def get_metadata(agave_client, uuid):
+    """Cached ``meta.getMetadata``"""
+    return _cached('meta:uuid:{}:{}'.format(_scope(agave_client), uuid),
+                   [_version_key('uuid', uuid)],
+                   lambda: agave_client.meta.getMetadata(uuid=uuid))
+
+
+def list_metadata(agave_client, q, **kwargs):
+    """Cached ``meta.listMetadata``
+
+    :param agave_client: agave client
+    :param q: query, a :class:`dict` or a json string
+    :param kwargs: extra arguments, e.g. ``offset``, ``limit``
+    """
+    query = json.loads(q) if isinstance(q, six.string_types) else q
+    q = json.dumps(query, sort_keys=True)
+    names = _query_names(query)
+    if names:
+        version_keys = [_version_key('name', name) for name in names]
+    else:
+        version_keys = [GLOBAL_VERSION]
+
+    key = 'meta:query:{}:{}'.format(
+        _scope(agave_client),
+        hashlib.md5(json.dumps([q, kwargs], sort_keys=True)).hexdigest())
+    return _cached(key, version_keys,
+                   lambda: agave_client.meta.listMetadata(q=q, **kwargs))
+
+
+def invalidate(uuid=None, name=None):
+    """Invalidates a record and every query which could return it
+
+    :param str uuid: uuid of the record saved or deleted
+    :param str name: name of the record saved or deleted
+    """
+    keys = [GLOBAL_VERSION]
+    if uuid:
+        keys.append(_version_key('uuid', uuid))
+    if name:
+        keys.append(_version_key('name', name))
+    for key in keys:
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+    memo = getattr(_local, 'memo', None)
+    if memo:
+        memo.clear()
+    logger.debug('Invalidated metadata cache for %s %s', name, uuid)
@@ -6,6 +6,7 @@ import six
 import urllib
 import urlparse
 from requests.exceptions import HTTPError
+from designsafe.apps.data.models.agave import cache as metadata_cache
 from designsafe.apps.data.models.agave.base import BaseAgaveResource
 from designsafe.apps.data.models.agave.metadata import BaseMetadataResource, BaseMetadataPermissionResource
 from designsafe.apps.data.models.agave.systems import roles as system_roles_list
@@ -24,8 +25,8 @@ class BaseFileMetadata(BaseMetadataResource):
     def __init__(self, agave_client, file_obj=None, **kwargs):
         meta_objs = []
         if file_obj:
-            query = '{{"associationIds": "{}", "name": "designsafe.file"}}'.format(file_obj.uuid)
-            meta_objs = agave_client.meta.listMetadata(q=query)
+            query = {'associationIds': file_obj.uuid, 'name': 'designsafe.file'}
+            meta_objs = metadata_cache.list_metadata(agave_client, query)
             if meta_objs:
                 defaults = meta_objs[0]
             if not meta_objs:
@@ -80,7 +81,8 @@ class BaseFileMetadata(BaseMetadataResource):
             try:
                 pem = meta_pems_users.pop(username)
             except KeyError:
-                pem = BaseMetadataPermissionResource(self.uuid, self._agave)
+                pem = BaseMetadataPermissionResource(self.uuid, self._agave,
+                                                     metadata_name=self.name)
                 pem.username = username
 
             if role == system_roles_list.GUEST and \
@@ -105,7 +107,8 @@ class BaseFileMetadata(BaseMetadataResource):
 
         project_roles = self._agave.systems.listRoles(systemId='project-{}'.format(project_uuid))
         project_roles = filter(lambda x: x['username'] != 'ds_admin', project_roles)
-        meta_pems = BaseMetadataPermissionResource.list_permissions(self.uuid, self._agave)
+        meta_pems = BaseMetadataPermissionResource.list_permissions(
+            self.uuid, self._agave, metadata_name=self.name)
         meta_pems_users = self._update_pems_with_system_roles(project_roles, meta_pems)
         for username, pem in six.iteritems(meta_pems_users):
             pem.delete()
@@ -418,6 +421,35 @@ class BaseFileResource(BaseAgaveResource):
                                           filePath=urllib.quote(self.path))
         return resp.content
 
+    def download_range(self, length, offset=0):
+        """Downloads at most `length` bytes of the file starting at `offset`
+
+        The bytes are requested with a ``Range`` header and the response is
+        streamed, no more than `length` bytes are read even if the range is
+        not honored.
+
+        :param int length: max number of bytes to download.
+        :param int offset: first byte to download.
+        :return: the downloaded bytes
+        :rtype: str
+        :raises HTTPError: If an error occurs.
+        """
+        from designsafe.apps.auth.clients import shared_session
+        headers = {
+            'Authorization': 'Bearer {}'.format(self._agave._token),
+            'Range': 'bytes={}-{}'.format(offset, offset + length - 1)
+        }
+        resp = shared_session().get(self._links['self']['href'],
+                                    headers=headers, stream=True, timeout=60)
+        try:
+            resp.raise_for_status()
+            if offset and resp.status_code != 206:
+                # Range not honored, skip to the offset
+                resp.raw.read(offset, decode_content=True)
+            return resp.raw.read(length, decode_content=True)
+        finally:
+            resp.close()
+
     def download_postit(self, force=True, max_uses=10, lifetime=600):
         args = {
             'url': urllib.unquote(self._links['self']['href']),
@@ -1,5 +1,6 @@
 import json
 import logging
+from designsafe.apps.data.models.agave import cache as metadata_cache
 from designsafe.apps.data.models.agave.base import BaseAgaveResource
 
 logger = logging.getLogger(__name__)
@@ -59,11 +60,13 @@ class BaseMetadataResource(BaseAgaveResource):
             result = self._agave.meta.updateMetadata(uuid=self.uuid,
                                                      body=self.request_body)
         self._wrapped.update(**result)
+        metadata_cache.invalidate(uuid=self.uuid, name=self.name)
         return self
 
     def delete(self):
         logger.info('Deleting "{}" metadata {}'.format(self.name, self.uuid))
         self._agave.meta.deleteMetadata(uuid=self.uuid)
+        metadata_cache.invalidate(uuid=self.uuid, name=self.name)
         return self
 
     @classmethod
@@ -76,9 +79,14 @@ class BaseMetadataResource(BaseAgaveResource):
 class BaseMetadataPermissionResource(BaseAgaveResource):
     """
     Permissions object for a :class:`BaseMetadataResource`.
+
+    :param str metadata_uuid: uuid of the metadata record.
+    :param agave_client: agave client.
+    :param str metadata_name: name of the metadata record, used to
+        invalidate cached queries. Looked up on save if `None`.
     """
 
-    def __init__(self, metadata_uuid, agave_client, **kwargs):
+    def __init__(self, metadata_uuid, agave_client, metadata_name=None, **kwargs):
         defaults = {
             'permission': {},
             'username': None
@@ -86,6 +94,7 @@ class BaseMetadataPermissionResource(BaseAgaveResource):
         defaults.update(**kwargs)
         super(BaseMetadataPermissionResource, self).__init__(agave_client, **defaults)
         self.metadata_uuid = metadata_uuid
+        self.metadata_name = metadata_name
 
     @property
     def read(self):
@@ -147,11 +156,17 @@ class BaseMetadataPermissionResource(BaseAgaveResource):
         :return: self
         :rtype: :class:`BaseMetadataPermissionResource`
         """
+        if self.metadata_name is None:
+            # Looked up before the update, the caller may lose access.
+            self.metadata_name = metadata_cache.get_metadata(
+                self._agave, self.metadata_uuid).name
         logger.info('Updating metadata permissions: {} {}'.format(self.metadata_uuid,
                                                                   self.request_body))
         result = self._agave.meta.updateMetadataPermissions(uuid=self.metadata_uuid,
                                                             body=self.request_body)
         self._wrapped.update(**result)
+        # A permission change changes what queries return to the grantee.
+        metadata_cache.invalidate(uuid=self.metadata_uuid, name=self.metadata_name)
         return self
 
     def delete(self):
@@ -166,15 +181,17 @@ class BaseMetadataPermissionResource(BaseAgaveResource):
         self.save()
 
     @classmethod
-    def list_permissions(cls, metadata_uuid, agave_client):
+    def list_permissions(cls, metadata_uuid, agave_client, metadata_name=None):
         """
         Get the permissions for a metadata object
         :param metadata_uuid: string: the UUID of the metadata for which to list
             permissions
         :param agave_client: agavepy.Agave: API client instance
+        :param metadata_name: string: name of the metadata, optional
 
         :return: List of permissions for the passed Metadata UUID
         :rtype: list of designsafe.apps.api.agave.BaseMetadataPermission
         """
         records = agave_client.meta.listMetadataPermissions(uuid=metadata_uuid)
-        return [cls(metadata_uuid, agave_client, **r) for r in records]
+        return [cls(metadata_uuid, agave_client, metadata_name=metadata_name, **r)
+                for r in records]
@@ -0,0 +1,84 @@
+"""
+.. module: designsafe.apps.data.models.changes
+   :synopsis: Change feed of file operations to apply to the files index.
+"""
+from __future__ import unicode_literals, absolute_import
+import logging
+from django.db import models
+from future.utils import python_2_unicode_compatible
+from designsafe.libs.elasticsearch.utils import normalize_file_path
+
+#pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+#pylint: enable=invalid-name
+
+@python_2_unicode_compatible
+class FileChange(models.Model):
+    """A file operation which has not been applied to the files index yet.
+
+    File operations record a change instead of scheduling a walk of the
+    path. The changes are applied in order and in batches by
+    :func:`~designsafe.apps.data.tasks.apply_file_changes`.
+    Full walks of a path are only needed for periodic reconciliation.
+
+    **Operations**:
+
+        * ``create``: a file or folder was created or its content changed
+          (e.g. upload, mkdir, copy, import).
+        * ``delete``: a file or folder was deleted.
+        * ``move``: a file or folder was moved or renamed to ``new_path``.
+        * ``pems``: the permissions of a file or folder changed.
+    """
+    CREATE = 'create'
+    DELETE = 'delete'
+    MOVE = 'move'
+    PEMS = 'pems'
+    OPERATIONS = (
+        (CREATE, 'Create'),
+        (DELETE, 'Delete'),
+        (MOVE, 'Move'),
+        (PEMS, 'Permissions'),
+    )
+
+    operation = models.CharField(max_length=10, choices=OPERATIONS)
+    system = models.CharField(max_length=255)
+    path = models.TextField()
+    new_path = models.TextField(blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    @classmethod
+    def record(cls, operation, system, path, new_path=''):
+        """Records a file operation
+
+        :param str operation: one of :attr:`OPERATIONS`
+        :param str system: system id
+        :param str path: full path of the file
+        :param str new_path: full path of the file after a ``move``
+
+        :returns: the saved change
+        :rtype: :class:`FileChange`
+        """
+        change = cls(operation=operation, system=system,
+                     path=normalize_file_path(path))
+        if new_path:
+            change.new_path = normalize_file_path(new_path)
+        change.save()
+        logger.debug('Recorded file change: %s', change)
+        return change
+
+    def same_as(self, other):
+        """Checks if two changes have the same effect on the index"""
+        return (self.operation == other.operation and
+                self.system == other.system and
+                self.path == other.path and
+                self.new_path == other.new_path)
+
+    def __str__(self):
+        if self.new_path:
+            return '{} {}/{} -> {}'.format(self.operation, self.system,
+                                           self.path, self.new_path)
+        return '{} {}/{}'.format(self.operation, self.system, self.path)
@@ -0,0 +1,152 @@
+"""
+.. module: designsafe.apps.data.models.shares
+   :synopsis: Materialized top-most shared paths used to list `$SHARE`.
+"""
+from __future__ import unicode_literals, absolute_import
+import logging
+from django.db import models, transaction
+from future.utils import python_2_unicode_compatible
+from designsafe.libs.elasticsearch.utils import normalize_file_path
+
+#pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+#pylint: enable=invalid-name
+
+@python_2_unicode_compatible
+class SharedRoot(models.Model):
+    """Top-most path an owner shared with a grantee.
+
+    Shares are recursive, a path shared with a user gives access to every
+    file below it. Only the top-most shared paths are stored, this way
+    the `$SHARE` listing is a single paginated query instead of a scan
+    of every document the user has permissions on.
+
+    The owner of a path is the first component of the path, the same
+    assumption "optimistic permissions" does.
+    """
+    system = models.CharField(max_length=255)
+    owner = models.CharField(max_length=255)
+    grantee = models.CharField(max_length=255, db_index=True)
+    path = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['path']
+        index_together = [['system', 'grantee']]
+
+    @classmethod
+    def record_share(cls, system, path, grantee, permission):
+        """Updates the shared roots after a permission change
+
+        :param str system: system id
+        :param str path: full path of the shared file
+        :param str grantee: username the file was shared with
+        :param str permission: permission given. ``NONE`` removes the share.
+        """
+        path = normalize_file_path(path)
+        owner = path.split('/')[0]
+        if not path or grantee == owner:
+            return
+
+        with transaction.atomic():
+            roots = cls.objects.filter(system=system, grantee=grantee)
+            if not permission or permission.upper() == 'NONE':
+                cls._subtree(roots, path).delete()
+                return
+
+            if cls._ancestors(roots, path).exists():
+                return
+
+            cls._subtree(roots, path).delete()
+            cls.objects.create(system=system, owner=owner,
+                               grantee=grantee, path=path)
+        logger.debug('Shared root: %s/%s -> %s', system, path, grantee)
+
+    @classmethod
+    def move_path(cls, system, path, new_path):
+        """Updates the shared roots after a move or rename
+
+        Roots equal to or below `path` are moved below `new_path`.
+
+        :param str system: system id
+        :param str path: full path of the file before the move
+        :param str new_path: full path of the file after the move
+        """
+        path = normalize_file_path(path)
+        new_path = normalize_file_path(new_path)
+        if not path or not new_path or path == new_path:
+            return
+
+        with transaction.atomic():
+            moved = list(cls._subtree(cls.objects.filter(system=system), path))
+            for root in moved:
+                root.delete()
+            for root in moved:
+                cls.record_share(system, new_path + root.path[len(path):],
+                                 root.grantee, 'READ')
+        if moved:
+            logger.debug('Moved %d shared roots: %s/%s -> %s', len(moved),
+                         system, path, new_path)
+
+    @classmethod
+    def delete_path(cls, system, path):
+        """Deletes the shared roots equal to or below a deleted path
+
+        :param str system: system id
+        :param str path: full path of the deleted file
+        """
+        path = normalize_file_path(path)
+        if not path:
+            return
+        cls._subtree(cls.objects.filter(system=system), path).delete()
+
+    @classmethod
+    def shared_paths(cls, system, username, offset=0, limit=100):
+        """Top-most paths shared with a user or with ``WORLD``
+
+        Paths in the user's home are not listed. A path shared with the
+        user below a path shared with ``WORLD``, or the other way around,
+        is only listed once, as the top-most path. Nested paths are
+        collapsed before paginating so every page is full.
+
+        :param str system: system id
+        :param str username: username
+        :param int offset: offset
+        :param int limit: limit
+
+        :returns: sorted list of full paths
+        :rtype: list
+        """
+        roots = cls.objects.filter(
+            system=system, grantee__in=[username, 'WORLD']).exclude(
+                owner=username).order_by('path').values_list(
+                    'path', flat=True).distinct()
+        kept = set()
+        paths = []
+        # Ancestors sort before their descendants.
+        for path in roots.iterator():
+            comps = path.split('/')
+            if any('/'.join(comps[:i]) in kept for i in range(1, len(comps))):
+                continue
+            kept.add(path)
+            if len(kept) > offset:
+                paths.append(path)
+                if len(paths) >= limit:
+                    break
+        return paths
+
+    @staticmethod
+    def _subtree(roots, path):
+        """Roots equal to or below `path`"""
+        return roots.filter(models.Q(path=path) |
+                            models.Q(path__startswith=path + '/'))
+
+    @staticmethod
+    def _ancestors(roots, path):
+        """Roots above `path`"""
+        comps = path.split('/')
+        ancestors = ['/'.join(comps[:i]) for i in range(1, len(comps))]
+        return roots.filter(path__in=ancestors)
+
+    def __str__(self):
+        return '{}/{} -> {}'.format(self.system, self.path, self.grantee)
@@ -0,0 +1,91 @@
+"""
+.. module: designsafe.apps.data.tasks
+   :synopsis: Celery tasks to keep the files index up to date.
+"""
+from __future__ import absolute_import
+import logging
+import time
+from celery import shared_task
+from django.conf import settings
+from designsafe.apps.data.models.changes import FileChange
+from designsafe.libs.common.locks import CacheLock
+
+#pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+#pylint: enable=invalid-name
+
+FILE_CHANGES_LOCK = 'designsafe.apps.data.tasks.apply_file_changes'
+
+@shared_task(bind=True)
+def apply_file_changes(self, batch_size=None):
+    """Applies the recorded file operations to the files index.
+
+    Changes are read in batches in the order they were recorded.
+    Consecutive changes with the same effect are applied only once.
+    A cache lock makes sure only one consumer runs at a time, which
+    keeps the changes in order. The lock is renewed after every batch
+    and no new batch is read after ``settings.FILE_CHANGES['time_budget']``
+    seconds, the remaining changes are applied by the next run.
+
+    A change which fails is kept and retried on the next run up to
+    ``settings.FILE_CHANGES['max_attempts']`` times. The changes
+    recorded after it wait for it to go through.
+
+    :param int batch_size: number of changes to read at a time.
+        Default ``settings.FILE_CHANGES['batch_size']``
+
+    :returns: count of changes applied
+    :rtype: int
+    """
+    from designsafe.apps.api.agave import get_service_account_client
+    from designsafe.apps.data.managers.indexer import AgaveIndexer
+
+    changes_settings = getattr(settings, 'FILE_CHANGES', {})
+    batch_size = batch_size or changes_settings.get('batch_size', 200)
+    max_attempts = changes_settings.get('max_attempts', 5)
+    lock_timeout = changes_settings.get('lock_timeout', 60 * 15)
+    time_budget = changes_settings.get('time_budget', 60 * 5)
+    lock = CacheLock(FILE_CHANGES_LOCK, lock_timeout, self.request.id)
+    if not lock.acquire():
+        logger.debug('File changes are being applied by another worker')
+        return 0
+
+    indexer = AgaveIndexer(agave_client=get_service_account_client())
+    applied = 0
+    deadline = time.time() + time_budget
+    try:
+        while time.time() < deadline and lock.renew():
+            changes = list(FileChange.objects.all()[:batch_size])
+            if not changes:
+                break
+
+            done = []
+            prev = None
+            failed = None
+            for change in changes:
+                if prev is None or not change.same_as(prev):
+                    try:
+                        indexer.apply_change(change, 'ds_admin')
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception('Error applying file change: %s', change)
+                        failed = change
+                        break
+                done.append(change.pk)
+                prev = change
+
+            FileChange.objects.filter(pk__in=done).delete()
+            applied += len(done)
+            if failed is not None:
+                failed.attempts += 1
+                if failed.attempts >= max_attempts:
+                    logger.error('Dropping file change after %d attempts: %s',
+                                 failed.attempts, failed)
+                    failed.delete()
+                else:
+                    failed.save()
+                break
+    finally:
+        lock.release()
+
+    logger.debug('Applied %d file changes', applied)
+    return applied
@@ -2,6 +2,7 @@ from django.test import TestCase, RequestFactory
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 
 from designsafe.apps.api.exceptions import ApiException
 from designsafe.apps.api.data.agave.filemanager import FileManager as AgaveFM
@@ -109,3 +110,338 @@ class DataBrowserViewTestCase(DataBrowserBaseTestCase):
                 mock_public_listing.assert_called_with(None)
             else:
                 mock_public_listing.assert_called_with('/'.join(url_components[3:]))
+
+
+class BulkIndexingTestCase(TestCase):
+    def test_file_uuid_is_deterministic(self):
+        from designsafe.libs.elasticsearch.utils import file_uuid
+        doc_id = file_uuid('designsafe.storage.default', 'ds_user/folder', 'file.txt')
+        self.assertEqual(
+            doc_id,
+            file_uuid('designsafe.storage.default', '/ds_user/folder/file.txt/'))
+        self.assertNotEqual(
+            doc_id,
+            file_uuid('designsafe.storage.community', 'ds_user/folder', 'file.txt'))
+
+    def test_batches_by_size(self):
+        from designsafe.apps.data.managers.indexer import _batches
+        batches = list(_batches(iter(range(7)), 3, 60))
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+    @mock.patch('designsafe.apps.data.managers.indexer.time')
+    def test_batches_by_flush_interval(self, mock_time):
+        from designsafe.apps.data.managers.indexer import _batches
+        mock_time.time.side_effect = [0, 0, 1, 10, 10, 10]
+        batches = list(_batches(iter(range(3)), 100, 5))
+        self.assertEqual(batches, [[0, 1], [2]])
+
+
+class ConcurrentWalkTestCase(TestCase):
+    tree = {
+        'ds_user': ['ds_user/a', 'ds_user/b'],
+        'ds_user/a': ['ds_user/a/c'],
+        'ds_user/b': [],
+        'ds_user/a/c': [],
+    }
+
+    def list_level(self, path):
+        folders = [mock.Mock(path=folder) for folder in self.tree[path]]
+        return folders, ['file.txt']
+
+    def test_walk_top_down(self):
+        from designsafe.apps.data.managers.indexer import concurrent_walk_levels
+        roots = [root for root, _, _ in
+                 concurrent_walk_levels(self.list_level, 'ds_user', max_workers=2)]
+        self.assertEqual(roots[0], 'ds_user')
+        self.assertEqual(sorted(roots), sorted(self.tree.keys()))
+
+    def test_walk_top_down_pruning(self):
+        from designsafe.apps.data.managers.indexer import concurrent_walk_levels
+        roots = []
+        for root, folders, _ in concurrent_walk_levels(self.list_level, 'ds_user',
+                                                       max_workers=2):
+            roots.append(root)
+            if root == 'ds_user/a':
+                del folders[:]
+        self.assertNotIn('ds_user/a/c', roots)
+
+    def test_walk_bottom_up(self):
+        from designsafe.apps.data.managers.indexer import concurrent_walk_levels
+        roots = [root for root, _, _ in
+                 concurrent_walk_levels(self.list_level, 'ds_user', bottom_up=True,
+                                        max_workers=2)]
+        self.assertEqual(roots[-1], 'ds_user')
+        self.assertLess(roots.index('ds_user/a/c'), roots.index('ds_user/a'))
+        self.assertEqual(sorted(roots), sorted(self.tree.keys()))
+
+
+class MergeListingsTestCase(TestCase):
+    class Named(object):
+        def __init__(self, name):
+            self.name = name
+
+    def test_merge_listings(self):
+        from designsafe.apps.data.managers.indexer import merge_listings
+        objs = [self.Named(name) for name in ['c', 'a', 'd']]
+        docs = [self.Named(name) for name in ['b', 'a', 'c', 'a']]
+        pairs = [(obj.name if obj else None, doc.name if doc else None)
+                 for obj, doc in merge_listings(objs, docs)]
+        self.assertEqual(pairs, [('a', 'a'), (None, 'a'), (None, 'b'),
+                                 ('c', 'c'), ('d', None)])
+
+
+class FileChangesTestCase(TestCase):
+    def test_record_normalizes_paths(self):
+        from designsafe.apps.data.models.changes import FileChange
+        change = FileChange.record(FileChange.MOVE, 'designsafe.storage.default',
+                                   '/ds_user/folder/', 'ds_user//other')
+        self.assertEqual(change.path, 'ds_user/folder')
+        self.assertEqual(change.new_path, 'ds_user/other')
+
+    @mock.patch('designsafe.apps.api.agave.get_service_account_client')
+    @mock.patch('designsafe.apps.data.managers.indexer.AgaveIndexer.apply_change')
+    def test_apply_file_changes(self, mock_apply_change, mock_client):
+        from designsafe.apps.data.models.changes import FileChange
+        from designsafe.apps.data.tasks import apply_file_changes
+        FileChange.record(FileChange.CREATE, 'designsafe.storage.default', 'ds_user/a')
+        FileChange.record(FileChange.CREATE, 'designsafe.storage.default', 'ds_user/a')
+        FileChange.record(FileChange.DELETE, 'designsafe.storage.default', 'ds_user/a')
+
+        applied = apply_file_changes(batch_size=2)
+
+        self.assertEqual(applied, 3)
+        self.assertEqual(mock_apply_change.call_count, 2)
+        self.assertFalse(FileChange.objects.exists())
+
+    @mock.patch('designsafe.apps.api.agave.get_service_account_client')
+    @mock.patch('designsafe.apps.data.managers.indexer.AgaveIndexer.apply_change')
+    def test_apply_file_changes_keeps_failed_change(self, mock_apply_change, mock_client):
+        from designsafe.apps.data.models.changes import FileChange
+        from designsafe.apps.data.tasks import apply_file_changes
+        mock_apply_change.side_effect = [1, Exception('error')]
+        FileChange.record(FileChange.CREATE, 'designsafe.storage.default', 'ds_user/a')
+        FileChange.record(FileChange.DELETE, 'designsafe.storage.default', 'ds_user/b')
+        FileChange.record(FileChange.CREATE, 'designsafe.storage.default', 'ds_user/c')
+
+        applied = apply_file_changes()
+
+        self.assertEqual(applied, 1)
+        self.assertEqual(
+            [(change.path, change.attempts) for change in FileChange.objects.all()],
+            [('ds_user/b', 1), ('ds_user/c', 0)])
+
+    def test_lock_is_not_released_once_taken_by_another_worker(self):
+        from designsafe.libs.common.locks import CacheLock
+        lock = CacheLock('designsafe.tests.lock', 60, 'worker-1')
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.renew())
+        # The lock expired and was taken by another worker.
+        cache.set('designsafe.tests.lock', 'worker-2', 60)
+        self.assertFalse(lock.renew())
+        lock.release()
+        self.assertEqual(cache.get('designsafe.tests.lock'), 'worker-2')
+        cache.delete('designsafe.tests.lock')
+
+
+class PermissionsIndexingTestCase(TestCase):
+    def _doc(self, path, name, fmt='folder'):
+        doc = mock.Mock(path=path, format=fmt)
+        doc.name = name
+        doc.meta.id = '{}/{}'.format(path, name)
+        return doc
+
+    @mock.patch('designsafe.apps.data.managers.indexer.connections')
+    @mock.patch('designsafe.apps.data.managers.indexer.streaming_bulk')
+    @mock.patch('designsafe.apps.data.managers.indexer.ESFileManager')
+    def test_inherited_permissions(self, mock_mgr_cls, mock_bulk, mock_connections):
+        from designsafe.apps.data.managers.indexer import AgaveIndexer
+        root = self._doc('ds_user', 'shared')
+        children = [self._doc('ds_user/shared', 'a'),
+                    self._doc('ds_user/shared/a', 'file.txt', 'raw'),
+                    self._doc('ds_user/shared', 'b.txt', 'raw')]
+        res = mock.MagicMock()
+        res.hits.total = 1
+        res.__getitem__.return_value = root
+        search = mock.Mock()
+        search.scan.return_value = children
+        mock_mgr = mock_mgr_cls.return_value
+        mock_mgr.get.return_value = (res, None)
+        mock_mgr.listing_recursive.return_value = (None, search)
+
+        def _bulk(client, actions, **kwargs):
+            mock_bulk.actions = list(actions)
+            return [(True, {'update': {}}) for _ in mock_bulk.actions]
+        mock_bulk.side_effect = _bulk
+        agave_client = mock.Mock()
+        agave_client.files.listPermissions.return_value = [
+            {'username': 'ds_user', 'recursive': True, '_links': {},
+             'permission': {'read': True, 'write': True, 'execute': True}}]
+
+        indexer = AgaveIndexer(agave_client=agave_client)
+        cnt = indexer.index_permissions('designsafe.storage.default',
+                                        'ds_user/shared', 'ds_user',
+                                        rate_limit=1000, inherit=True)
+
+        self.assertEqual(cnt, 4)
+        self.assertEqual(agave_client.files.listPermissions.call_count, 1)
+        self.assertTrue(all('_links' not in action['doc']['permissions'][0]
+                            for action in mock_bulk.actions))
+
+    @mock.patch('designsafe.apps.data.managers.indexer.connections')
+    @mock.patch('designsafe.apps.data.managers.indexer.streaming_bulk')
+    @mock.patch('designsafe.apps.data.managers.indexer.ESFileManager')
+    def test_direct_share_on_child_is_kept(self, mock_mgr_cls, mock_bulk,
+                                           mock_connections):
+        from designsafe.apps.data.managers.indexer import AgaveIndexer
+        root = self._doc('ds_user', 'shared')
+        child = self._doc('ds_user/shared', 'b.txt', 'raw')
+        res = mock.MagicMock()
+        res.hits.total = 1
+        res.__getitem__.return_value = root
+        search = mock.Mock()
+        search.scan.return_value = [child]
+        mock_mgr = mock_mgr_cls.return_value
+        mock_mgr.get.return_value = (res, None)
+        mock_mgr.listing_recursive.return_value = (None, search)
+
+        def _bulk(client, actions, **kwargs):
+            mock_bulk.actions = list(actions)
+            return [(True, {'update': {}}) for _ in mock_bulk.actions]
+        mock_bulk.side_effect = _bulk
+        owner = {'username': 'ds_user', 'recursive': True,
+                 'permission': {'read': True, 'write': True, 'execute': True}}
+        grantee = {'username': 'grantee', 'recursive': True,
+                   'permission': {'read': True, 'write': False, 'execute': False}}
+        agave_client = mock.Mock()
+        agave_client.files.listPermissions.side_effect = [[owner], [owner, grantee]]
+
+        indexer = AgaveIndexer(agave_client=agave_client)
+        indexer.index_permissions('designsafe.storage.default', 'ds_user/shared',
+                                  'ds_user', rate_limit=1000)
+
+        self.assertEqual(agave_client.files.listPermissions.call_count, 2)
+        pems = dict((action['_id'], action['doc']['permissions'])
+                    for action in mock_bulk.actions)
+        self.assertEqual([pem['username'] for pem in pems['ds_user/shared/b.txt']],
+                         ['ds_user', 'grantee'])
+
+
+class SharedRootTestCase(TestCase):
+    def _paths(self):
+        from designsafe.apps.data.models.shares import SharedRoot
+        return [root.path for root in SharedRoot.objects.filter(grantee='grantee')]
+
+    def test_record_share_keeps_top_most_path(self):
+        from designsafe.apps.data.models.shares import SharedRoot
+        system = 'designsafe.storage.default'
+        SharedRoot.record_share(system, 'ds_user/a/b', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/c', 'grantee', 'READ')
+        SharedRoot.record_share(system, '/ds_user/a/', 'grantee', 'READ_WRITE')
+        SharedRoot.record_share(system, 'ds_user/a/d', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/a', 'ds_user', 'ALL')
+        self.assertEqual(self._paths(), ['ds_user/a', 'ds_user/c'])
+
+        SharedRoot.record_share(system, 'ds_user/a', 'grantee', 'NONE')
+        self.assertEqual(self._paths(), ['ds_user/c'])
+
+    def test_rename_and_delete_update_roots(self):
+        from designsafe.apps.data.models.shares import SharedRoot
+        system = 'designsafe.storage.default'
+        SharedRoot.record_share(system, 'ds_user/a', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/b/c', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/ab', 'grantee', 'READ')
+
+        SharedRoot.move_path(system, 'ds_user/a', 'ds_user/renamed')
+        SharedRoot.move_path(system, 'ds_user/b', 'ds_user/d')
+        self.assertEqual(self._paths(), ['ds_user/ab', 'ds_user/d/c', 'ds_user/renamed'])
+
+        SharedRoot.delete_path(system, 'ds_user/d')
+        self.assertEqual(self._paths(), ['ds_user/ab', 'ds_user/renamed'])
+
+    def test_shared_paths_collapses_nested_roots(self):
+        from designsafe.apps.data.models.shares import SharedRoot
+        system = 'designsafe.storage.default'
+        SharedRoot.record_share(system, 'ds_user/a', 'WORLD', 'READ')
+        SharedRoot.record_share(system, 'ds_user/a/b', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/a-b', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/c', 'grantee', 'READ')
+        SharedRoot.record_share(system, 'ds_user/c', 'WORLD', 'READ')
+        SharedRoot.record_share(system, 'grantee/e', 'WORLD', 'READ')
+
+        self.assertEqual(SharedRoot.shared_paths(system, 'grantee'),
+                         ['ds_user/a', 'ds_user/a-b', 'ds_user/c'])
+        self.assertEqual(SharedRoot.shared_paths(system, 'grantee', offset=1, limit=1),
+                         ['ds_user/a-b'])
+
+
+class MetadataCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = mock.Mock(_token='token')
+        self.client.meta.listMetadata.return_value = [{'uuid': '1', 'name': 'designsafe.project'}]
+
+    def test_list_metadata_is_cached_until_invalidated(self):
+        from designsafe.apps.data.models.agave import cache as metadata_cache
+        query = {'name': 'designsafe.project', 'associationIds': '1'}
+        metas = metadata_cache.list_metadata(self.client, query)
+        metadata_cache.list_metadata(self.client, json.dumps(query))
+        self.assertEqual(metas[0].uuid, '1')
+        self.assertEqual(self.client.meta.listMetadata.call_count, 1)
+
+        metadata_cache.invalidate(uuid='2', name='designsafe.file')
+        metadata_cache.list_metadata(self.client, query)
+        self.assertEqual(self.client.meta.listMetadata.call_count, 1)
+
+        metadata_cache.invalidate(uuid='1', name='designsafe.project')
+        metadata_cache.list_metadata(self.client, query)
+        self.assertEqual(self.client.meta.listMetadata.call_count, 2)
+
+    def test_permission_save_invalidates_name_queries(self):
+        from designsafe.apps.data.models.agave import cache as metadata_cache
+        from designsafe.apps.data.models.agave.metadata import BaseMetadataPermissionResource
+        self.client.meta.getMetadata.return_value = {'uuid': '1', 'name': 'designsafe.project'}
+        self.client.meta.updateMetadataPermissions.return_value = {
+            'username': 'grantee', 'permission': {'read': True, 'write': True}}
+        query = {'name': 'designsafe.project'}
+        metadata_cache.list_metadata(self.client, query)
+
+        pem = BaseMetadataPermissionResource('1', self.client)
+        pem.username = 'grantee'
+        pem.permission_bit = 'ALL'
+        pem.save()
+
+        self.assertEqual(pem.metadata_name, 'designsafe.project')
+        metadata_cache.list_metadata(self.client, query)
+        self.assertEqual(self.client.meta.listMetadata.call_count, 2)
+
+    def test_request_memoization(self):
+        from designsafe.apps.data.models.agave import cache as metadata_cache
+        metadata_cache.start_request()
+        self.addCleanup(metadata_cache.end_request)
+        hits = metadata_cache.stats()['memo_hits']
+        metadata_cache.list_metadata(self.client, {'name': 'designsafe.project'})
+        metadata_cache.list_metadata(self.client, {'name': 'designsafe.project'})
+        self.assertEqual(metadata_cache.stats()['memo_hits'], hits + 1)
+        self.assertEqual(self.client.meta.listMetadata.call_count, 1)
+
+
+class PrefetchRelatedTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_prefetch_forward_relations_with_one_query(self):
+        from designsafe.apps.data.models.agave.base import Model as MetadataModel
+        from designsafe.apps.projects.models.agave.experimental import Experiment
+        client = mock.Mock(_token='token')
+        client.meta.listMetadata.return_value = [
+            {'uuid': 'prj-1', 'name': 'designsafe.project', 'value': {}},
+            {'uuid': 'prj-2', 'name': 'designsafe.project', 'value': {}}]
+        exps = [Experiment(uuid='exp-1', value={'project': ['prj-1']}),
+                Experiment(uuid='exp-2', value={'project': ['prj-2', 'prj-3']})]
+
+        MetadataModel.prefetch_related(client, exps, ['project'])
+
+        self.assertEqual(client.meta.listMetadata.call_count, 1)
+        self.assertEqual([p.uuid for p in exps[0].project(client)], ['prj-1'])
+        self.assertEqual([p.uuid for p in exps[1].project(client)], ['prj-2'])
+        self.assertEqual(client.meta.listMetadata.call_count, 1)
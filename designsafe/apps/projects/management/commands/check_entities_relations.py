@@ -4,7 +4,6 @@ import json
 import logging
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from requests.exceptions import HTTPError
 from designsafe.apps.projects.models.agave.base import Project
 from designsafe.apps.api.agave import get_service_account_client
 from designsafe.apps.data.models.agave.base import Model as MetadataModel
@@ -78,17 +77,21 @@ class Command(BaseCommand):
         ent.save(self.client)
 
     def _check_related_uuids(self, ent):
+        """Removes the related uuids which do not exist.
+
+        The related fields must have been resolved with
+        :meth:`~designsafe.apps.data.models.agave.base.Model.prefetch_related`.
+        """
         uuids = []
         for attrname, field in six.iteritems(ent._meta._related_fields):
             if attrname == 'files':
                 continue
 
             attr = getattr(ent, attrname)
+            found = set([obj.uuid for obj in attr(self.client)])
             for uuid in getattr(attr, 'uuids', []):
-                try:
-                    self.client.meta.getMetadata(uuid=uuid)
-                except HTTPError as e:
-                    self.stdout.write(e.response.text)
+                if uuid not in found:
+                    self.stdout.write('Related entity not found: %s' % uuid)
                     uuids.append(uuid)
             #self.stdout.write('uuids: %s' % uuids)
         if len(uuids):
@@ -103,9 +106,13 @@ class Command(BaseCommand):
         entities = self.client.meta.listMetadata(q=json.dumps(
             {'name': {'$in': rel_names}, 'associationIds': prj.uuid}))
         self.stdout.write('entities length: %d' % len(entities))
-        for entity in entities:
-            cls = lookup_model(entity)
-            ent = cls(**entity)
+        ents = [lookup_model(entity)(**entity) for entity in entities]
+        attrnames = set()
+        for ent in ents:
+            attrnames.update([attrname for attrname in ent._meta._related_fields
+                              if attrname != 'files'])
+        MetadataModel.prefetch_related(self.client, ents, attrnames)
+        for ent in ents:
             self.stdout.write('Entity: %s' % ent.uuid)
             self._check_related_uuids(ent)
             #self.stdout.write('%s: %s' % (attrname, fld.uuids))
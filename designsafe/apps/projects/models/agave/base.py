@@ -130,11 +130,13 @@ class Project(MetadataModel):
 
     def related_entities(self, offset=0, limit=100):
         from designsafe.apps.projects.models.utils import lookup_model
+        from designsafe.apps.data.models.agave import cache as metadata_cache
         relattrs = self._meta._reverse_fields
         rel_names = [getattr(self, attrname).related_obj_name for attrname in relattrs \
                          if getattr(self, attrname).related_obj_name != 'designsafe.file']
-        resp = self.manager().agave_client.meta.listMetadata(
-            q=json.dumps({'name': {'$in': rel_names}, 'associationIds': self.uuid}),
+        resp = metadata_cache.list_metadata(
+            self.manager().agave_client,
+            {'name': {'$in': rel_names}, 'associationIds': self.uuid},
             offset=offset,
             limit=limit)
         ents = [lookup_model(rsp)(**rsp) for rsp in resp]
@@ -11,3 +11,10 @@ def update_search_index():
     logger.info("Updating search index")
     if not settings.DEBUG:
         call_command("rebuild_index", interactive=False)
+
+@shared_task()
+def refresh_sitemaps():
+    """Refreshes the cached list of public projects of the sitemap"""
+    from designsafe.sitemaps import refresh_project_paths
+    paths = refresh_project_paths()
+    logger.info("Refreshed sitemap, %d public projects", len(paths))
@@ -2,10 +2,13 @@ from __future__ import absolute_import
 
 import os
 import json
+import time
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from designsafe.apps.api.notifications.models import Notification
+from django.core.cache import cache
+from django.conf import settings
+from designsafe.apps.api.notifications.models import Notification, JobEvent
 from django.db import transaction
 from agavepy.agave import AgaveException
 from celery import shared_task
@@ -13,6 +16,7 @@ from requests import ConnectionError, HTTPError
 import logging
 
 from designsafe.apps.api.tasks import reindex_agave
+from designsafe.libs.common.locks import CacheLock
 
 logger = logging.getLogger(__name__)
 
@@ -337,8 +341,76 @@ def handle_webhook_request(job):
     except AgaveException as e:
         logger.warning('Agave API error. Retrying...')
 
+JOB_EVENTS_LOCK = 'designsafe.apps.workspace.tasks.process_job_events'
+JOB_EVENTS_SCHEDULED = 'designsafe.apps.workspace.tasks.process_job_events:scheduled'
+
+def schedule_job_events():
+    """Schedules a run of :func:`process_job_events`.
+
+    Webhooks received within ``settings.JOB_EVENTS['flush_delay']``
+    seconds of each other are processed by the same run.
+    """
+    flush_delay = getattr(settings, 'JOB_EVENTS', {}).get('flush_delay', 2)
+    if cache.add(JOB_EVENTS_SCHEDULED, True, flush_delay + 60):
+        process_job_events.apply_async(countdown=flush_delay)
+
+@shared_task(bind=True)
+def process_job_events(self, batch_size=None):
+    """Notifies users of the recorded job status webhooks.
+
+    Events are read in batches in the order they were received and
+    coalesced per job: only the latest event of every job in a batch
+    is given to :func:`handle_webhook_request`. A cache lock makes sure
+    only one consumer runs at a time. The lock is renewed after every
+    batch and no new batch is read after
+    ``settings.JOB_EVENTS['time_budget']`` seconds, the remaining events
+    are processed by the next run.
+
+    :param int batch_size: number of events to read at a time.
+        Default ``settings.JOB_EVENTS['batch_size']``
+
+    :returns: count of events processed
+    :rtype: int
+    """
+    events_settings = getattr(settings, 'JOB_EVENTS', {})
+    batch_size = batch_size or events_settings.get('batch_size', 500)
+    lock_timeout = events_settings.get('lock_timeout', 60 * 10)
+    time_budget = events_settings.get('time_budget', 60 * 3)
+    cache.delete(JOB_EVENTS_SCHEDULED)
+    lock = CacheLock(JOB_EVENTS_LOCK, lock_timeout, self.request.id)
+    if not lock.acquire():
+        logger.debug('Job events are being processed by another worker')
+        return 0
+
+    processed = 0
+    deadline = time.time() + time_budget
+    try:
+        while time.time() < deadline and lock.renew():
+            events = list(JobEvent.objects.all()[:batch_size])
+            if not events:
+                break
+
+            latest = {}
+            for event in events:
+                latest[event.job_id] = event
+            for event in sorted(latest.values(), key=lambda e: e.pk):
+                try:
+                    handle_webhook_request(event.job)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Error processing job event: %s %s',
+                                     event.job_id, event.status)
+
+            JobEvent.objects.filter(pk__in=[e.pk for e in events]).delete()
+            processed += len(events)
+            logger.debug('Processed %d job events for %d jobs',
+                         len(events), len(latest))
+    finally:
+        lock.release()
+
+    return processed
+
 def index_job_outputs(user, job):
-    """Calls FileManager.indexer.index to index a job for a user.
+    """Calls FileManager.indexer.bulk_index to index a job for a user.
 
     Args:
         user: Django User model instance.
@@ -351,6 +423,6 @@ def index_job_outputs(user, job):
 
     from designsafe.apps.api.data.agave.filemanager import FileManager as AgaveFileManager
     mgr = AgaveFileManager(user)
-    mgr.indexer.index(system_id, archive_path, user.username,
-                      full_indexing = True, pems_indexing = True,
-                      index_full_path = True)
+    mgr.indexer.bulk_index(system_id, archive_path, user.username,
+                           full_indexing = True, pems_indexing = True,
+                           index_full_path = True)
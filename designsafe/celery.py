@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import logging
 import os
+from datetime import timedelta
 
 from celery import Celery
 from celery.schedules import crontab
@@ -26,6 +27,22 @@ app.conf.update(
         'update_user_storages': {
             'task': 'designsafe.apps.search.tasks.update_search_index',
             'schedule': crontab(minute="*/15"),
+        },
+        'apply_file_changes': {
+            'task': 'designsafe.apps.data.tasks.apply_file_changes',
+            'schedule': timedelta(
+                seconds=getattr(settings, 'FILE_CHANGES', {}).get('flush_interval', 30)),
+            'options': {'queue': 'indexing'},
+        },
+        'refresh_sitemaps': {
+            'task': 'designsafe.apps.search.tasks.refresh_sitemaps',
+            'schedule': timedelta(
+                seconds=getattr(settings, 'SITEMAPS', {}).get('refresh_interval', 60 * 60 * 6)),
+        },
+        'process_job_events': {
+            'task': 'designsafe.apps.workspace.tasks.process_job_events',
+            'schedule': timedelta(
+                seconds=getattr(settings, 'JOB_EVENTS', {}).get('flush_interval', 60)),
         }
     }
 )
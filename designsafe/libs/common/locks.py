@@ -0,0 +1,59 @@
+"""Locks shared by workers, kept in the cache."""
+import logging
+import uuid
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CacheLock(object):
+    """Lock held by a single worker at a time.
+
+    The lock expires after `timeout` seconds so a worker which dies does
+    not keep it. A worker holding the lock for longer must :meth:`renew`
+    it. Only the worker holding the lock releases it.
+
+    :param str key: cache key of the lock.
+    :param int timeout: number of seconds after which the lock expires.
+    :param str token: value identifying the holder, e.g. a task id.
+
+    .. rubric:: Example
+
+        >>> lock = CacheLock('designsafe.tasks.consumer', 60 * 10)
+        >>> if lock.acquire():
+        ...     try:
+        ...         do_work()
+        ...     finally:
+        ...         lock.release()
+    """
+    def __init__(self, key, timeout, token=None):
+        self.key = key
+        self.timeout = timeout
+        self.token = token or uuid.uuid4().hex
+
+    def acquire(self):
+        """Takes the lock if nobody holds it
+
+        :returns: `True` if the lock was taken.
+        """
+        return cache.add(self.key, self.token, self.timeout)
+
+    def owned(self):
+        """Checks the lock is still held by this holder"""
+        return cache.get(self.key) == self.token
+
+    def renew(self):
+        """Resets the expiration of the lock
+
+        :returns: `False` if the lock expired or was taken by another holder.
+        """
+        if not self.owned():
+            logger.warning('Lost lock %s', self.key)
+            return False
+        cache.set(self.key, self.token, self.timeout)
+        return True
+
+    def release(self):
+        """Releases the lock if it is still held by this holder"""
+        if self.owned():
+            cache.delete(self.key)
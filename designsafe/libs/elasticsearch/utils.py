@@ -0,0 +1,44 @@
+"""
+.. module: designsafe.libs.elasticsearch.utils
+   :synopsis: Helpers shared by the different ES doc types.
+"""
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import logging
+import os
+
+#pylint: disable=invalid-name
+logger = logging.getLogger(__name__)
+#pylint: enable=invalid-name
+
+def normalize_file_path(path, name=''):
+    """Normalizes a file path the way it is stored in the files index.
+
+    Leading and trailing slashes are removed and the root path is
+    represented as an empty string.
+
+    :param str path: parent path or full path of the file
+    :param str name: name of the file. Optional if ``path`` is a full path.
+
+    :returns: normalized full path
+    :rtype: str
+    """
+    full_path = os.path.join(path or '/', name or '')
+    return os.path.normpath('/' + full_path).strip('/')
+
+def file_uuid(system, path, name=''):
+    """Generates a deterministic document id for a file.
+
+    The id is a hash of the system id and the normalized full path
+    of the file. This way the same file always maps to the same document
+    and writes can be done without searching for the document first.
+
+    :param str system: system id
+    :param str path: parent path or full path of the file
+    :param str name: name of the file. Optional if ``path`` is a full path.
+
+    :returns: sha256 hex digest
+    :rtype: str
+    """
+    key = '{}/{}'.format(system, normalize_file_path(path, name))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
@@ -13,6 +13,7 @@ from django.core.exceptions import MiddlewareNotUsed
 from termsandconditions.middleware import (TermsAndConditionsRedirectMiddleware,
                                            is_path_protected)
 from termsandconditions.models import TermsAndConditions
+from designsafe.apps.data.models.agave import cache as metadata_cache
 
 logger = logging.getLogger(__name__)
 
@@ -103,3 +104,17 @@ class RequestProfilingMiddleware(object):
                 }
             json.dump(dets, flo, indent=2)
         return response
+
+
+class MetadataCacheMiddleware(object):
+    """Memoizes agave metadata lookups for the duration of a request.
+
+    See :mod:`designsafe.apps.data.models.agave.cache`.
+    """
+
+    def process_request(self, request):
+        metadata_cache.start_request()
+
+    def process_response(self, request, response):
+        metadata_cache.end_request()
+        return response
@@ -150,6 +150,7 @@ MIDDLEWARE_CLASSES = (
     'cms.middleware.language.LanguageCookieMiddleware',
     'impersonate.middleware.ImpersonateMiddleware',
     'designsafe.middleware.DesignSafeTermsMiddleware',
+    'designsafe.middleware.MetadataCacheMiddleware',
 )
 
 ROOT_URLCONF = 'designsafe.urls'
@@ -546,6 +547,40 @@ AGAVE_JWT_PUBKEY = os.environ.get('AGAVE_JWT_PUBKEY')
 AGAVE_JWT_ISSUER = os.environ.get('AGAVE_JWT_ISSUER')
 AGAVE_JWT_HEADER = os.environ.get('AGAVE_JWT_HEADER')
 AGAVE_JWT_USER_CLAIM_FIELD = os.environ.get('AGAVE_JWT_USER_CLAIM_FIELD')
+#
+# Agave filesystem walks: concurrent `files.list` calls and listing page size
+AGAVE_WALK_MAX_WORKERS = int(os.environ.get('AGAVE_WALK_MAX_WORKERS', 8))
+AGAVE_LISTING_PAGE_SIZE = int(os.environ.get('AGAVE_LISTING_PAGE_SIZE', 100))
+# Max number of `files.listPermissions` calls per second when indexing permissions
+AGAVE_PEMS_RATE_LIMIT = float(os.environ.get('AGAVE_PEMS_RATE_LIMIT', 20))
+# Agave clients: connections kept alive per host, retries of idempotent
+# requests and number of clients cached per process
+AGAVE_HTTP_POOL_SIZE = int(os.environ.get('AGAVE_HTTP_POOL_SIZE', 20))
+AGAVE_HTTP_MAX_RETRIES = int(os.environ.get('AGAVE_HTTP_MAX_RETRIES', 3))
+AGAVE_CLIENT_CACHE_SIZE = int(os.environ.get('AGAVE_CLIENT_CACHE_SIZE', 500))
+# Seconds to cache agave metadata lookups across requests
+AGAVE_METADATA_CACHE_TTL = int(os.environ.get('AGAVE_METADATA_CACHE_TTL', 60))
+# Max number of bytes of a file shown in text previews and seconds the
+# rendered previews are cached for
+TEXT_PREVIEW_MAX_SIZE = int(os.environ.get('TEXT_PREVIEW_MAX_SIZE', 512 * 1024))
+TEXT_PREVIEW_CACHE_TTL = int(os.environ.get('TEXT_PREVIEW_CACHE_TTL', 60 * 60 * 24))
+# Agave job webhooks are recorded and processed in batches
+JOB_EVENTS = {
+    # Max number of recorded job events read at a time.
+    'batch_size': 500,
+    # Number of seconds events are buffered after a webhook is received.
+    'flush_delay': 2,
+    # Number of seconds between runs of the job events consumer.
+    'flush_interval': 60,
+    # Number of seconds after which the consumer lock expires.
+    'lock_timeout': 60 * 10,
+    # Number of seconds after which a consumer stops reading new batches.
+    'time_budget': 60 * 3,
+}
+# Seconds the unread notifications count of a user is cached for. A
+# notification saved while the count is computed is counted twice until
+# the count expires, so keep it short.
+NOTIFICATIONS_UNREAD_CACHE_TTL = 60 * 5
 
 PROJECT_STORAGE_SYSTEM_TEMPLATE = {
     'id': 'project-{}',
@@ -572,6 +607,35 @@ PROJECT_STORAGE_SYSTEM_TEMPLATE = {
 }
 
 PUBLISHED_SYSTEM = 'designsafe.storage.published'
+# Copies of publication files to the published storage
+PUBLICATION_STAGING = {
+    # Number of files copied at a time.
+    'max_workers': 8,
+    # How files already staged are recognized: 'mtime' (size and
+    # modification time) or 'checksum'.
+    'verify': 'mtime',
+    # Number of seconds between progress reports.
+    'progress_interval': 60,
+}
+# Ingest of published projects into Fedora
+FEDORA_INGEST = {
+    'base_url': os.environ.get(
+        'FEDORA_BASE_URL',
+        'http://fedoraweb01.tacc.utexas.edu:8080/fcrepo/rest/publications_01'),
+    # Number of resources sent at a time.
+    'max_workers': 8,
+}
+
+SITEMAPS = {
+    # Seconds rendered sitemap pages are cached for.
+    'cache_timeout': 60 * 60,
+    # Seconds between refreshes of the public projects listed in the sitemap.
+    'refresh_interval': 60 * 60 * 6,
+    # Seconds the list of public projects is kept if it is not refreshed.
+    'projects_timeout': 60 * 60 * 24,
+    # Max number of urls per sitemap page.
+    'page_size': 5000,
+}
 
 # RECAPTCHA SETTINGS FOR LESS SPAMMO
 DJANGOCMS_FORMS_RECAPTCHA_PUBLIC_KEY = os.environ.get('DJANGOCMS_FORMS_RECAPTCHA_PUBLIC_KEY')
@@ -586,6 +650,16 @@ DESIGNSAFE_UPLOAD_PATH = '/corral-repl/tacc/NHERI/uploads'
 EZID_USER = os.environ.get('EZID_USER')
 EZID_PASS = os.environ.get('EZID_PASS')
 EZID_SHOULDER = os.environ.get('EZID_SHOULDER')
+# EZID requests made when a project is published
+DOI_RESERVATION = {
+    # Number of DOIs reserved or updated at a time.
+    'max_workers': 8,
+    # Number of times a failing EZID request is retried.
+    'max_retries': 3,
+    'retry_delay': 2,
+    # Number of seconds a reserved DOI is reused by retries.
+    'reservation_timeout': 60 * 60 * 24 * 30,
+}
 
 DESIGNSAFE_ENVIRONMENT = os.environ.get('DESIGNSAFE_ENVIRONMENT', 'dev').lower()
 if os.environ.get('PORTAL_PROFILE') == 'True':
@@ -91,3 +91,26 @@ ES_INDICES = {
     #                   'class': 'designsafe.apps.workspace.models.elasticsearch.IndexedJob'}]
     #}
 }
+
+ES_BULK_INDEXING = {
+    # Max number of actions sent to ES in a single bulk request.
+    'batch_size': 500,
+    # Max number of seconds actions are buffered before a bulk request is sent.
+    'flush_interval': 5,
+}
+
+FILE_CHANGES = {
+    # Max number of recorded file operations read at a time.
+    'batch_size': 200,
+    # Number of seconds between runs of the file changes consumer.
+    'flush_interval': 30,
+    # Number of times a failing file operation is retried before it is dropped.
+    'max_attempts': 5,
+    # Number of seconds after which the consumer lock expires.
+    'lock_timeout': 60 * 15,
+    # Number of seconds after which a consumer stops reading new batches.
+    'time_budget': 60 * 5,
+}
+
+# Number of seconds the sitewide search tab counts are cached for a query string.
+SEARCH_COUNTS_CACHE_TTL = 60
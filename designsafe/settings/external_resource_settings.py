@@ -26,3 +26,43 @@ GOOGLE_OAUTH2_STORAGE_MODEL = {
     'user_property': 'user_id',
     'credentials_property': 'credential'
 }
+
+###
+# Settings for chunked uploads to external resources
+#
+EXTERNAL_RESOURCES_UPLOADS = {
+    # Dropbox allows up to 150MB per request. Google Drive requires
+    # multiples of 256KB.
+    'chunk_size': int(os.environ.get('EXTERNAL_RESOURCES_UPLOAD_CHUNK_SIZE',
+                                     8 * 1024 * 1024)),
+    'max_retries': 5,
+    'retry_delay': 2,
+    # Seconds between progress messages.
+    'progress_interval': 30,
+    # Max number of times an upload session is resumed at the offset
+    # expected by the external resource.
+    'max_resumes': 5,
+    # Max number of seconds to wait for an upload session to be committed.
+    'commit_timeout': 60 * 10,
+}
+
+###
+# Settings for parallel folder transfers to and from external resources
+#
+EXTERNAL_RESOURCES_TRANSFERS = {
+    # Workers and max files started per second for every provider
+    'box': {'max_workers': 4, 'rate_limit': 10},
+    'dropbox': {'max_workers': 4, 'rate_limit': 10},
+    # Google Drive allows 10 requests per second per user
+    'googledrive': {'max_workers': 4, 'rate_limit': 5},
+    # Retries for every file
+    'max_retries': 3,
+    'retry_delay': 2,
+    # Seconds to keep the completed items of a transfer
+    'checkpoint_timeout': 60 * 60 * 24,
+}
+
+###
+# Seconds to cache the ids of Box hierarchical paths
+#
+BOX_PATH_CACHE_TTL = int(os.environ.get('BOX_PATH_CACHE_TTL', 60 * 10))
@@ -20,6 +20,13 @@ CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
 CELERY_ALWAYS_EAGER = True
 BROKER_BACKEND = 'memory'
 
+# In-process cache, cleared by the tests which depend on it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 # No token refreshes during testing
 MIDDLEWARE_CLASSES = [c for c in MIDDLEWARE_CLASSES if c !=
                       'designsafe.apps.auth.middleware.AgaveTokenRefreshMiddleware']
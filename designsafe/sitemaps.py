@@ -21,8 +21,15 @@ New sitemaps must be added to ``designsafe.urls`` sitemap dictionary
 
 **Public Projects**
 
-Adding Public Projects requires the use of ``PublicElasticFileManager`` to 
-access items within ``nees.public`` on Agave.
+Public Projects are read from the ``nees.public`` documents of the public
+index with a single scroll. The list is cached and refreshed periodically by
+:func:`designsafe.apps.search.tasks.refresh_sitemaps`.
+
+**Sitemap Index**
+
+``/sitemap.xml`` is a sitemap index, every section is served from
+``/sitemap-<section>.xml`` and split in pages of
+``settings.SITEMAPS['page_size']`` urls.
 
 **Priority and Changefreq preferences**
 
@@ -32,10 +39,13 @@ Adjusting these settings for the CMS is handled in ``designsafe.urls``
  *  Priority - lets crawlers know which DesignSafe-CI pages are most important
 """
 
+from django.conf import settings
 from django.contrib import sitemaps
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.urls import reverse
-from designsafe.apps.api.agave.filemanager.public_search_index import PublicElasticFileManager as pefm
+from elasticsearch_dsl.query import Q
+from designsafe.apps.api.agave.filemanager.public_search_index import PublicObjectIndexed
 
 # imported urlpatterns from apps
 import urls     # from designsafe import urls not working?
@@ -144,32 +154,42 @@ class DynamicViewSitemap(sitemaps.Sitemap):
     def location(self, item):
         return reverse(item)
 
-# public projects - pulling in urls from agave
+PROJECT_PATHS_CACHE_KEY = 'designsafe.sitemaps.project_paths'
+
+def project_paths():
+    """Lists the paths of the public projects in a single scroll"""
+    search = PublicObjectIndexed.search()
+    search = search.query(Q('bool',
+                            must=[Q({'term': {'path._exact': '/'}}),
+                                  Q({'term': {'systemId': 'nees.public'}})]))
+    search = search.source(['project', 'systemId'])
+    search = search.sort('project._exact')
+    search = search.params(preserve_order=True)
+
+    root = reverse('designsafe_data:data_depot')
+    return ['{root}public/{system}/{project}'.format(root=root,
+                                                     system=doc.systemId,
+                                                     project=doc.project)
+            for doc in search.scan()]
+
+def refresh_project_paths():
+    """Caches the paths of the public projects"""
+    paths = project_paths()
+    cache.set(PROJECT_PATHS_CACHE_KEY, paths,
+              getattr(settings, 'SITEMAPS', {}).get('projects_timeout', 60 * 60 * 24))
+    return paths
+
+# public projects - pulling in urls from the public index
 class ProjectSitemap(sitemaps.Sitemap):
     priority = 0.6
     changefreq = 'weekly'
+    limit = getattr(settings, 'SITEMAPS', {}).get('page_size', 5000)
 
     def items(self):
-
-        projPath = []
-
-        # pefm - PublicElasticFileManager to grab public projects
-        count = 0
-        while True:
-            count += 200
-            projects = pefm().listing('nees.public', '/', 0, count).to_dict()
-            if len(projects['children']) < count:
-                break
-
-        for proj in projects['children']:
-            subpath = {
-                'root' : reverse('designsafe_data:data_depot'),
-                'project' : proj['project'],
-                'system' : proj['system']
-            }
-            projPath.append('{root}public/{system}/{project}'.format(**subpath))
-
-        return projPath
+        paths = cache.get(PROJECT_PATHS_CACHE_KEY)
+        if paths is None:
+            paths = refresh_project_paths()
+        return paths
 
     def location(self, item):
         return item
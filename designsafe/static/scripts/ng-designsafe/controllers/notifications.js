@@ -53,6 +53,8 @@
         'process': function notifyProcessor(msg){
           if (angular.element('#notification-container').hasClass('open')) {
             $scope.list();
+          } else if (angular.isNumber(msg.unread)) {
+            $scope.data.unread = msg.unread;
           } else {
             $scope.data.unread++;
           }
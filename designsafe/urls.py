@@ -35,7 +35,8 @@ from django.contrib.auth.views import logout as des_logout
 from designsafe.views import project_version as des_version
 
 # sitemap - classes must be imported and added to sitemap dictionary
-from django.contrib.sitemaps.views import sitemap
+from django.contrib.sitemaps.views import sitemap, index as sitemap_index
+from django.views.decorators.cache import cache_page
 from cms.sitemaps import CMSSitemap
 from designsafe.sitemaps import StaticViewSitemap, DynamicViewSitemap, HomeSitemap, ProjectSitemap, SubSitemap
 from designsafe import views
@@ -43,6 +44,7 @@ from designsafe import views
 # cms preferences
 CMSSitemap.priority = 0.7
 CMSSitemap.changefreq = 'weekly'
+sitemap_cache_timeout = getattr(settings, 'SITEMAPS', {}).get('cache_timeout', 60 * 60)
 
 sitemaps = {
     'home': HomeSitemap,
@@ -59,7 +61,10 @@ urlpatterns = [
     url(r'^admin/impersonate/', include('impersonate.urls')),
 
     # sitemap
-    url(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    url(r'^sitemap\.xml$', cache_page(sitemap_cache_timeout)(sitemap_index),
+        {'sitemaps': sitemaps}),
+    url(r'^sitemap-(?P<section>.+)\.xml$', cache_page(sitemap_cache_timeout)(sitemap),
+        {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
 
     # terms-and-conditions
     url(r'^terms/', include('termsandconditions.urls')),